@@ -0,0 +1,157 @@
+"""Second derivative and curvature images for finding band dispersions, see Zhang et al., Rev. Sci. Instrum. 83,
+043712 (2012).
+
+Smoothing and differentiation are done together as one multiplication in Fourier space, by the spectrum of a
+Gaussian times ``(2*pi*i*f)**order`` along each axis. Spectra are cached per shape and parameters, and a stack of
+images (e.g. every slice of a cube) is transformed in chunks spread over a thread pool, since scipy.fft releases the
+GIL.
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft
+
+from .Parallel import map_chunks
+
+
+@lru_cache(maxsize=64)
+def _axis_spectrum(n: int, sigma: float, order: int, delta: float, real: bool) -> np.ndarray:
+    f = fft.rfftfreq(n) if real else fft.fftfreq(n)  # cycles per element
+    spectrum = np.exp(-2*(np.pi*sigma*f)**2)
+    if order:
+        spectrum = spectrum*(2j*np.pi*f/delta)**order
+    return spectrum
+
+
+@lru_cache(maxsize=32)
+def spectrum(shape, sigma, order, delta) -> np.ndarray:
+    """The Fourier multiplier smoothing with Gaussians of standard deviations ``sigma`` (in elements) and
+    differentiating ``order`` times along each axis, for a real transform over arrays of ``shape``. All arguments
+    are tuples with one entry per transformed axis."""
+    out = 1
+    for a, n in enumerate(shape):
+        s = _axis_spectrum(n, sigma[a], order[a], delta[a], a == len(shape) - 1)
+        out = out*s.reshape((-1,) + (1,)*(len(shape) - a - 1))
+    return out
+
+
+def smooth_derivatives(mat: np.ndarray, axes, sigma, delta, orders, workers: int = None) -> dict:
+    """Smoothed derivatives of ``mat`` over one or two ``axes``, for every combination in ``orders``.
+
+    The axes are padded by reflection to limit wrap-around at the edges, and transformed once. Every other axis is
+    a batch axis, split into chunks processed in ``workers`` threads. Non-finite elements, e.g. masked or outside of
+    the data, are filled by normalized convolution (the smoothed data over the smoothed weights of the finite
+    elements, or the image mean far from any) before transforming, and are NaN in the results.
+
+    :param axes: The axes to smooth and differentiate along
+    :param sigma: Gaussian standard deviation in elements for each of ``axes``
+    :param delta: Grid spacing of each of ``axes``, so derivatives are in units of the coordinates
+    :param orders: Sequence of tuples, each giving the derivative order along each of ``axes``
+    :return: Dict mapping each tuple of ``orders`` to a float array shaped like ``mat``
+    """
+    axes = [a % mat.ndim for a in axes]
+    sigma = tuple(float(s) for s in np.broadcast_to(sigma, (len(axes),)))
+    delta = tuple(float(d) for d in delta)
+    orders = [tuple(o) for o in orders]
+    dtype = np.result_type(mat.dtype, np.float32)
+    moved = np.moveaxis(np.asarray(mat), axes, range(mat.ndim - len(axes), mat.ndim))
+    batch_shape = moved.shape[:mat.ndim - len(axes)]
+    image_shape = moved.shape[mat.ndim - len(axes):]
+    stack = moved.reshape((-1,) + image_shape)
+    pad = [min(int(np.ceil(4*s)) + 2, n - 1) for s, n in zip(sigma, image_shape)]
+    fft_shape = tuple(fft.next_fast_len(n + 2*p, real=True) for n, p in zip(image_shape, pad))
+    complex_dtype = np.result_type(dtype, np.complex64)
+    spectra = {o: spectrum(fft_shape, sigma, o, delta).astype(complex_dtype, copy=False) for o in orders}
+    smoothing = spectrum(fft_shape, sigma, (0,)*len(axes), delta).astype(complex_dtype, copy=False)
+    out = {o: np.empty(stack.shape, dtype=dtype) for o in orders}
+    fft_axes = tuple(range(1, len(axes) + 1))
+    crop = (slice(None),) + tuple(slice(p, p + n) for p, n in zip(pad, image_shape))
+
+    def transform(block):
+        block = np.pad(block, [(0, 0)] + [(p, p) for p in pad], mode='reflect')
+        return fft.rfftn(block, s=fft_shape, axes=fft_axes)
+
+    def smoothed(block):
+        return fft.irfftn(transform(block)*smoothing, s=fft_shape, axes=fft_axes)[crop]
+
+    def work(chunk):
+        block = stack[chunk].astype(dtype, copy=False)
+        finite = np.isfinite(block)
+        holes = not finite.all()
+        if holes:
+            weight = finite.astype(dtype)
+            block = np.where(finite, block, 0).astype(dtype, copy=False)
+            count = weight.sum(axis=fft_axes, keepdims=True)
+            mean = block.sum(axis=fft_axes, keepdims=True)/np.maximum(count, 1)
+            norm = smoothed(weight)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                local = np.where(norm > 1e-3, smoothed(block)/norm, mean)
+            block = np.where(finite, block, local)
+        transformed = transform(block)
+        product = np.empty_like(transformed)
+        for o in orders:
+            np.multiply(transformed, spectra[o], out=product)
+            result = fft.irfftn(product, s=fft_shape, axes=fft_axes)[crop]
+            out[o][chunk] = np.where(finite, result, np.nan) if holes else result
+
+    # chunks of a few megabytes keep the transforms in cache
+    n = len(stack)
+    step = max(1, 2**19//int(np.prod(fft_shape)))
+    chunks = [slice(lo, min(lo + step, n)) for lo in range(0, n, step)]
+    map_chunks(work, chunks, workers)
+    return {o: np.moveaxis(v.reshape(batch_shape + image_shape), range(mat.ndim - len(axes), mat.ndim), axes)
+            for o, v in out.items()}
+
+
+def _image_max(values: np.ndarray, axes) -> np.ndarray:
+    """The maximum over ``axes`` of every image, skipping NaNs, and zero for images without finite values"""
+    return np.max(np.where(np.isnan(values), 0, values), axis=tuple(axes), keepdims=True)
+
+
+def second_derivative(mat: np.ndarray, axis: int, delta, sigma=1.0, smooth_axis: int = None,
+                      smooth_sigma: float = None, workers: int = None) -> np.ndarray:
+    """Second derivative of ``mat`` along ``axis`` after Gaussian smoothing of ``sigma`` elements.
+
+    :param delta: Grid spacing of every axis of ``mat``
+    :param smooth_axis: Another axis to smooth along, by ``smooth_sigma`` elements (defaults to ``sigma``)
+    """
+    axes, sigmas, order = [axis], [sigma], [2]
+    if smooth_axis is not None:
+        axes.append(smooth_axis)
+        sigmas.append(sigma if smooth_sigma is None else smooth_sigma)
+        order.append(0)
+    return smooth_derivatives(mat, axes, sigmas, [delta[a] for a in axes], [tuple(order)], workers)[tuple(order)]
+
+
+def curvature(mat: np.ndarray, axes, a0: float = 1.0, sigma=1.0, weight: float = 1.0,
+              workers: int = None) -> np.ndarray:
+    """The curvature of ``mat`` along one axis, or the 2D curvature over two axes.
+
+    Derivatives are taken per element, so the result does not depend on the units of the axes. Along one axis the
+    curvature is ``f''/(C + f'**2)**1.5``; over two it is the curvature of Zhang et al. with ``Cx = 1/C`` and
+    ``Cy = weight/C``. In both cases ``C = a0*max(f'**2)``, so smaller ``a0`` sharpens the features. The maximum is
+    taken over every image (or profile) separately, so each image of a stack comes out as if computed alone. Like
+    the second derivative, the curvature is negative along peaks.
+
+    :param axes: One axis, or a pair of axes
+    :param a0: Free parameter scaling the regularization ``C``
+    :param sigma: Gaussian smoothing in elements, one value or one per axis
+    :param weight: Relative weight of the second axis for 2D curvature
+    """
+    axes = [axes] if np.ndim(axes) == 0 else list(axes)
+    unit = [1.0]*len(axes)
+    if len(axes) == 1:
+        d = smooth_derivatives(mat, axes, sigma, unit, [(1,), (2,)], workers)
+        fx, fxx = d[(1,)], d[(2,)]
+        c = a0*_image_max(fx**2, axes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return fxx/(c + fx**2)**1.5
+    if len(axes) != 2:
+        raise ValueError("Curvature is defined along one axis or over two axes")
+    d = smooth_derivatives(mat, axes, sigma, unit, [(1, 0), (0, 1), (2, 0), (0, 2), (1, 1)], workers)
+    fx, fy, fxx, fyy, fxy = d[(1, 0)], d[(0, 1)], d[(2, 0)], d[(0, 2)], d[(1, 1)]
+    scale = a0*np.maximum(_image_max(fx**2, axes), _image_max(fy**2, axes))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cx, cy = 1/scale, weight/scale
+        num = (1 + cx*fx**2)*cy*fyy - 2*cx*cy*fx*fy*fxy + (1 + cy*fy**2)*cx*fxx
+        return num/(1 + cx*fx**2 + cy*fy**2)**1.5
@@ -0,0 +1,334 @@
+import itertools
+import threading
+from collections.abc import Iterable
+from typing import Union
+
+import numpy as np
+
+from .DataMatrix import RegularDataArray
+from .MemoryBudget import budget
+from .Profiler import UpdateProfiler
+
+
+def bin_slice(data: RegularDataArray, i: int, pos: float, index: int, binwidth: float) -> slice:
+    """The index slice averaged over along axis ``i`` for a cursor at ``pos`` (index ``index``) with ``binwidth``.
+    A bin width no larger than the axis delta never bins, and selects the single element at ``index``.
+    """
+    if binwidth > data.delta[i]:
+        lo = min(max(pos - binwidth/2, data.coord_min[i]), data.coord_max[i])
+        hi = min(max(pos + binwidth/2, data.coord_min[i]), data.coord_max[i])
+        mn = int(np.ceil(data.scale_to_index(i, lo)))
+        mx = int(np.floor(data.scale_to_index(i, hi)))
+        return slice(mn, mx + 1)
+    else:
+        return slice(int(index), int(index) + 1)
+
+
+def bin_bounds(data: RegularDataArray, axes, pos: np.ndarray, binwidth: np.ndarray):
+    """Vectorized :func:`bin_slice` for many cursor positions.
+
+    :param axes: The axes the positions refer to
+    :param pos: (N, len(axes)) array of positions, clamped to the data range like :meth:`CutEngine.set_pos`
+    :param binwidth: Bin widths broadcastable to ``pos``
+    :return: (lo, hi) integer arrays of shape (N, len(axes)) so that axis ``axes[a]`` of cut ``n`` averages
+        over ``lo[n, a]:hi[n, a]``
+    """
+    axes = list(axes)
+    cmin, cmax, delta = data.coord_min[axes], data.coord_max[axes], data.delta[axes]
+    pos = np.clip(pos, cmin, cmax)
+    binwidth = np.broadcast_to(np.clip(binwidth, 0, cmax - cmin), pos.shape)
+
+    def to_index(coords):
+        if data.is_regular():
+            return (coords - cmin)/delta
+        return np.stack([data.scale_to_indices(ax, coords[:, a]) for a, ax in enumerate(axes)], axis=1)
+
+    index = np.round(to_index(pos)).astype(int)
+    with np.errstate(invalid='ignore'):
+        mn = np.ceil(to_index(np.clip(pos - binwidth/2, cmin, cmax))).astype(int)
+        mx = np.floor(to_index(np.clip(pos + binwidth/2, cmin, cmax))).astype(int)
+    binned = binwidth > delta
+    return np.where(binned, mn, index), np.where(binned, mx + 1, index + 1)
+
+
+def _prefix_table(arr: np.ndarray, axes) -> np.ndarray:
+    """Prefix sums of ``arr`` along ``axes``, zero padded at the start of each of those axes"""
+    out = np.zeros([n + 1 if ax in axes else n for ax, n in enumerate(arr.shape)])
+    view = out[tuple(slice(1, None) if ax in axes else slice(None) for ax in range(arr.ndim))]
+    view[...] = arr
+    for ax in axes:
+        np.cumsum(view, axis=ax, out=view)
+    return out
+
+
+def _box_sums(table: np.ndarray, comp, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Sums over the boxes ``lo:hi`` along the axes ``comp`` of the array whose prefix table is ``table``, by
+    inclusion-exclusion over the 2**len(comp) corners. Axes of ``table`` with length 1 are broadcast axes: they
+    are not indexed and contribute the box length as a factor instead.
+
+    :return: Array of shape (N, *remaining axes of table)
+    """
+    t = np.moveaxis(table, comp, range(len(comp)))
+    indexed = [a for a in range(len(comp)) if t.shape[a] > 1]
+    zeros = np.zeros(len(lo), dtype=int)
+    total = 0
+    for corner in itertools.product((False, True), repeat=len(indexed)):
+        idx = [zeros]*len(comp)
+        for a, upper in zip(indexed, corner):
+            idx[a] = hi[:, a] if upper else lo[:, a]
+        sign = -1 if (len(corner) - sum(corner)) % 2 else 1
+        with np.errstate(invalid='ignore'):  # inf - inf, for infinite data
+            total = total + sign*t[tuple(idx)]
+    broadcast = [a for a in range(len(comp)) if a not in indexed]
+    if broadcast:
+        factor = np.prod(hi[:, broadcast] - lo[:, broadcast], axis=1)
+        total = total*factor.reshape((-1,) + (1,)*(total.ndim - 1))
+    return total
+
+
+def prefix_tables(data: RegularDataArray, comp):
+    """The prefix-sum tables :func:`batch_cuts` averages over the axes ``comp`` with, computed once per data and
+    axes and kept in the memory budget under ``'prefix_sum'`` and ``'mask_prefix_sum'``.
+
+    :return: (total, weight, mask_table): the prefix sums of the data with NaNs and masked elements zeroed, those of
+        the weights when the data has NaNs (else None), and those of the un-broadcast mask when it has a mask and no
+        NaNs (else None)
+    """
+    comp = tuple(comp)
+    mask = data.mask
+
+    def tables():
+        dat = np.asarray(data.values)
+        weight = None
+        if data.has_nan:
+            weight = ~np.isnan(dat)
+            dat = np.where(weight, dat, 0)
+            if mask is not None:
+                weight = weight*mask
+        if mask is not None:
+            dat = dat*mask
+        return _prefix_table(dat, comp), None if weight is None else _prefix_table(weight, comp)
+
+    total, weight = budget.get_or_compute(data, 'prefix_sum', comp, tables)
+    mask_table = None
+    if weight is None and mask is not None:
+        mask_table = budget.get_or_compute(data, 'mask_prefix_sum', comp, lambda: _prefix_table(
+            mask, [a for a in comp if mask.shape[a] > 1]))
+    return total, weight, mask_table
+
+
+def batch_cuts(data: RegularDataArray, axis, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Mean of ``data`` over the boxes ``lo:hi`` along every axis not in ``axis``, for many boxes at once.
+
+    Boxes of single elements are gathered directly. Otherwise the sums come from prefix-sum tables, which are
+    cached in the memory budget so that further batches over the same axes cost only the gathers. NaNs and the
+    data mask are skipped like in :meth:`RegularDataArray.mean`, and the mask's own prefix sums are taken over the
+    un-broadcast mask.
+
+    :param axis: Sorted list of the axes that are kept
+    :param lo: (N, ndim - len(axis)) first index of each box along the remaining axes, in order
+    :param hi: Same shape as ``lo``, one past the last index
+    :return: Array of shape (N, *[data.shape[a] for a in axis])
+    """
+    comp = tuple(a for a in range(data.ndim) if a not in axis)
+    mask = data.mask
+    if not isinstance(data.values, np.ndarray):
+        return _slab_means(data, comp, lo, hi)
+    if np.all(hi - lo == 1):
+        values = np.moveaxis(np.asarray(data.values), comp, range(len(comp)))[tuple(lo.T)].astype(float)
+        if mask is not None:
+            m = np.moveaxis(mask, comp, range(len(comp)))
+            m = m[tuple(lo[:, a] if m.shape[a] > 1 else 0 for a in range(len(comp)))]
+            values[np.broadcast_to(m == 0, values.shape)] = np.nan
+        return values
+
+    total, weight, mask_table = prefix_tables(data, comp)
+    sums = _box_sums(total, comp, lo, hi)
+    if weight is not None:
+        norm = _box_sums(weight, comp, lo, hi)
+    elif mask_table is not None:
+        norm = _box_sums(mask_table, comp, lo, hi)
+    else:
+        norm = np.prod(hi - lo, axis=1).reshape((-1,) + (1,)*(sums.ndim - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums/norm
+
+
+def _slab_means(data: RegularDataArray, comp, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """:func:`batch_cuts` for lazy data, which is read by slicing so that only the binned slabs are loaded or
+    computed. Boxes with the same range along the first of ``comp`` share one slab, read once over the union of
+    their ranges along the other axes, and are summed from its prefix tables all at once."""
+    shape = tuple(n for a, n in enumerate(data.shape) if a not in comp)
+    out = np.empty((len(lo),) + shape)
+    if not len(lo):
+        return out
+    slabs, group = np.unique(np.stack([lo[:, 0], hi[:, 0]], axis=1), axis=0, return_inverse=True)
+    for g in range(len(slabs)):
+        rows = np.flatnonzero(group.ravel() == g)
+        start, stop = lo[rows].min(axis=0), hi[rows].max(axis=0)
+        key = [slice(None)]*data.ndim
+        for a, l, h in zip(comp, start, stop):
+            key[a] = slice(int(l), int(h))
+        block = np.asarray(data.values[tuple(key)], dtype=float)
+        # NaNs and masked elements are skipped, like in RegularDataArray.mean
+        weight = ~np.isnan(block)
+        if data.mask is not None:
+            weight = weight*data.mask[tuple(k if n > 1 else slice(None) for k, n in zip(key, data.mask.shape))]
+        weight = np.broadcast_to(weight, block.shape)
+        sums = _box_sums(_prefix_table(np.where(weight != 0, block, 0)*weight, comp), comp, lo[rows] - start,
+                         hi[rows] - start)
+        norm = _box_sums(_prefix_table(weight, comp), comp, lo[rows] - start, hi[rows] - start)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[rows] = sums/norm
+    return out
+
+
+class CutEngine:
+    """The cursor state and binning semantics of ImageTool, without Qt.
+
+    Holds the index, position and bin width of the cursor along every axis in NumPy arrays and computes the same
+    line and image cuts as the GUI, which delegates to this class. The engine is thread-safe and picklable, so it
+    can be shipped to worker processes::
+
+        engine = CutEngine(data)
+        engine.set_pos(2, 21.3)
+        engine.set_binwidth(2, 0.05)
+        edc = engine.get_cut(2)
+    """
+
+    def __init__(self, data: RegularDataArray):
+        self._lock = threading.RLock()
+        self.profiler = UpdateProfiler()
+        self.reset(data)
+
+    def __repr__(self):
+        return f"CutEngine[index={list(self.index)}, pos={list(self.pos)}, binwidth={list(self.binwidth)}]"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['profiler']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self.profiler = UpdateProfiler()
+
+    def reset(self, data: RegularDataArray = None):
+        """Move the cursor to the first element of every axis without binning, optionally for new data"""
+        with self._lock:
+            if data is not None:
+                self.data = data
+            self.index = np.zeros(self.data.ndim, dtype=int)
+            self.pos = np.array(self.data.coord_min, dtype=float)
+            self.binwidth = np.array(self.data.delta, dtype=float)
+
+    def update_data(self, data: RegularDataArray):
+        """Replace the data with a grown, scrolled or modified version of the same dimensions, keeping the cursor
+        position and bin widths in coordinates as far as the new grid allows"""
+        with self._lock:
+            pos, binwidth = self.pos.copy(), self.binwidth.copy()
+            self.data = data
+            for i in range(data.ndim):
+                self.set_binwidth(i, binwidth[i])
+                self.set_pos(i, pos[i])
+
+    def state(self):
+        """A consistent copy of (pos, index, binwidth)"""
+        with self._lock:
+            return self.pos.copy(), self.index.copy(), self.binwidth.copy()
+
+    def set_pos(self, i, newpos):
+        with self._lock:
+            newpos = min(max(float(newpos), self.data.coord_min[i]), self.data.coord_max[i])
+            self.pos[i] = newpos
+            self.index[i] = round(self.data.scale_to_index(i, newpos))
+
+    def set_index(self, i, newindex):
+        with self._lock:
+            newindex = min(max(round(newindex), 0), self.data.shape[i] - 1)
+            self.index[i] = newindex
+            self.pos[i] = self.data.index_to_scale(i, newindex)
+
+    def set_binwidth(self, i, newwidth):
+        with self._lock:
+            self.binwidth[i] = min(max(float(newwidth), 0), self.data.coord_max[i] - self.data.coord_min[i])
+
+    def set_binwidth_i(self, i, newindex):
+        newindex = min(max(0, round(newindex)), self.data.shape[i] - 1)
+        self.set_binwidth(i, newindex*self.data.delta[i])
+
+    def get_index_slice(self, i):
+        """Using the known binwidth and bin positions, calculate a slice in index space
+        Note: if the binwidth <= delta (or the bin index is 1), there will never be any binning
+        """
+        with self._lock:
+            return bin_slice(self.data, i, self.pos[i], self.index[i], self.binwidth[i])
+
+    def get_slice(self):
+        with self._lock:
+            return tuple(self.get_index_slice(i) for i in range(self.data.ndim))
+
+    def get_cut(self, axis: Union[int, Iterable]):
+        """Average the data over the bins of every axis not in ``axis``.
+
+        :param axis: The axis of a line cut, or the pair of axes of an image cut
+        """
+        if not isinstance(axis, Iterable):
+            axis = [axis]
+        else:
+            axis = list(axis)
+        with self._lock:
+            data = self.data
+            selection = tuple(slice(None) if i in axis else self.get_index_slice(i) for i in range(data.ndim))
+        axis_cmpl = tuple(filter(lambda x: x not in axis, range(data.ndim)))
+        with self.profiler.stage('isel'):
+            cut = data.isel(*selection)
+        with self.profiler.stage('mean'):
+            cut = cut.mean(axis_cmpl)
+        with self.profiler.stage('squeeze'):
+            return cut.squeeze()
+
+    def get_cuts(self, axis: Union[int, Iterable], positions, binwidths=None) -> RegularDataArray:
+        """Compute the cuts along ``axis`` for many cursor positions at once, without moving the cursor.
+
+        Each cut is what :meth:`get_cut` returns with the cursor at that position, and the results are stacked
+        along a new leading ``cut`` axis. The batch is computed in one vectorized pass (see :func:`batch_cuts`).
+
+        :param axis: The axis of a line cut, or the pair of axes of an image cut
+        :param positions: (N, ndim) cursor positions, where the entries along ``axis`` are ignored, or
+            (N, k) positions along the k axes not in ``axis``. For line cuts of 2D data, shape (N,) also works.
+        :param binwidths: Bin widths in the same layout as a single row of ``positions``, or one row per cut.
+            Defaults to the current bin widths of the cursor.
+        :return: RegularDataArray with dims ``('cut', *dims of axis)``
+        """
+        axis = sorted([axis] if not isinstance(axis, Iterable) else axis)
+        data = self.data
+        comp = [a for a in range(data.ndim) if a not in axis]
+        positions = np.asarray(positions, dtype=float)
+        if positions.ndim == 1 and len(comp) == 1:
+            positions = positions[:, None]
+        positions = self._select_axes(positions, comp, 'positions')
+        if binwidths is None:
+            with self._lock:
+                binwidths = self.binwidth[comp]
+        else:
+            binwidths = np.asarray(binwidths, dtype=float)
+            if binwidths.ndim == 1 and len(comp) == 1 and len(binwidths) == len(positions) != data.ndim:
+                binwidths = binwidths[:, None]
+            binwidths = self._select_axes(binwidths, comp, 'binwidths')
+        lo, hi = bin_bounds(data, comp, positions, binwidths)
+        values = batch_cuts(data, axis, lo, hi)
+        return RegularDataArray(values, delta=[1] + [data.delta[a] for a in axis],
+                                coord_min=[0] + [data.coord_min[a] for a in axis],
+                                dims=['cut'] + [data.dims[a] for a in axis], name=data.name,
+                                coords=[None] + [data.coords[a] for a in axis])
+
+    def _select_axes(self, arr, comp, label):
+        """Reduce the last dimension of ``arr`` from all axes to the axes in ``comp``"""
+        if arr.shape[-1] == self.data.ndim:
+            arr = arr[..., comp]
+        elif arr.shape[-1] != len(comp):
+            raise ValueError(f"{label} should have {self.data.ndim} or {len(comp)} columns, got shape {arr.shape}")
+        return arr
@@ -2,11 +2,22 @@ import numpy as np
 from collections.abc import Iterable
 from scipy.interpolate import RegularGridInterpolator
 
+from .MemoryBudget import budget
+from .LazyArray import LazyArray, IndexedArray, NpyStack, npy_files
+from . import FileFormat
+from .Resample import resample
+from . import Curvature
+
 try:
     import xarray as xr
 except ImportError:
     xr = None
 
+try:
+    import dask.array as dask_array
+except ImportError:
+    dask_array = None
+
 try:
     import matplotlib.pyplot as plt
 except ImportError:
@@ -19,25 +30,41 @@ class RegularDataArray(object):
     defines properties relevant to the regular grid
     """
 
-    def __init__(self, dat, delta=None, coord_min=None, dims=None, name='Unnamed'):
+    def __init__(self, dat, delta=None, coord_min=None, dims=None, name='Unnamed', mask=None, copy=True,
+                 coords=None):
         """Create an instance of a RegularDataArray from an existing array.
 
         ``delta``, ``coord_min``, and ``dims`` are ordered according to row-major order. For example, given 2D matrix
         ``img`` with ``dims = ['x', 'y']``, then dat[:, 0] would be all the ``x`` values at a fixed ``y``.
 
         :param dat: Input data. If class:`RegularDataArray`, then perform a deep copy. Input class:`np.ndarray` is
-        ordinary usage. If class:`xr.DataArray`, then assume it's already regularly gridded.
-        :type dat: class:`RegularDataArray`, class:`np.ndarray`, or class`xr.DataArray`
+        ordinary usage. If class:`xr.DataArray`, then assume it's already regularly gridded. A
+        class:`LazyArray`, a dask array, or an xarray DataArray backed by dask or by a lazily loaded file is kept
+        as is and only computed where it is sliced.
+        :type dat: class:`RegularDataArray`, class:`np.ndarray`, class`xr.DataArray` or class:`LazyArray`
         :param delta: Iterable representing the delta for each axis
         :type delta: Iterable[class:`np.ndarray`]
         :param coord_min: The first coordinate value for each axis
         :type coord_min: Iterable[class:`np.ndarray`]
         :param dims: Labels of each dimension
         :type dims: Iterable[class:`str`]
+        :param mask: Optional boolean or weight mask, see :meth:`set_mask`
+        :type mask: class:`np.ndarray`
+        :param copy: If False, an input class:`np.ndarray` or in-memory class:`xr.DataArray` is used without
+            copying it
+        :type copy: bool
+        :param coords: Explicit coordinates for each axis, or None for axes that are regular. Overrides ``delta``
+            and ``coord_min`` of those axes. Coordinates must be monotonic, and uniformly spaced ones are treated as
+            regular. See :meth:`regularize`.
+        :type coords: Iterable[Union[None, class:`np.ndarray`]]
         """
+        if hasattr(dat, '__dask_graph__') and not (xr and isinstance(dat, xr.DataArray)):
+            dat = IndexedArray(dat)
         # Deep copy RegularDataArray
         if isinstance(dat, RegularDataArray):
-            self._data = dat._data.copy()
+            # read-only memory maps are as immutable as LazyArrays, and copying would load the whole file
+            read_only_map = isinstance(dat._data, np.memmap) and getattr(dat._data, 'mode', None) == 'r'
+            self._data = dat._data if read_only_map else dat._data.copy()
             def deepcopy(listin):
                 return [x.copy() for x in listin]
             self.delta = np.array(deepcopy(dat.delta))
@@ -45,11 +72,16 @@ class RegularDataArray(object):
             self.dims = dat.dims
             self.axes = deepcopy(dat.axes)
             self.coord_max = np.array(deepcopy(dat.coord_max))
+            self.coords = [None if c is None else c.copy() for c in dat.coords]
             self.name = dat.name
+            self._interp_method = None
+            self._has_nan = dat._has_nan
+            self._levels = dat._levels
+            self.mask = None if dat.mask is None else dat.mask.copy()
             return
         # read in numpy array
-        elif isinstance(dat, np.ndarray):
-            self._data = dat.copy()
+        elif isinstance(dat, (np.ndarray, LazyArray)):
+            self._data = dat.copy() if copy else dat
             if coord_min is None:
                 self.coord_min = np.array([0 for _ in range(dat.ndim)])
             else:
@@ -68,7 +100,14 @@ class RegularDataArray(object):
                 self.delta = np.array(delta)
         # read in xarray
         elif xr and isinstance(dat, xr.DataArray):
-            self._data = dat.values.copy()
+            if coords is None and delta is None and coord_min is None:
+                coords = [dat.coords[x].values for x in dat.dims]
+            if dat.chunks is not None:
+                self._data = IndexedArray(dat.data)
+            elif not getattr(dat.variable, '_in_memory', True):
+                self._data = IndexedArray(dat.variable)
+            else:
+                self._data = np.array(dat.data, copy=True) if copy else np.asarray(dat.data)
             if coord_min is None:
                 self.coord_min = np.array([dat.coords[x][0] for x in dat.dims])
             else:
@@ -80,16 +119,26 @@ class RegularDataArray(object):
                 self.delta = np.array(list(delta))
         else:
             raise ValueError("Input data is not recognized by RegularDataArray")
+        # explicit coordinates of non-uniform axes
+        self.coords = [None]*self._data.ndim
+        if coords is not None:
+            self._set_coords(coords)
+
         # if any delta is negative, make it positive and update data
         idx = self.delta < 0
         if np.any(idx):
+            self.coords = [None if c is None or not flip else c[::-1].copy() for c, flip in zip(self.coords, idx)]
             self.coord_min[idx] += (np.array(self._data.shape)[idx] - 1) * self.delta[idx]
             self.delta[idx] *= -1
             newview = tuple(slice(None, None, -1 if x else None) for x in idx)
             self._data = self._data[newview].copy()
+            if mask is not None:
+                mask = np.asarray(mask)
+                mask = mask[tuple(slc if n > 1 else slice(None) for slc, n in zip(newview, mask.shape))]
 
         # create axes and coord_max properties
-        self.axes = [cmin + d*np.arange(n) for cmin, d, n in zip(self.coord_min, self.delta, self._data.shape)]
+        self.axes = [cmin + d*np.arange(n) if c is None else c.copy()
+                     for cmin, d, n, c in zip(self.coord_min, self.delta, self._data.shape, self.coords)]
         self.coord_max = np.array([ax[-1] for ax in self.axes])
 
         # create dims property
@@ -109,8 +158,167 @@ class RegularDataArray(object):
         # Set the name
         self.name = str(name)
 
-        # Set up interpolator
-        self.interpolator = None
+        # Interpolators are built on demand and cached in the memory budget
+        self._interp_method = None
+
+        # Cached statistics, computed on first use
+        self._has_nan = None
+        self._levels = None
+
+        self.mask = None
+        if mask is not None:
+            self.set_mask(mask)
+
+    def _set_coords(self, coords):
+        """Store the explicit coordinates of non-uniform axes, and set delta and coord_min of every given axis"""
+        coords = list(coords)
+        if len(coords) != self._data.ndim:
+            raise ValueError(f"Need coordinates or None for each of the {self._data.ndim} axes, got {len(coords)}")
+        self.coord_min = self.coord_min.astype(float)
+        self.delta = self.delta.astype(float)
+        for i, c in enumerate(coords):
+            if c is None:
+                continue
+            c = np.asarray(c, dtype=float)
+            if c.shape != (self._data.shape[i],):
+                raise ValueError(f"Coordinates of axis {i} have shape {c.shape}, expected ({self._data.shape[i]},)")
+            if len(c) < 2:
+                self.coord_min[i] = c[0] if len(c) else 0
+                continue
+            steps = np.diff(c)
+            if not (np.all(steps > 0) or np.all(steps < 0)):
+                raise ValueError(f"Coordinates of axis {i} are not strictly monotonic")
+            self.coord_min[i] = c[0]
+            self.delta[i] = (c[-1] - c[0])/(len(c) - 1)
+            if np.max(np.abs(steps - self.delta[i])) > 1e-6*abs(self.delta[i]):
+                self.coords[i] = c
+
+    def is_regular(self, axis: int = None) -> bool:
+        """Whether ``axis``, or every axis, is uniformly spaced"""
+        if axis is None:
+            return all(c is None for c in self.coords)
+        return self.coords[axis] is None
+
+    def regularize(self, delta=None, workers: int = None):
+        """Resample the non-uniform axes onto regular grids with separable linear interpolation. Other axes are
+        kept, so regular data is returned unchanged.
+
+        :param delta: Grid spacing for each axis, or None to keep the number of points of each non-uniform axis
+        :param workers: Number of threads, see :func:`pyimagetool.Resample.resample_axis`
+        """
+        if self.is_regular():
+            return self
+        delta = [None]*self.ndim if delta is None else list(np.broadcast_to(np.asarray(delta, dtype=float),
+                                                                             (self.ndim,)))
+        new_delta = self.delta.astype(float)
+        dst = [None]*self.ndim
+        for i, c in enumerate(self.coords):
+            if c is None:
+                continue
+            if delta[i] is not None:
+                new_delta[i] = delta[i]
+            n = int(np.floor((c[-1] - c[0])/new_delta[i] + 1e-9)) + 1
+            dst[i] = c[0] + new_delta[i]*np.arange(n)
+        mat = resample(np.asarray(self._data), self.axes, dst, workers)
+        return RegularDataArray(mat, delta=new_delta, coord_min=self.coord_min, dims=self.dims, name=self.name,
+                                copy=False)
+
+    def regrid(self, new_delta=None, new_coord_min=None, new_shape=None, method='linear', workers: int = None):
+        """Resample onto a new regular grid, one axis at a time with tabulated indices and weights (see
+        :func:`pyimagetool.Resample.resample`). Axes whose grid does not change are not touched. Points outside of
+        the data, and masked elements, become NaN.
+
+        :param new_delta: Grid spacing for each axis, defaults to the current spacing
+        :param new_coord_min: First coordinate for each axis, defaults to the current one
+        :param new_shape: Number of points for each axis, defaults to covering the current range
+        :param method: ``linear`` or ``nearest``
+        :param workers: Number of threads used for each axis
+        """
+        def per_axis(values, default):
+            if values is None:
+                return np.array(default, dtype=float)
+            return np.broadcast_to(np.asarray(values, dtype=float), (self.ndim,)).copy()
+        new_delta = per_axis(new_delta, self.delta)
+        new_coord_min = per_axis(new_coord_min, self.coord_min)
+        if new_shape is None:
+            new_shape = np.floor((self.coord_max - new_coord_min)/new_delta + 1e-9).astype(int) + 1
+        new_shape = [max(int(n), 1) for n in np.broadcast_to(new_shape, (self.ndim,))]
+        dst = []
+        for i in range(self.ndim):
+            unchanged = self.is_regular(i) and new_shape[i] == self.shape[i] and \
+                np.isclose(new_delta[i], self.delta[i], rtol=1e-9, atol=0) and \
+                np.isclose(new_coord_min[i], self.coord_min[i], rtol=0, atol=1e-9*abs(self.delta[i]))
+            dst.append(None if unchanged else new_coord_min[i] + new_delta[i]*np.arange(new_shape[i]))
+        mat = np.asarray(self._data)
+        if self.mask is not None:
+            mat = np.where(self.mask != 0, mat, np.nan)
+        mat = resample(mat, self.axes, dst, workers, method)
+        return RegularDataArray(mat, delta=new_delta, coord_min=new_coord_min, dims=self.dims, name=self.name,
+                                copy=mat is self._data)
+
+    def second_derivative(self, axis: int, sigma: float = 1.0, smooth_axis: int = None, smooth_sigma: float = None,
+                          workers: int = None):
+        """Second derivative along ``axis`` after Gaussian smoothing, computed with FFTs for every slice at once.
+        See :func:`pyimagetool.Curvature.second_derivative`.
+
+        :param sigma: Standard deviation of the smoothing along ``axis``, in elements
+        :param smooth_axis: Another axis to smooth along, by ``smooth_sigma`` elements (defaults to ``sigma``)
+        :param workers: Number of threads sharing the slices
+        """
+        # masked elements are NaN, which the derivatives fill in and leave NaN
+        mat = np.asarray(self._data)
+        if self.mask is not None:
+            mat = np.where(self.mask != 0, mat, np.nan)
+        mat = Curvature.second_derivative(mat, axis, self.delta, sigma, smooth_axis, smooth_sigma, workers)
+        return RegularDataArray(mat, delta=self.delta, coord_min=self.coord_min, dims=self.dims, name=self.name,
+                                coords=self.coords, copy=False)
+
+    def curvature(self, axes, a0: float = 1.0, sigma=1.0, weight: float = 1.0, workers: int = None):
+        """Curvature along one axis, or 2D curvature over a pair of axes for every slice at once. See
+        :func:`pyimagetool.Curvature.curvature`.
+
+        :param a0: Free parameter, smaller values sharpen the features
+        :param sigma: Standard deviation of the smoothing in elements, one value or one per axis
+        :param weight: Relative weight of the second axis for 2D curvature
+        """
+        mat = np.asarray(self._data)
+        if self.mask is not None:
+            mat = np.where(self.mask != 0, mat, np.nan)
+        mat = Curvature.curvature(mat, axes, a0, sigma, weight, workers)
+        return RegularDataArray(mat, delta=self.delta, coord_min=self.coord_min, dims=self.dims, name=self.name,
+                                coords=self.coords, copy=False)
+
+    def fit_peaks(self, axis: int, n_peaks: int = 1, model: str = 'lorentzian', initial=None, workers: int = None):
+        """Fit ``n_peaks`` Lorentzian or Gaussian peaks on a linear background to every 1D cut along ``axis`` at
+        once. See :func:`pyimagetool.PeakFit.fit_peaks`.
+
+        :param initial: Starting parameters, e.g. the ``params`` of an earlier result
+        :return: PeakFitResult, which returns the fitted parameters as RegularDataArrays, e.g. ``result['center']``
+        """
+        from .PeakFit import fit_peaks
+        return fit_peaks(self, axis, n_peaks, model, initial, workers=workers)
+
+    def track_peak(self, axis: int, window: int = 3, method: str = 'parabolic', search=None, minimum: bool = False):
+        """Subpixel position and height of the maximum of every 1D cut along ``axis``, e.g. to follow a band
+        through a cube. See :func:`pyimagetool.PeakFit.track_peak`.
+
+        :param window: Number of elements around the maximum used for the refinement
+        :param method: ``'parabolic'`` or ``'centroid'``
+        :return: (position, amplitude) RegularDataArrays
+        """
+        from .PeakFit import track_peak
+        return track_peak(self, axis, window, method, search, minimum)
+
+    def symmetrize(self, axis: int, center: float = 0.0, mode: str = 'average', lazy: bool = False):
+        """Reflect the data about ``center`` along ``axis`` and combine it with the original, e.g. about the Fermi
+        level. See :mod:`pyimagetool.Symmetrize`.
+
+        :param center: The coordinate of the mirror plane, which need not be on the grid
+        :param mode: ``'average'`` averages the overlap, ``'sum'`` adds it, and ``'reflect'`` only reflects
+        :param lazy: Compute the result only where it is indexed, e.g. for display in ImageTool
+        """
+        from . import Symmetrize
+        return (Symmetrize.view if lazy else Symmetrize.symmetrize)(self, axis, center, mode)
 
     def __str__(self):
         out = f"{self.name} Array\n"
@@ -180,7 +388,8 @@ class RegularDataArray(object):
             data = self._data[tuple(selection)]
         except IndexError:
             raise IndexError("Slice data")
-        return RegularDataArray(data, delta=delta, coord_min=coord_min, dims=self.dims)
+        return self._subset(RegularDataArray(data, delta=delta, coord_min=coord_min, dims=self.dims,
+                                             mask=self._mask_subset(selection), coords=self._coords_subset(selection)))
 
     def sel(self, *args):
         if len(args) != self.ndim:
@@ -216,7 +425,8 @@ class RegularDataArray(object):
             data = self._data[tuple(selection)]
         except IndexError:
             raise IndexError("Slice data")
-        return RegularDataArray(data, delta=delta, coord_min=coord_min, dims=self.dims)
+        return self._subset(RegularDataArray(data, delta=delta, coord_min=coord_min, dims=self.dims,
+                                             mask=self._mask_subset(selection), coords=self._coords_subset(selection)))
 
     def squeeze(self):
         """Remove any one dimensional axis."""
@@ -228,7 +438,11 @@ class RegularDataArray(object):
             if not rm:
                 coord_min.append(self.coord_min[i])
                 delta.append(self.delta[i])
-        return RegularDataArray(mat, coord_min=coord_min, delta=delta)
+        mask = None
+        if self.mask is not None:
+            mask = self.mask.reshape([n for n, rm in zip(self.mask.shape, rm_dim) if not rm])
+        coords = [c for c, rm in zip(self.coords, rm_dim) if not rm]
+        return self._subset(RegularDataArray(mat, coord_min=coord_min, delta=delta, mask=mask, coords=coords))
 
     def transpose(self, tr):
         """Transpose the RegularSpacedData
@@ -239,20 +453,101 @@ class RegularDataArray(object):
         coord_min = [self.coord_min[i] for i in tr]
         delta = [self.delta[i] for i in tr]
         dims = tuple(self.dims[i] for i in tr)
-        return RegularDataArray(np.transpose(self.data, tr),
-                                coord_min=coord_min, delta=delta, dims=dims, name=self.name)
+        mask = None if self.mask is None else np.transpose(self.mask, tr)
+        out = RegularDataArray(np.transpose(self.data, tr), coord_min=coord_min, delta=delta, dims=dims,
+                               name=self.name, mask=mask, coords=[self.coords[i] for i in tr])
+        out._levels = self._levels
+        return self._subset(out)
+
+    def set_mask(self, mask):
+        """Attach a mask that every reduction (mean, coarsen, levels, cursor cuts) respects.
+
+        The mask must have the same number of dimensions as the data and broadcast against it, so a per-pixel
+        detector mask for ``dims = ('x', 'y', 'energy')`` can have shape ``(nx, ny, 1)``. A boolean mask keeps the
+        elements that are ``True``. A float mask weights each element in the averages, and weight 0 excludes it.
+
+        :param mask: The mask, or None to remove it
+        :type mask: class:`np.ndarray`
+        """
+        if mask is not None:
+            if not isinstance(mask, np.memmap):  # memory-mapped masks, e.g. from load, stay on disk
+                mask = np.array(mask)
+            if mask.ndim != self.ndim or np.broadcast_shapes(mask.shape, self.shape) != self.shape:
+                raise ValueError(f"Mask shape {mask.shape} does not broadcast to data shape {self.shape}")
+        self.mask = mask
+        self._levels = None
+        budget.discard(self, 'prefix_sum')
+        budget.discard(self, 'mask_prefix_sum')
+
+    def _coords_subset(self, selection):
+        """Apply an index selection to the explicit coordinates"""
+        return [None if c is None else c[slc] for c, slc in zip(self.coords, selection)]
+
+    def _mask_subset(self, selection):
+        """Apply an index selection to the mask, leaving broadcast axes alone"""
+        if self.mask is None:
+            return None
+        return self.mask[tuple(slc if n > 1 else slice(None) for slc, n in zip(selection, self.mask.shape))]
+
+    def _subset(self, out):
+        """Pass on cached knowledge that remains true for any subset of this array"""
+        if self._has_nan is False:
+            out._has_nan = False
+        return out
+
+    def mark_modified(self, region=None):
+        """Call after changing the data in place. Drops the derived data cached for this array (interpolators,
+        prefix sums, levels), and re-derives ``has_nan`` by scanning only the modified region.
+
+        :param region: Tuple of index slices that were modified, or None if anything may have changed
+        """
+        budget.discard(self)
+        self._levels = None
+        if region is None or self._has_nan is not False:
+            self._has_nan = None
+        else:
+            self._has_nan = self._region(region).has_nan
+
+    def inherit_statistics(self, previous, region):
+        """Derive the cached statistics from those of ``previous``, for data that equals ``previous`` except inside
+        ``region`` and except for elements of ``previous`` that fall outside of this array's grid, as when frames are
+        appended to a live dataset. Only the region is scanned.
+
+        :param previous: The RegularDataArray this array was derived from
+        :param region: Tuple of index slices of this array holding new data
+        """
+        new = self._region(region)
+        if previous._has_nan is False:
+            self._has_nan = new.has_nan
+        grown = np.all(self.coord_min <= previous.coord_min + self.delta*1e-6) and \
+            np.all(self.coord_max >= previous.coord_max - self.delta*1e-6)
+        if previous._levels is not None and grown and self.mask is None and previous.mask is None:
+            lo, hi = new.levels()
+            self._levels = (float(np.fmin(previous._levels[0], lo)), float(np.fmax(previous._levels[1], hi)))
+
+    def _region(self, region):
+        """View of a tuple of index slices as a RegularDataArray, for computing statistics"""
+        return RegularDataArray(self._data[region], mask=self._mask_subset(region), copy=False)
 
     def index_to_scale(self, axis, i):
         """Retrieve the coordinate corresponding to index i
         :return: float representing the coordinate value of index i
         """
+        if self.coords[axis] is not None:
+            return float(np.interp(i, np.arange(self.shape[axis]), self.coords[axis]))
         return float(self.coord_min[axis] + self.delta[axis]*i)
 
     def scale_to_index(self, axis, coord_val):
         """Retrieve the index (may not be an integer) representing coord_val on axis
         :return: float representing index of coordinate
         """
-        return float((coord_val - self.coord_min[axis])/self.delta[axis])
+        return float(self.scale_to_indices(axis, coord_val))
+
+    def scale_to_indices(self, axis, coord_vals) -> np.ndarray:
+        """Vectorized :meth:`scale_to_index`. On non-uniform axes, coordinates outside of the axis are clamped."""
+        if self.coords[axis] is not None:
+            return np.interp(coord_vals, self.coords[axis], np.arange(self.shape[axis]))
+        return (np.asarray(coord_vals) - self.coord_min[axis])/self.delta[axis]
 
     def interp(self, pts, method='linear'):
         """Interpolate the regularly gridded data at arbitrary points.
@@ -262,12 +557,48 @@ class RegularDataArray(object):
         :param method: should be ``linear`` or ``nearest``
         :type method: class:`str`
         """
-        if self.interpolator is None or method != self.interpolator[0]:
-            fcn = RegularGridInterpolator(tuple(self.axes), self._data, method, bounds_error=False)
-            self.interpolator = (method, fcn)
-            return fcn(pts)
-        else:
-            return self.interpolator[1](pts)
+        def build():
+            return RegularGridInterpolator(tuple(self.axes), self._data, method, bounds_error=False)
+
+        def size(fcn):
+            # the interpolator may have converted the data to float, in which case it holds a second copy
+            copied = 0 if np.may_share_memory(fcn.values, self._data) else fcn.values.nbytes
+            return copied + sum(ax.nbytes for ax in self.axes)
+
+        self._interp_method = method
+        return budget.get_or_compute(self, 'interpolator', method, build, size)(pts)
+
+    @property
+    def interpolator(self):
+        """(method, RegularGridInterpolator) used by the last call to :meth:`interp`, or None if it is not cached"""
+        fcn = budget.get(self, 'interpolator', self._interp_method)
+        return None if fcn is None else (self._interp_method, fcn)
+
+    def to_xarray(self):
+        """The data as an class:`xr.DataArray` with coordinates, without copying. Dask and lazily loaded backends
+        stay lazy, and other lazy arrays are wrapped in dask arrays when dask is installed."""
+        if xr is None:
+            raise ModuleNotFoundError("xarray not available!")
+        dat = self._data
+        if isinstance(dat, IndexedArray):
+            dat = dat.array
+            if isinstance(dat, xr.Variable):
+                dat = xr.Variable(self.dims, dat)
+        elif isinstance(dat, LazyArray) and dask_array is not None:
+            dat = dask_array.from_array(dat, chunks='auto', meta=np.empty((0,)*dat.ndim, dtype=dat.dtype))
+        elif isinstance(dat, LazyArray):
+            dat = np.asarray(dat)
+        coords = {dim: ax for dim, ax in zip(self.dims, self.axes)}
+        return xr.DataArray(dat, coords=coords, dims=self.dims, name=self.name)
+
+    def save(self, path):
+        """Save the data, grid, dims, name and mask to a single file that :func:`load` opens in constant time.
+        See :mod:`pyimagetool.FileFormat`."""
+        meta = {'delta': self.delta.tolist(), 'delta_dtype': self.delta.dtype.str,
+                'coord_min': self.coord_min.tolist(), 'coord_min_dtype': self.coord_min.dtype.str,
+                'dims': list(self.dims), 'name': self.name,
+                'coords': [None if c is None else c.tolist() for c in self.coords]}
+        FileFormat.write(path, self._data, meta, self.mask)
 
     def plot(self, ax=None, **kwargs):
         if plt:
@@ -307,8 +638,82 @@ class RegularDataArray(object):
         coord_min = [self.coord_min[ax] if ax not in axes else (self.coord_max[ax] + self.coord_min[ax])/2
                      for ax in range(self.ndim)]
         delta = self.delta.copy()
-        mat = np.mean(self.data, axis=axes).reshape(newdims)
-        return RegularDataArray(mat, coord_min=coord_min, delta=delta, dims=self.dims, name=self.name)
+        if self.has_nan or self.mask is not None:
+            mat = _masked_mean(self.data, self.mask, tuple(axes), self.has_nan).reshape(newdims)
+        else:
+            mat = np.mean(self.data, axis=axes).reshape(newdims)
+        coords = [None if ax in axes else c for ax, c in enumerate(self.coords)]
+        return RegularDataArray(mat, coord_min=coord_min, delta=delta, dims=self.dims, name=self.name, coords=coords)
+
+    def coarsen(self, factors):
+        """Average blocks of ``factors`` elements along each axis. Elements left over at the end of an axis are
+        dropped. NaNs and masked elements are skipped, and a block with no valid element becomes NaN.
+
+        :param factors: Integer block size for each axis, or one integer used for every axis
+        :type factors: Union[int, Iterable[int]]
+        """
+        if not isinstance(factors, Iterable):
+            factors = [factors]*self.ndim
+        factors = [int(f) for f in factors]
+        if len(factors) != self.ndim or min(factors) < 1:
+            raise ValueError(f"Need one positive factor per axis, got {factors}")
+        shape = [n // f for n, f in zip(self.shape, factors)]
+        if min(shape) < 1:
+            raise ValueError(f"Factors {factors} are larger than the data shape {self.shape}")
+        blocked_shape = [x for s, f in zip(shape, factors) for x in (s, f)]
+        mat = self._data[tuple(slice(0, s*f) for s, f in zip(shape, factors))].reshape(blocked_shape)
+        block_axes = tuple(range(1, 2*self.ndim, 2))
+        if self.has_nan or self.mask is not None:
+            mask = self.mask
+            if mask is not None:
+                mask = mask[tuple(slice(0, s*f) if n > 1 else slice(None)
+                                  for s, f, n in zip(shape, factors, mask.shape))]
+                mask = mask.reshape([x for s, f, n in zip(shape, factors, mask.shape)
+                                     for x in ((s, f) if n > 1 else (1, 1))])
+            mat = _masked_mean(mat, mask, block_axes, self.has_nan)
+        else:
+            mat = np.mean(mat, axis=block_axes)
+        factors = np.array(factors)
+        coord_min = self.coord_min + self.delta*(factors - 1)/2
+        coords = [None if c is None else c[:s*f].reshape(s, f).mean(axis=1)
+                  for c, s, f in zip(self.coords, shape, factors)]
+        return RegularDataArray(mat, delta=self.delta*factors, coord_min=coord_min, dims=self.dims, name=self.name,
+                                coords=coords)
+
+    def levels(self):
+        """Minimum and maximum of the data, skipping NaNs. The result is cached.
+
+        :return: (min, max), or (nan, nan) if there is no valid data
+        """
+        if self._levels is None:
+            if self._data.size == 0:
+                self._levels = (np.nan, np.nan)
+            elif self.has_nan or self.mask is not None:
+                # fmin/fmax skip NaNs, and the mask is broadcast by the reduction instead of being expanded
+                where = True if self.mask is None else self.mask != 0
+                if np.issubdtype(self._data.dtype, np.inexact):
+                    lo, hi = np.inf, -np.inf
+                elif self._data.dtype.kind == 'b':
+                    lo, hi = True, False
+                else:
+                    lo, hi = np.iinfo(self._data.dtype).max, np.iinfo(self._data.dtype).min
+                mn = np.fmin.reduce(self._data, axis=None, where=where, initial=lo)
+                mx = np.fmax.reduce(self._data, axis=None, where=where, initial=hi)
+                self._levels = (float(mn), float(mx)) if mn <= mx else (np.nan, np.nan)
+            else:
+                self._levels = (float(np.min(self._data)), float(np.max(self._data)))
+        return self._levels
+
+    @property
+    def has_nan(self) -> bool:
+        """Whether the data contains NaN. Computed with a single pass over the data on first use and cached."""
+        if self._has_nan is None:
+            if self._data.size == 0 or not np.issubdtype(self._data.dtype, np.inexact):
+                self._has_nan = False
+            else:
+                # min propagates NaN, so this is one pass with no temporary boolean array
+                self._has_nan = bool(np.isnan(np.min(self._data)))
+        return self._has_nan
 
     @property
     def T(self):
@@ -337,6 +742,97 @@ class RegularDataArray(object):
         return self.coord_min
 
 
+def _mask_sum(mask, shape, axes):
+    """Sum a mask that broadcasts to ``shape`` over ``axes`` without expanding it. Axes along which the mask is
+    broadcast contribute their length as a factor."""
+    if mask is None:
+        return np.prod([shape[ax] for ax in axes])
+    total = np.sum(mask, axis=tuple(ax for ax in axes if mask.shape[ax] > 1), keepdims=True)
+    total = total*np.prod([shape[ax] for ax in axes if mask.shape[ax] == 1])
+    return total.reshape([n for ax, n in enumerate(total.shape) if ax not in axes])
+
+
+def _masked_mean(data, mask, axes, skip_nan):
+    """Weighted mean over ``axes`` of the elements selected by ``mask`` (see :meth:`RegularDataArray.set_mask`),
+    optionally skipping NaNs. Means with no valid element are NaN."""
+    if mask is not None and mask.dtype != bool:
+        return _weighted_mean(data, mask, axes, skip_nan)
+    where = ~np.isnan(data) if skip_nan else None
+    if mask is not None:
+        where = mask if where is None else where & mask
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = np.sum(data, axis=axes, where=True if where is None else where)
+        return total/_mask_sum(where, data.shape, axes)
+
+
+def _weighted_mean(data, weights, axes, skip_nan, slab_size=2**20):
+    """:func:`_masked_mean` for a weight mask. The weighted data is summed in slabs of about ``slab_size`` elements
+    along the first axis, so no weighted copy of the whole data is made."""
+    axes = tuple(ax % data.ndim for ax in axes)
+    kept = [1 if ax in axes else n for ax, n in enumerate(data.shape)]
+    total = np.zeros(kept, dtype=np.result_type(data.dtype, weights.dtype))
+    count = np.zeros(kept, dtype=weights.dtype)
+    step = max(1, slab_size // max(1, int(np.prod(data.shape[1:]))))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for start in range(0, data.shape[0], step):
+            rows = slice(start, start + step)
+            block = np.asarray(data[rows])
+            w = weights[rows] if weights.shape[0] > 1 else weights
+            if skip_nan:
+                w = np.where(np.isnan(block), 0, w)
+                block = np.where(w == 0, 0, block)
+            out = (slice(None),) if 0 in axes else (rows,)
+            total[out] += np.sum(block*w, axis=axes, keepdims=True)
+            count[out] += np.sum(np.broadcast_to(w, block.shape), axis=axes, keepdims=True)
+        return (total/count).reshape([n for ax, n in enumerate(data.shape) if ax not in axes])
+
+
+def from_events(events, delta, coord_min, shape, dims=None, name='Events', chunk_size=2**20, workers=None):
+    """Histogram an event list, e.g. (x, y, t) hits of a delay-line detector, onto a regular grid.
+
+    See :class:`pyimagetool.Events.EventHistogram`, which also supports appending events and rebinning.
+
+    :param events: (N, ndim) array of event coordinates, or a sequence of ndim columns of length N
+    :param delta: Bin size along each axis
+    :param coord_min: Center of the first bin along each axis
+    :param shape: Number of bins along each axis
+    :param chunk_size: Number of events histogrammed at a time
+    :param workers: Number of threads used to histogram chunks in parallel
+    """
+    from .Events import EventHistogram
+    return EventHistogram(events, delta, coord_min, shape, dims=dims, name=name, chunk_size=chunk_size,
+                          workers=workers).histogram()
+
+
+def load(path, mmap_mode='r') -> RegularDataArray:
+    """Open a file written by :meth:`RegularDataArray.save`. Only the header is parsed, and the data is
+    memory-mapped, so opening takes the same time for any file size.
+
+    :param mmap_mode: Mode passed to class:`np.memmap`, e.g. ``'r+'`` to modify the file in place, or None to
+        read the data into memory
+    """
+    dat, header, mask = FileFormat.read(path, mmap_mode)
+    delta = np.array(header['delta'], dtype=header['delta_dtype'])
+    coord_min = np.array(header['coord_min'], dtype=header['coord_min_dtype'])
+    return RegularDataArray(dat, delta=delta, coord_min=coord_min, dims=header['dims'], name=header['name'],
+                            mask=mask, copy=False, coords=header.get('coords'))
+
+
+def from_npy_stack(files, delta=None, coord_min=None, dims=None, axis=0, max_open=64, name='Unnamed'):
+    """Present equally shaped frames saved as separate ``.npy`` files as one RegularDataArray, without loading or
+    concatenating them. Frames are memory-mapped on demand, so cursor cuts only read the frames inside the bin.
+
+    :param files: A directory, whose ``.npy`` files are stacked in natural order (``step2`` before ``step10``), or
+        a sequence of paths
+    :param axis: Position of the stacking axis in the result
+    :param max_open: Number of memory-mapped frames kept open
+    """
+    if isinstance(files, (str, bytes)) or hasattr(files, '__fspath__'):
+        files = npy_files(files)
+    return RegularDataArray(NpyStack(files, axis=axis, max_open=max_open), delta=delta, coord_min=coord_min,
+                            dims=dims, name=name)
+
+
 def from_numpy_array(dat: np.array, delta=None, coord_min=None, dims=None):
     """
     Build data using a numpy array. Must provide one of the following:
@@ -352,15 +848,15 @@ if xr:
         if xr:
             coord_min = np.array([dat[dim].values[0] for dim in dat.dims])
             delta = np.array([dat[dim].values[1] - dat[dim].values[0] for dim in dat.dims])
-            return RegularDataArray(dat.values, delta=delta, coord_min=coord_min, dims=dat.dims)
+            return RegularDataArray(dat, delta=delta, coord_min=coord_min, dims=dat.dims, copy=False)
         else:
             raise ModuleNotFoundError("xarray not available!")
 
     def from_xarray_irregular(dat: xr.DataArray):
+        """Keep the exact coordinates of every axis. Non-uniform axes can be resampled onto a regular grid with
+        :meth:`RegularDataArray.regularize`."""
         if xr:
-            coord_min = np.array([dat[dim].values[0] for dim in dat.dims])
-            delta = np.array([np.mean(np.diff(dat[dim].values)) for dim in dat.dims])
-            return RegularDataArray(dat.values, delta=delta, coord_min=coord_min, dims=dat.dims)
+            return RegularDataArray(dat, dims=dat.dims, copy=False, coords=[dat[dim].values for dim in dat.dims])
         else:
             raise ModuleNotFoundError("xarray not available!")
 else:
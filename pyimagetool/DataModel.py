@@ -6,10 +6,13 @@ class SingleValueModel(QtCore.QObject):
     """A cursor position is either a float or int (determined at instantiation) and preserves the type in assignment.
     Furthermore, the object emits either an int or float pyqtSignal when the value is changed through the setter."""
     value_set = QtCore.Signal(object)
+    tracer = None  # the active SignalTracer, which is told about every emission while it is set
 
-    def __init__(self, val: object):
+    def __init__(self, val: object, name: str = ''):
+        """:param name: Label used when tracing signals, e.g. ``Cursor.index[0]``"""
         super().__init__()
         self._value = val
+        self.name = name
 
     def __repr__(self):
         return f"Model[{self._value}]"
@@ -18,9 +21,16 @@ class SingleValueModel(QtCore.QObject):
         return self.__repr__()
 
     def set_value(self, newval, block=False):
+        old = self._value
         self._value = newval
         if not block:
+            self._emit(old)
+
+    def _emit(self, old):
+        if SingleValueModel.tracer is None:
             self.value_set.emit(self._value)
+        else:
+            SingleValueModel.tracer.emit(self, old)
 
     @property
     def value(self):
@@ -32,8 +42,8 @@ class SingleValueModel(QtCore.QObject):
 
 
 class ValueLimitedModel(SingleValueModel):
-    def __init__(self, val, lower=None, upper=None):
-        super().__init__(val)
+    def __init__(self, val, lower=None, upper=None, name: str = ''):
+        super().__init__(val, name)
         self._lower_lim = lower
         self._upper_lim = upper
 
@@ -66,9 +76,10 @@ class ValueLimitedModel(SingleValueModel):
             newval = self._lower_lim
         if self._upper_lim is not None and newval > self._upper_lim:
             newval = self._upper_lim
+        old = self._value
         self._value = newval
         if not block:
-            self.value_set.emit(self._value)
+            self._emit(old)
         return self._value
 
     @property
@@ -0,0 +1,154 @@
+import threading
+
+import numpy as np
+
+from .DataMatrix import RegularDataArray
+from .MemoryBudget import budget
+from .Parallel import map_chunks, n_workers
+
+
+def _as_columns(events, ndim=None):
+    """Split events given as an (N, ndim) array or a sequence of columns into a tuple of 1D float columns"""
+    if isinstance(events, np.ndarray) and events.ndim == 2:
+        columns = tuple(events[:, i] for i in range(events.shape[1]))
+    else:
+        columns = tuple(np.asarray(c) for c in events)
+    if any(c.ndim != 1 or c.shape != columns[0].shape for c in columns):
+        raise ValueError("Events must be an (N, ndim) array or a sequence of ndim columns of equal length")
+    if ndim is not None and len(columns) != ndim:
+        raise ValueError(f"Expected events with {ndim} coordinates, got {len(columns)}")
+    return columns
+
+
+def histogram_chunk(columns, delta, coord_min, shape) -> np.ndarray:
+    """Count the events of one chunk on a regular grid. Events outside of the grid are dropped.
+
+    Bins are centered on the grid coordinates, so bin i along an axis covers
+    [coord_min + (i - 1/2)*delta, coord_min + (i + 1/2)*delta).
+
+    :return: Flat class:`np.ndarray` of counts with prod(shape) elements
+    """
+    n = columns[0].shape[0]
+    flat = np.zeros(n, dtype=np.intp)
+    valid = np.ones(n, dtype=bool)
+    for col, d, c0, size in zip(columns, delta, coord_min, shape):
+        idx = np.floor((col - c0)/d + 0.5)
+        valid &= (idx >= 0) & (idx < size)
+        flat *= size
+        flat += np.where(valid, idx, 0).astype(np.intp)
+    return np.bincount(flat[valid], minlength=int(np.prod(shape)))
+
+
+class EventHistogram:
+    """An event list, e.g. the (x, y, t) hits of a delay-line detector, histogrammed onto a regular grid.
+
+    Events are stored in chunks, never as a dense cube. The counts for a grid are accumulated chunk by chunk,
+    optionally in several threads, and kept in the memory budget per grid, so switching back to a previous
+    binning is free and appending events only histograms the new chunks. :class:`pyimagetool.ImageTool` accepts
+    an EventHistogram and can rebin it in the background with :meth:`pyimagetool.ImageTool.rebin_events`.
+    """
+
+    def __init__(self, events, delta, coord_min, shape, dims=None, name='Events', chunk_size=2**20,
+                 workers=None):
+        """
+        :param events: (N, ndim) array of event coordinates, or a sequence of ndim columns of length N
+        :param delta: Bin size along each axis
+        :param coord_min: Center of the first bin along each axis
+        :param shape: Number of bins along each axis
+        :param dims: Axis names
+        :param chunk_size: Number of events histogrammed at a time
+        :param workers: Number of threads used to histogram chunks. Defaults to the number of CPUs
+        """
+        columns = _as_columns(events)
+        self.ndim = len(columns)
+        self.dims = tuple(dims) if dims is not None else tuple('xyzt'[:self.ndim])
+        self.name = name
+        self.chunk_size = int(chunk_size)
+        self.workers = n_workers(workers)
+        self._chunks = []
+        self._lock = threading.RLock()
+        self.set_grid(delta, coord_min, shape)
+        self.append(columns)
+
+    def __repr__(self):
+        return f"EventHistogram[{self.n_events} events in {len(self._chunks)} chunks, shape {self.shape}]"
+
+    @property
+    def n_events(self) -> int:
+        return sum(c[0].shape[0] for c in self._chunks)
+
+    def set_grid(self, delta=None, coord_min=None, shape=None):
+        """Change the default grid used by :meth:`histogram`. Arguments left as None are kept."""
+        delta = self.delta if delta is None else np.broadcast_to(np.asarray(delta, dtype=float), (self.ndim,))
+        coord_min = self.coord_min if coord_min is None else np.broadcast_to(np.asarray(coord_min, dtype=float),
+                                                                             (self.ndim,))
+        shape = self.shape if shape is None else tuple(int(n) for n in np.broadcast_to(shape, (self.ndim,)))
+        if np.any(delta <= 0):
+            raise ValueError("Bin sizes must be positive")
+        self.delta, self.coord_min, self.shape = np.array(delta), np.array(coord_min), shape
+
+    def grid_for(self, delta):
+        """The grid with bin size ``delta`` covering the same range as the current grid, as
+        (delta, coord_min, shape)"""
+        delta = np.broadcast_to(np.asarray(delta, dtype=float), (self.ndim,))
+        lo = self.coord_min - self.delta/2
+        hi = lo + self.delta*np.array(self.shape)
+        shape = tuple(max(int(n), 1) for n in np.ceil((hi - lo)/delta - 1e-9))
+        return delta, lo + delta/2, shape
+
+    def append(self, events):
+        """Add events. Cached histograms are brought up to date lazily, by histogramming only the new chunks."""
+        columns = _as_columns(events, self.ndim)
+        columns = tuple(np.ascontiguousarray(c, dtype=float) for c in columns)
+        n = columns[0].shape[0]
+        with self._lock:
+            for start in range(0, n, self.chunk_size):
+                self._chunks.append(tuple(c[start:start + self.chunk_size] for c in columns))
+
+    def histogram(self, delta=None, coord_min=None, shape=None, dtype=None) -> RegularDataArray:
+        """Histogram the events on the current grid, or on the given one.
+
+        :param dtype: Data type of the returned counts. By default uint32, or uint64 if a bin holds more counts
+        :raises OverflowError: If an integer ``dtype`` cannot hold the largest count
+        """
+        delta = self.delta if delta is None else np.broadcast_to(np.asarray(delta, dtype=float), (self.ndim,))
+        coord_min = self.coord_min if coord_min is None else np.broadcast_to(np.asarray(coord_min, dtype=float),
+                                                                             (self.ndim,))
+        shape = self.shape if shape is None else tuple(int(n) for n in np.broadcast_to(shape, (self.ndim,)))
+        counts = self._counts(delta, coord_min, shape)
+        largest = int(counts.max()) if counts.size else 0
+        if dtype is None:
+            dtype = np.uint32 if largest <= np.iinfo(np.uint32).max else np.uint64
+        elif np.issubdtype(dtype, np.integer) and largest > np.iinfo(dtype).max:
+            raise OverflowError(f"A bin holds {largest} events, more than {np.dtype(dtype)} can hold")
+        return RegularDataArray(counts.astype(dtype).reshape(shape), delta=delta, coord_min=coord_min,
+                                dims=self.dims, name=self.name, copy=False)
+
+    def _counts(self, delta, coord_min, shape) -> np.ndarray:
+        key = (tuple(delta), tuple(coord_min), tuple(shape))
+        with self._lock:
+            counts, done = budget.get(self, 'event_histogram', key, (None, 0))
+            chunks = self._chunks[done:]
+            if not chunks and counts is not None:
+                return counts
+            if counts is None:
+                counts = np.zeros(int(np.prod(shape)), dtype=np.int64)
+            else:
+                counts = counts.copy()  # the cached totals may be in use by another thread
+        if chunks:
+            # every thread sums its share of the chunks into its own totals, so that memory grows with the number
+            # of threads, not of chunks
+            def work(share):
+                totals = np.zeros_like(counts)
+                for c in share:
+                    totals += histogram_chunk(c, delta, coord_min, shape)
+                return totals
+
+            shares = [chunks[i::self.workers] for i in range(min(self.workers, len(chunks)))]
+            for totals in map_chunks(work, shares, self.workers):
+                counts += totals
+            with self._lock:
+                _, cached = budget.get(self, 'event_histogram', key, (None, 0))
+                if cached < done + len(chunks):
+                    budget.put(self, 'event_histogram', key, (counts, done + len(chunks)))
+        return counts
@@ -0,0 +1,188 @@
+"""Fermi level correction of every detector channel, e.g. from a polycrystalline gold reference.
+
+:func:`fit_edges` fits a Fermi-Dirac edge to every EDC of a cube in one batched Levenberg-Marquardt pass,
+:func:`smooth_edge` smooths the fitted edge over the channels, and :func:`shift_channels` moves every EDC by its
+fractional offset with the vectorized linear interpolation of :func:`pyimagetool.Registration.apply_shifts`.
+:func:`correct` does all three::
+
+    corrected = FermiEdge.correct(data, energy_axis=2, reference=gold, sum_axes=(1,), order=2)
+"""
+import numpy as np
+from scipy import ndimage
+from scipy.special import expit
+
+from .DataMatrix import RegularDataArray
+from .Parallel import map_chunks
+from .PeakFit import levenberg_marquardt
+from .Registration import apply_shifts
+
+K_B = 8.617333e-5  # Boltzmann constant in eV/K
+
+
+def fermi_dirac(x: np.ndarray, params: np.ndarray, jacobian: bool = False):
+    """A Fermi-Dirac edge on a linear density of states and a constant background,
+    ``(a + b*(x - ef))/(exp((x - ef)/w) + 1) + c``, for stacked ``params`` [ef, w, a, b, c] of shape (M, 5)
+
+    :return: (M, len(x)) values, and the (M, len(x), 5) Jacobian if ``jacobian``
+    """
+    ef, w, a, b, c = (params[:, i, None] for i in range(5))
+    u = x[None, :] - ef
+    g = expit(-u/w)
+    dos = a + b*u
+    f = dos*g + c
+    if not jacobian:
+        return f
+    dg = dos*g*(1 - g)/w  # derivative of the edge with respect to ef
+    jac = np.stack([dg - b*g, dg*u/w, g, u*g, np.ones_like(f)], axis=-1)
+    return f, jac
+
+
+def initial_edge(x: np.ndarray, y: np.ndarray, width: float) -> np.ndarray:
+    """Starting parameters for every row of ``y``: the edge where the smoothed EDC falls fastest, the background
+    from its top tenth in energy and the step height from its bottom tenth. NaNs are ignored."""
+    finite = np.isfinite(y)
+    n = y.shape[1]
+    tenth = max(n//10, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        above = np.sum(np.where(finite[:, -tenth:], y[:, -tenth:], 0), axis=1)/np.sum(finite[:, -tenth:], axis=1)
+        below = np.sum(np.where(finite[:, :tenth], y[:, :tenth], 0), axis=1)/np.sum(finite[:, :tenth], axis=1)
+    above, below = np.nan_to_num(above), np.nan_to_num(below)
+    dx = (x[-1] - x[0])/max(n - 1, 1)
+    if dx < 0:
+        above, below = below, above
+    smooth = ndimage.gaussian_filter1d(np.where(finite, y, below[:, None]), max(width/abs(dx), 1), axis=1,
+                                       mode='nearest')
+    i = np.argmin(np.gradient(smooth, axis=1)*np.sign(dx), axis=1)
+    params = np.zeros((len(y), 5))
+    params[:, 0] = x[i]
+    params[:, 1] = width
+    params[:, 2] = below - above
+    params[:, 4] = above
+    return params
+
+
+def fit_edges(data: RegularDataArray, energy_axis: int = -1, sum_axes=(), temperature: float = 20.0,
+              max_iter: int = 100, chunk_size: int = 2**21, workers: int = None) -> dict:
+    """Fit a Fermi-Dirac edge to every EDC of ``data``.
+
+    :param energy_axis: The energy axis, in eV for ``temperature`` to set a sensible starting width
+    :param sum_axes: Axes summed over before fitting, e.g. the scan axis of a gold reference, to fit one EDC per
+        detector channel
+    :param temperature: Sample temperature in K. The starting width is kT, or two energy steps if that is wider
+    :param chunk_size: Number of Jacobian elements computed at a time
+    :param workers: Number of threads fitting chunks in parallel
+    :return: Dict of RegularDataArrays on the grid of the remaining axes: ``ef`` the edge position, ``width`` the
+        fitted kT, ``chi2`` the mean squared residual and ``converged``
+    """
+    energy_axis = energy_axis % data.ndim
+    sum_axes = sorted({a % data.ndim for a in np.atleast_1d(sum_axes).astype(int)})
+    if energy_axis in sum_axes:
+        raise ValueError("The energy axis can not be summed over")
+    mat = np.asarray(data.values, dtype=float)
+    if data.mask is not None:
+        mat = np.where(np.broadcast_to(data.mask, data.shape) != 0, mat, np.nan)
+    if sum_axes:
+        mat = np.nansum(mat, axis=tuple(sum_axes), keepdims=True)
+    mat = np.moveaxis(mat, energy_axis, -1)
+    y = mat.reshape(-1, mat.shape[-1])
+    x = np.asarray(data.axes[energy_axis], dtype=float)
+    width = max(K_B*temperature, 2*abs(data.delta[energy_axis]))
+    params, chi2 = np.empty((len(y), 5)), np.empty(len(y))
+    converged = np.empty(len(y), dtype=bool)
+    step = max(1, chunk_size//(len(x)*5))
+
+    def work(lo):
+        rows = slice(lo, min(lo + step, len(y)))
+        params[rows], chi2[rows], converged[rows] = levenberg_marquardt(
+            fermi_dirac, x, y[rows], initial_edge(x, y[rows], width), positive=(1,), max_iter=max_iter)
+
+    map_chunks(work, range(0, len(y), step), workers)
+    keep = [a for a in range(data.ndim) if a != energy_axis and a not in sum_axes]
+    grid = dict(delta=[data.delta[a] for a in keep], coord_min=[data.coord_min[a] for a in keep],
+                dims=tuple(data.dims[a] for a in keep), coords=[data.coords[a] for a in keep])
+    shape = tuple(data.shape[a] for a in keep)
+    values = {'ef': params[:, 0], 'width': params[:, 1], 'chi2': chi2, 'converged': converged}
+    return {name: RegularDataArray(v.reshape(shape), name=f'{data.name} {name}', **grid)
+            for name, v in values.items()}
+
+
+def smooth_edge(edge: RegularDataArray, sigma=None, order: int = None, converged: RegularDataArray = None,
+                axis: int = 0) -> RegularDataArray:
+    """Smooth a fitted edge over the channels, skipping NaNs and failed fits.
+
+    :param sigma: Standard deviation in elements of a Gaussian smoothing over every axis, one value or one per axis
+    :param order: Instead, the order of a polynomial fitted along ``axis``, separately for every other index
+    :param converged: The ``converged`` map of :func:`fit_edges`. Failed fits are left out of the smoothing
+    """
+    values = np.array(edge.values, dtype=float)
+    valid = np.isfinite(values)
+    if converged is not None:
+        valid &= np.asarray(converged.values, dtype=bool)
+    if order is not None:
+        axis = axis % edge.ndim
+        x = edge.axes[axis] - np.mean(edge.axes[axis])
+        y = np.moveaxis(np.where(valid, values, 0), axis, 0).reshape(len(x), -1)
+        w = np.moveaxis(valid, axis, 0).reshape(len(x), -1)
+        # weighted least squares for every column at once
+        vander = np.polynomial.polynomial.polyvander(x, order)  # (n, order + 1)
+        a = np.einsum('nm,nk,nl->mkl', w, vander, vander)
+        rhs = np.einsum('nm,nk,nm->mk', w, vander, y)
+        coef = np.linalg.solve(a + 1e-12*np.eye(order + 1), rhs[:, :, None])[:, :, 0]
+        fitted = np.einsum('nk,mk->nm', vander, coef)
+        values = np.moveaxis(fitted.reshape(np.moveaxis(values, axis, 0).shape), 0, axis)
+    elif sigma is not None:
+        # normalized convolution, so that missing values do not pull the edge towards zero
+        weight = ndimage.gaussian_filter(valid.astype(float), sigma, mode='nearest')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = ndimage.gaussian_filter(np.where(valid, values, 0), sigma, mode='nearest')/weight
+    else:
+        values = np.where(valid, values, np.nan)
+    return RegularDataArray(values, delta=edge.delta, coord_min=edge.coord_min, dims=edge.dims, name=edge.name,
+                            coords=edge.coords, copy=False)
+
+
+def shift_channels(data: RegularDataArray, offsets, energy_axis: int = -1, workers: int = None) -> RegularDataArray:
+    """Move every EDC of ``data`` down in energy by its offset, so that an edge at ``offset`` moves to zero offset.
+    Elements shifted in from outside of the energy range are NaN.
+
+    :param offsets: Energy offsets broadcastable against ``data`` without its energy axis, e.g. the edge map of
+        :func:`fit_edges` minus the Fermi level, with size 1 along summed axes
+    """
+    energy_axis = energy_axis % data.ndim
+    edcs = np.moveaxis(np.asarray(data.values), energy_axis, -1)
+    offsets = np.asarray(offsets.values if isinstance(offsets, RegularDataArray) else offsets, dtype=float)
+    shifts = np.broadcast_to(offsets/data.delta[energy_axis], edcs.shape[:-1]).reshape(-1, 1)
+    mat = apply_shifts(edcs.reshape(-1, edcs.shape[-1]), shifts, axis=0, workers=workers)
+    mat = np.moveaxis(mat.reshape(edcs.shape), -1, energy_axis)
+    return RegularDataArray(mat, delta=data.delta, coord_min=data.coord_min, dims=data.dims, name=data.name,
+                            coords=data.coords, copy=False)
+
+
+def correct(data: RegularDataArray, energy_axis: int = -1, reference: RegularDataArray = None, sum_axes=(),
+            fermi_level: float = None, sigma=None, order: int = None, smooth_axis: int = 0,
+            temperature: float = 20.0, workers: int = None) -> RegularDataArray:
+    """Fit the Fermi edge of every channel, smooth it, and shift every channel of ``data`` onto one Fermi level.
+
+    :param reference: Data to fit the edges on, e.g. a gold reference with the same channels, or None to fit
+        ``data`` itself
+    :param sum_axes: Axes of ``reference`` summed over before fitting. The edge is taken to be constant along them
+    :param fermi_level: The energy the edges are moved to, by default the mean of the smoothed edge
+    :param sigma: See :func:`smooth_edge`
+    :param order: See :func:`smooth_edge`
+    :param smooth_axis: The axis of the edge map, i.e. of the axes of ``data`` that are neither the energy axis nor
+        summed over, along which the polynomial of ``order`` is fitted
+    :return: The corrected data on the grid of ``data``
+    """
+    reference = data if reference is None else reference
+    if reference.ndim != data.ndim:
+        raise ValueError("The reference must have the same axes as the data")
+    energy_axis = energy_axis % data.ndim
+    fits = fit_edges(reference, energy_axis, sum_axes, temperature, workers=workers)
+    edge = smooth_edge(fits['ef'], sigma, order, fits['converged'], smooth_axis)
+    ef = np.asarray(edge.values)
+    if fermi_level is None:
+        fermi_level = np.nanmean(ef)
+    # put back the summed axes with size 1 to broadcast the edge map against the data
+    sum_axes = sorted({a % data.ndim for a in np.atleast_1d(sum_axes).astype(int)})
+    ef = np.expand_dims(ef, tuple(a - (a > energy_axis) for a in sum_axes))
+    return shift_channels(data, np.nan_to_num(ef - fermi_level), energy_axis, workers)
@@ -0,0 +1,96 @@
+"""The single-file format of :meth:`RegularDataArray.save`.
+
+A file is laid out as::
+
+    magic          8 bytes   b'PYIMGTL\\x00'
+    header length  8 bytes   little-endian uint64
+    header         JSON, space padded so that the data block starts on an ALIGNMENT boundary
+    data block     raw C-order bytes of the data
+    mask block     raw C-order bytes of the mask, if any, also aligned
+
+The header holds the format version, the grid (``delta``, ``coord_min``, ``dims``, ``name``), and the dtype, shape
+and offset of each block, so opening a file reads only the header and memory-maps the blocks.
+"""
+import json
+import os
+
+import numpy as np
+
+MAGIC = b'PYIMGTL\x00'
+VERSION = 1
+ALIGNMENT = 4096
+
+
+def _align(n: int) -> int:
+    return -(-n // ALIGNMENT)*ALIGNMENT
+
+
+def _block(arr, offset: int) -> dict:
+    return {'dtype': np.lib.format.dtype_to_descr(arr.dtype), 'shape': list(arr.shape), 'offset': offset}
+
+
+def _nbytes(arr) -> int:
+    return int(np.prod(arr.shape))*arr.dtype.itemsize
+
+
+def write(path, data, meta: dict, mask=None):
+    """Write ``data`` (an array, or a lazy array sliceable along its first axis) and an optional mask
+
+    :param meta: JSON serializable grid information stored in the header
+    """
+    # the header length depends on the offsets it contains, so size it with generous offsets first
+    header = dict(meta, version=VERSION, data=_block(data, 2**62),
+                  mask=None if mask is None else _block(mask, 2**62))
+    start = _align(len(MAGIC) + 8 + len(json.dumps(header).encode()))
+    header['data'] = _block(data, start)
+    if mask is not None:
+        header['mask'] = _block(mask, _align(start + _nbytes(data)))
+    encoded = json.dumps(header).encode()
+    encoded += b' '*(start - len(MAGIC) - 8 - len(encoded))
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(encoded)).astype('<u8').tobytes())
+        f.write(encoded)
+        if isinstance(data, np.ndarray):
+            f.write(np.ascontiguousarray(data).data)
+        else:  # lazy arrays are written one slab at a time
+            for i in range(data.shape[0]):
+                f.write(np.ascontiguousarray(data[i], dtype=data.dtype).data)
+        if mask is not None:
+            f.seek(header['mask']['offset'])
+            f.write(np.ascontiguousarray(mask).data)
+
+
+def read_header(path) -> dict:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{os.fspath(path)} is not a PyImageTool file")
+        n = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(n).decode())
+    if header.get('version', 0) > VERSION:
+        raise ValueError(f"{os.fspath(path)} has format version {header['version']}, newer than this PyImageTool "
+                         f"supports ({VERSION})")
+    return header
+
+
+def read(path, mmap_mode='r'):
+    """Open a file written by :func:`write`.
+
+    :param mmap_mode: Memory-map the blocks with this mode, or read them into memory if None
+    :return: (data, header, mask)
+    """
+    header = read_header(path)
+
+    def block(spec):
+        dtype = np.dtype(np.lib.format.descr_to_dtype(spec['dtype']))
+        shape = tuple(spec['shape'])
+        if mmap_mode is None:
+            with open(path, 'rb') as f:
+                f.seek(spec['offset'])
+                return np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode=mmap_mode, offset=spec['offset'], shape=shape)
+
+    mask = None if header['mask'] is None else block(header['mask'])
+    return block(header['data']), header, mask
@@ -1,13 +1,20 @@
 from pyqtgraph.Qt import QtCore, QtWidgets
+from concurrent.futures import ThreadPoolExecutor, Future
 from functools import partial
 from typing import Union
 import pyqtgraph as pg
 import numpy as np
-import warnings
 
 from .widgets import InfoBar
 from .PGImageTool import PGImageTool
 from .DataMatrix import RegularDataArray
+from .MemoryBudget import budget
+from .Events import EventHistogram
+from .RingBuffer import RingBuffer
+from . import Sidecar
+from . import KSpace
+from . import Symmetrize
+from .Pipeline import Pipeline
 
 try:
     import xarray as xr
@@ -21,25 +28,46 @@ class ImageTool(QtWidgets.QWidget):
     LayoutSimple = PGImageTool.LayoutSimple
     LayoutComplete = PGImageTool.LayoutComplete
     LayoutRaster = PGImageTool.LayoutRaster
+    events_rebinned = QtCore.Signal(object)
+    events_rebin_failed = QtCore.Signal(str)
 
     def __init__(self, data: DataType,
                  layout: int = PGImageTool.LayoutSimple, parent=None):
         """Create an ImageTool QWidget.
-        :param data: A RegularDataArray, numpy.array, or xarray.DataArray
+        :param data: A RegularDataArray, numpy.array, xarray.DataArray, an EventHistogram which can be rebinned
+            with :meth:`rebin_events`, a RingBuffer holding a live acquisition, see :meth:`refresh_live`, or a
+            Pipeline, whose last stage is shown, see :meth:`show_stage`
         :param layout: An int that defines the layout. See PGImageTool for layout definitions
         :param parent: QWidget that will be this widget's parent
         """
         super().__init__(parent)
-        # Warn user about nan
-        if hasattr(data, 'values'):
-            d = data.values
+        self.events: EventHistogram = None
+        self._rebin_pool: ThreadPoolExecutor = None
+        self._append_buffers: dict = {}  # 'values' or 'mask' -> (storage, its filled part, axis), see _grow
+        self.ring: RingBuffer = None
+        self.sidecar: Sidecar.Sidecar = None
+        self.views: list = []  # (name, data underneath) of every view shown, innermost first, see _show_view
+        self.pipeline: Pipeline = None
+        self.stage: int = -1  # the pipeline stage shown, -1 for the last one
+        if isinstance(data, Pipeline):
+            self.pipeline = data
+            data = data.output()
+        if isinstance(data, EventHistogram):
+            self.events = data
+            data = data.histogram()
+        if isinstance(data, RingBuffer):
+            self.ring = data
+            data = data.snapshot()
+            if data is None:
+                raise ValueError("The RingBuffer needs at least one frame")
+            self.data: RegularDataArray = data  # a read-only view into the ring, never copied
         else:
-            d = data
-        if np.any(np.isnan(d)):
-            warnings.warn('Input data contains NaNs. All NaN will be set to 0.')
-            d[np.isnan(d)] = 0
-        # Create data
-        self.data: RegularDataArray = RegularDataArray(data)
+            # Create data. NaNs are kept and skipped when binning, and the caller's array is never modified.
+            self.data: RegularDataArray = RegularDataArray(data)
+        resampled = not self.data.is_regular()
+        if resampled:
+            # the image panels need a regular grid, so non-uniform axes are resampled once up front
+            self.data = self.data.regularize()
         self.it_layout: int = layout
         # Create info bar and ImageTool PyQt Widget
         self.info_bar = InfoBar(self.data, parent=self)
@@ -53,14 +81,24 @@ class ImageTool(QtWidgets.QWidget):
         self.layout().addWidget(self.pg_win)
         # Create status bar
         self.status_bar = QtWidgets.QStatusBar(self)
-        self.status_bar.showMessage("Initialized")
+        self.status_bar.showMessage("Initialized" + (", non-uniform axes resampled" if resampled else ""))
+        self.timing_label = QtWidgets.QLabel()
+        self.timing_label.setVisible(False)
+        self.status_bar.addPermanentWidget(self.timing_label)
+        self.timing_timer = QtCore.QTimer(self)
+        self.timing_timer.setInterval(1000)
+        self.timing_timer.timeout.connect(self.update_timings)
         self.layout().addWidget(self.status_bar)
+        self.live_timer = QtCore.QTimer(self)
+        self.live_timer.timeout.connect(self.refresh_live)
         # Connect signals and slots
         self.mouse_move_proxy = pg.SignalProxy(self.pg_win.mouse_hover, rateLimit=30, slot=self.update_status_bar)
         self.build_handlers()
         # TODO: update to QT 5.14 and use textActivated signal instead
         self.info_bar.cmap_combobox.currentTextChanged.connect(self.set_all_cmaps)
         self.info_bar.transpose_request.connect(self.transpose_data)
+        self.events_rebinned.connect(self.set_rebinned_data)
+        self.events_rebin_failed.connect(self.status_bar.showMessage)
 
     def update_status_bar(self, msg: tuple):
         """Slot for mouse move signal"""
@@ -105,6 +143,179 @@ class ImageTool(QtWidgets.QWidget):
                                                 partial(self.pg_win.cursor.set_binwidth, i)))
             self.pg_win.cursor.binwidth[i].value_set.connect(partial(update_doublespinbox_view, dsb))
 
+    @property
+    def profiler(self):
+        """The :class:`UpdateProfiler` timing each stage of the panel updates"""
+        return self.pg_win.profiler
+
+    def show_timings(self, show: bool = True):
+        """Turn update profiling on and show the median stage times of each panel in the status bar, or turn it off"""
+        self.profiler.enabled = show
+        if show:
+            self.timing_timer.start()
+            self.update_timings()
+        else:
+            self.timing_timer.stop()
+        self.timing_label.setVisible(show)
+
+    def update_timings(self):
+        self.timing_label.setText(self.profiler.status_text())
+
+    def memory_usage(self) -> dict:
+        """Bytes of derived data (interpolators, cut caches, statistics...) cached for this tool, by category.
+        All tools share one budget, see :data:`pyimagetool.MemoryBudget.budget`."""
+        return budget.usage_by_category(self.data, self.pg_win)
+
+    def use_sidecar(self, path) -> Future:
+        """Load the precomputed statistics and tables of the data file ``path`` from its sidecar, or rebuild a
+        missing or stale sidecar in the background. See :class:`pyimagetool.Sidecar.Sidecar`.
+
+        :return: A Future tracking the rebuild, or None if a current sidecar was loaded
+        """
+        self.sidecar, loaded, future = Sidecar.attach(self.data, path)
+        self.status_bar.showMessage("Loaded sidecar" if loaded else "Rebuilding sidecar in the background")
+        return future
+
+    def save_sidecar(self):
+        """Write what has been computed for the data since, e.g. the tables of :meth:`get_cuts`, to the sidecar"""
+        if self.sidecar is None:
+            raise ValueError("No sidecar in use, see use_sidecar")
+        self.sidecar.save(self.data)
+
+    def notify_region_changed(self, data: RegularDataArray = None, region=None):
+        """Show data that grew, scrolled or changed in place, recomputing only the affected cuts and keeping the
+        cursor and zoom. See :meth:`PGImageTool.notify_region_changed`.
+
+        :param data: The new data, or None if :attr:`data` was modified in place
+        :param region: Tuple of index slices of the new data that hold new values, or None for everything
+        """
+        if data is not None:
+            self.data = data
+        self.info_bar.set_ranges(self.data)
+        self.pg_win.notify_region_changed(data, region)
+        self.sync_info_bar()
+
+    def append(self, frames, axis: int = -1):
+        """Append frames along ``axis`` and refresh incrementally. With a RingBuffer source the frames go into the
+        ring, otherwise into a buffer that doubles its capacity when full. A mask grows along with the data, with the
+        appended frames unmasked, unless it broadcasts along ``axis``.
+
+        :param frames: Array with the shape of the data except along ``axis``, or one frame without that axis
+        :param axis: The axis to append along. Ignored for a RingBuffer source, which has its own
+        """
+        axis = (self.ring.axis if self.ring is not None else axis) % self.data.ndim
+        frames = np.asarray(frames)
+        if frames.ndim == self.data.ndim - 1:
+            frames = np.expand_dims(frames, axis)
+        if self.ring is not None:
+            for k in range(frames.shape[axis]):
+                self.ring.append(np.take(frames, k, axis=axis))
+            self.refresh_live()
+            return
+        old = self.data
+        if old.coords[axis] is not None:
+            raise ValueError(f"Axis {axis} has explicit coordinates, which appended frames do not extend")
+        n = old.shape[axis]
+        data = RegularDataArray(self._grow('values', old.values, frames, axis), delta=old.delta,
+                                coord_min=old.coord_min, dims=old.dims, name=old.name, coords=old.coords, copy=False)
+        if old.mask is not None:
+            mask = old.mask
+            if mask.shape[axis] > 1:  # otherwise the mask broadcasts over the appended frames too
+                # appended frames are unmasked
+                shape = list(mask.shape)
+                shape[axis] = frames.shape[axis]
+                mask = self._grow('mask', mask, np.ones(shape, dtype=mask.dtype), axis)
+            data.mask = mask  # set directly, since set_mask would copy the growing buffer
+        region = [slice(None)]*data.ndim
+        region[axis] = slice(n, None)
+        self.notify_region_changed(data, tuple(region))
+
+    def _grow(self, name: str, values: np.ndarray, frames: np.ndarray, axis: int) -> np.ndarray:
+        """Write ``frames`` after ``values`` along ``axis`` into the buffer ``name``, whose capacity doubles when
+        full, and return a view of its filled part, so that appending N frames one by one copies O(N) elements in
+        total. The buffer is reused while ``values`` is the view it returned last."""
+        n, k = values.shape[axis], frames.shape[axis]
+        buffer, view, buffer_axis = self._append_buffers.get(name, (None, None, None))
+        dtype = np.result_type(values.dtype, frames.dtype)
+        if buffer is None or values is not view or buffer_axis != axis or buffer.dtype != dtype \
+                or buffer.shape[axis] < n + k:
+            shape = list(values.shape)
+            shape[axis] = max(2*(n + k), 16)
+            buffer = np.empty(shape, dtype=dtype)
+            buffer[(slice(None),)*axis + (slice(0, n),)] = values
+        buffer[(slice(None),)*axis + (slice(n, n + k),)] = frames
+        view = buffer[(slice(None),)*axis + (slice(0, n + k),)]
+        self._append_buffers[name] = (buffer, view, axis)
+        return view
+
+    def refresh_live(self):
+        """Show the frames appended to the RingBuffer source since the last refresh. Connected to
+        :attr:`live_timer`, so ``tool.live_timer.start(50)`` follows an acquisition thread at 20 Hz."""
+        if self.ring is None:
+            raise ValueError("This ImageTool was not created from a RingBuffer")
+        new = self.ring.count - self.data.frame_count
+        if new <= 0:
+            return
+        snapshot = self.ring.snapshot()
+        region = None
+        if self.ring.is_current(self.data):
+            region = [slice(None)]*snapshot.ndim
+            region[self.ring.axis] = slice(max(snapshot.shape[self.ring.axis] - new, 0), None)
+            region = tuple(region)
+        self.notify_region_changed(snapshot, region)
+
+    def sync_info_bar(self):
+        """Show the current cursor state in the info bar without firing its signals"""
+        cursor = self.pg_win.cursor
+        for i in range(self.data.ndim):
+            values = ((self.info_bar.cursor_i[i], cursor.get_index(i)), (self.info_bar.cursor_c[i], cursor.get_pos(i)),
+                      (self.info_bar.bin_i[i], round(cursor.get_binwidth(i)/self.data.delta[i])),
+                      (self.info_bar.bin_c[i], cursor.get_binwidth(i)))
+            for box, value in values:
+                box.blockSignals(True)
+                box.setValue(value)
+                box.blockSignals(False)
+
+    def rebin_events(self, delta=None, coord_min=None, shape=None) -> Future:
+        """Histogram the events again on a new grid in a background thread, and show the result when it is ready.
+        Only grids that have not been computed before, or events appended since, cost any work.
+
+        :param delta: New bin sizes, in the axis order of the events. If only delta is given, the new grid covers
+            the same range as the current one
+        :param coord_min: Center of the first bin along each axis
+        :param shape: Number of bins along each axis
+        :return: A Future resolving to the new RegularDataArray
+        """
+        if self.events is None:
+            raise ValueError("This ImageTool was not created from an EventHistogram")
+        if delta is not None and coord_min is None and shape is None:
+            delta, coord_min, shape = self.events.grid_for(delta)
+        self.events.set_grid(delta, coord_min, shape)
+        if self._rebin_pool is None:
+            self._rebin_pool = ThreadPoolExecutor(1)
+        self.status_bar.showMessage("Rebinning events...")
+        events = self.events
+        future = self._rebin_pool.submit(events.histogram, events.delta, events.coord_min, events.shape)
+        future.add_done_callback(self._rebin_done)
+        return future
+
+    def _rebin_done(self, future: Future):
+        """Runs in the rebinning thread: hand the histogram, or the reason there is none, to the GUI thread"""
+        error = future.exception()
+        if error is None:
+            self.events_rebinned.emit(future.result())
+        else:
+            self.events_rebin_failed.emit(f"Rebinning events failed: {error}")
+
+    def set_rebinned_data(self, data: RegularDataArray):
+        """Slot receiving histograms from :meth:`rebin_events`. Keeps the current axis order."""
+        tr = [data.dims.index(d) for d in self.data.dims]
+        if tr != list(range(data.ndim)):
+            data = data.transpose(tr)
+        self.data = data
+        self.reset()
+        self.status_bar.showMessage(f"Rebinned {self.events.n_events} events onto a {data.shape} grid")
+
     def update_binwidth_index_view(self, spinbox, i, newvalue):
         spinbox.blockSignals(True)
         spinbox.setValue(round(newvalue/self.data.delta[i]))
@@ -119,9 +330,76 @@ class ImageTool(QtWidgets.QWidget):
         self.pg_win.load_ct(cmap_name)
 
     def transpose_data(self, tr):
+        if self.ring is not None:
+            self.status_bar.showMessage("A live RingBuffer cannot be transposed")
+            return
         self.data = self.data.transpose(tr)
         self.reset()
 
+    def show_kspace(self, enable: bool = True, **geometry):
+        """Show the data converted from emission angles to momentum, or go back to the angles. The conversion is
+        lazy: only the cuts on display are converted, as the cursor moves. See :mod:`pyimagetool.KSpace`. Views shown
+        on top of momentum space, e.g. a symmetrization, are removed with it.
+
+        :param geometry: Keywords of :class:`pyimagetool.KSpace.KSpaceConverter`, e.g. ``slit_axis`` and
+            ``kinetic_offset``
+        """
+        if self.ring is not None:
+            self.status_bar.showMessage("A live RingBuffer cannot be converted to momentum")
+            return
+        if not self._show_view('kspace', enable, lambda data: KSpace.converter_for(data, **geometry).view(data)):
+            return
+        self.status_bar.showMessage("Showing momentum space" if enable else "Showing angles")
+
+    def show_symmetrized(self, enable: bool = True, axis: int = 0, center: float = 0.0, mode: str = 'average'):
+        """Show the data symmetrized about ``center`` along ``axis``, or go back to the data. Like the momentum
+        view, the symmetrized view is lazy: only the cuts on display are computed. See
+        :mod:`pyimagetool.Symmetrize`. Views shown on top of the symmetrized data are removed with it.
+        """
+        if self.ring is not None:
+            self.status_bar.showMessage("A live RingBuffer cannot be symmetrized")
+            return
+        if not self._show_view('symmetrize', enable, lambda data: Symmetrize.view(data, axis, center, mode)):
+            return
+        self.status_bar.showMessage(f"Showing {self.data.dims[axis % self.data.ndim]} symmetrized about {center}"
+                                    if enable else "Showing the data")
+
+    def _show_view(self, name: str, enable: bool, make) -> bool:
+        """Show the view ``make(data)`` of the data underneath the view ``name``, or remove that view. Views stack
+        in the order they are shown, and changing or removing one also removes those shown on top of it, whose
+        parameters refer to its data.
+
+        :return: False if there was nothing to remove
+        """
+        names = [view[0] for view in self.views]
+        i = names.index(name) if name in names else len(self.views)
+        if i == len(self.views) and not enable:
+            return False
+        base = self.views[i][1] if i < len(self.views) else self.data
+        data = make(base) if enable else base  # before changing the stack, in case the view can not be made
+        del self.views[i:]
+        if enable:
+            self.views.append((name, base))
+        self.data = data
+        self.reset()
+        return True
+
+    def show_stage(self, i: int = -1):
+        """Show the output of stage ``i`` of the pipeline, computed only where the cuts on display need it"""
+        if self.pipeline is None:
+            raise ValueError("This ImageTool was not created from a Pipeline")
+        self.stage = i
+        self.notify_region_changed(self.pipeline.output(i))
+        self.status_bar.showMessage(f"Showing {self.pipeline.stages[i] if self.pipeline.stages else 'the source'}")
+
+    def set_stage_params(self, i: int, **params):
+        """Change parameters of pipeline stage ``i`` and refresh. Only stage ``i`` and the stages after it are
+        recomputed, and only for the cuts on display."""
+        if self.pipeline is None:
+            raise ValueError("This ImageTool was not created from a Pipeline")
+        self.pipeline.set_params(i, **params)
+        self.show_stage(self.stage)
+
     def keyReleaseEvent(self, e):
         if e.key() == QtCore.Qt.Key_Shift:
             self.pg_win.shift_down = False
@@ -155,3 +433,15 @@ class ImageTool(QtWidgets.QWidget):
         else:
             legalvalues = list(self.pg_win.imgs.keys()) + list(self.pg_win.lineplots_data.keys())
             raise ValueError(f'plot {plot} not found in this ImageTool. Should be one of {legalvalues}')
+
+    def get_cuts(self, axis: Union[int, tuple, str], positions, binwidths=None) -> RegularDataArray:
+        """Get many line or image cuts at once, without moving the cursor. See :meth:`CutEngine.get_cuts`.
+
+        :param axis: An axis index, a pair of axes, or a plot name such as ``z`` or ``xy``
+        :param positions: (N, ndim) cursor positions, or (N, k) positions along the k axes that are averaged over
+        :param binwidths: Bin widths for each axis, or one row per cut. Defaults to the current bin widths
+        :return: RegularDataArray stacking the cuts along a leading ``cut`` axis
+        """
+        if isinstance(axis, str):
+            axis = self.pg_win.coord_to_index[axis.lower()]
+        return self.pg_win.cursor.engine.get_cuts(axis, positions, binwidths)
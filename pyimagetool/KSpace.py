@@ -0,0 +1,248 @@
+"""Conversion of ARPES data from emission angles to momentum.
+
+For a slit angle ``alpha`` and a perpendicular (polar or deflector) angle ``beta``, both in degrees and relative to
+normal emission, a photoelectron of kinetic energy ``Ek`` (eV) has the parallel momentum (1/Angstrom)::
+
+    kx = K*sqrt(Ek)*sin(alpha)
+    ky = K*sqrt(Ek)*cos(alpha)*sin(beta)
+
+with ``K`` = :data:`K_FACTOR`. The conversion samples the angle data at the inverse of this map, on a regular
+(kx, ky) grid, one energy slice at a time.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .DataMatrix import RegularDataArray
+from .LazyArray import LazyArray
+from .MemoryBudget import budget
+from .Parallel import map_chunks, n_workers
+
+K_FACTOR = 0.5123167  # sqrt(2*m_e)/hbar in 1/(Angstrom*sqrt(eV))
+_converters = OrderedDict()  # (source grid, geometry) -> KSpaceConverter, most recently used last
+_converters_lock = threading.Lock()
+
+
+def _bilinear(img: np.ndarray, fa: np.ndarray, fb: np.ndarray) -> np.ndarray:
+    """Sample the 2D ``img`` at the fractional indices (fa, fb). Points outside of ``img`` are NaN."""
+    na, nb = img.shape
+    with np.errstate(invalid='ignore'):
+        valid = (fa >= 0) & (fa <= na - 1) & (fb >= 0) & (fb <= nb - 1)
+    fa = np.where(valid, fa, 0)
+    fb = np.where(valid, fb, 0)
+    i0 = np.minimum(fa.astype(np.intp), max(na - 2, 0))
+    j0 = np.minimum(fb.astype(np.intp), max(nb - 2, 0))
+    i1 = np.minimum(i0 + 1, na - 1)
+    j1 = np.minimum(j0 + 1, nb - 1)
+    wa = (fa - i0).astype(img.dtype)
+    wb = (fb - j0).astype(img.dtype)
+    top = img[i0, j0] + (img[i0, j1] - img[i0, j0])*wb
+    bottom = img[i1, j0] + (img[i1, j1] - img[i1, j0])*wb
+    out = top + (bottom - top)*wa
+    out[~valid] = np.nan
+    return out
+
+
+class KSpaceConverter:
+    """The geometry of an angle-to-momentum conversion, and the regular (kx, ky, E) grid it converts onto.
+
+    A converter is built for the grid of one dataset and converts any dataset on that grid with :meth:`convert`, or
+    lazily with :meth:`view`. The fractional source indices of each energy slice are tabulated once and kept in the
+    memory budget, so further slices of the same energy, e.g. from another scan or from scrubbing back and forth
+    in an ImageTool, cost only the interpolation.
+    """
+
+    def __init__(self, data: RegularDataArray, slit_axis: int = 0, perp_axis: int = None, energy_axis: int = -1,
+                 slit_offset: float = 0.0, perp_offset: float = 0.0, kinetic_offset: float = 0.0, dk=None,
+                 workers: int = None):
+        """
+        :param data: An angle-angle-energy cube or an angle-energy image. Angles are in degrees
+        :param slit_axis: The axis of the angle along the analyzer slit, converted to ``kx``
+        :param perp_axis: The axis of the angle perpendicular to the slit, converted to ``ky``. Defaults to the
+            remaining axis of a cube
+        :param energy_axis: The energy axis, which is kept as it is
+        :param slit_offset: Slit angle of normal emission
+        :param perp_offset: Perpendicular angle of normal emission
+        :param kinetic_offset: Added to the energy axis to obtain kinetic energies, e.g. ``hv - work function``
+            for binding energies
+        :param dk: Momentum step of (kx, ky), or one step for both. Defaults to the angle steps at the highest
+            kinetic energy
+        :param workers: Number of threads converting energy slices in parallel
+        """
+        if data.ndim not in (2, 3):
+            raise ValueError(f"k-space conversion needs angle-energy or angle-angle-energy data, not {data.ndim}D")
+        ndim = data.ndim
+        self.energy_axis = energy_axis % ndim
+        self.slit_axis = slit_axis % ndim
+        if perp_axis is None and ndim == 3:
+            perp_axis = ({0, 1, 2} - {self.slit_axis, self.energy_axis}).pop()
+        self.perp_axis = None if perp_axis is None else perp_axis % ndim
+        angle_axes = [self.slit_axis] + ([] if self.perp_axis is None else [self.perp_axis])
+        if len({self.energy_axis, *angle_axes}) != ndim:
+            raise ValueError("slit_axis, perp_axis and energy_axis must be distinct axes of the data")
+        self.slit_offset = float(slit_offset)
+        self.perp_offset = float(perp_offset)
+        self.kinetic_offset = float(kinetic_offset)
+        self.workers = n_workers(workers)
+        self.source_grid = (data.shape, tuple(data.delta), tuple(data.coord_min))
+        self.angles = [np.asarray(data.axes[a], dtype=float) for a in angle_axes]
+        self.kinetic = np.asarray(data.axes[self.energy_axis], dtype=float) + self.kinetic_offset
+
+        # the widest momentum range is reached at the highest kinetic energy
+        k0 = K_FACTOR*np.sqrt(max(self.kinetic.max(), 0))
+        alpha = np.deg2rad(self.angles[0][[0, -1]] - self.slit_offset)
+        limits = [k0*np.sin(alpha)]
+        if self.perp_axis is not None:
+            beta = np.deg2rad(self.angles[1][[0, -1]] - self.perp_offset)
+            cos_max = 1.0 if alpha[0] <= 0 <= alpha[1] else np.cos(alpha).max()
+            limits.append(k0*cos_max*np.sin(beta))
+        steps = [k0*np.deg2rad(data.delta[a]) for a in angle_axes]
+        if dk is not None:
+            steps = list(np.broadcast_to(np.asarray(dk, dtype=float), (len(angle_axes),)))
+        self.k_min = [lim.min() for lim in limits]
+        self.dk = [float(s) for s in steps]
+        self.k_shape = [int(np.floor((lim.max() - lim.min())/s + 1e-9)) + 1 for lim, s in zip(limits, steps)]
+        self.k_axes = [m + s*np.arange(n) for m, s, n in zip(self.k_min, self.dk, self.k_shape)]
+
+        self.shape = list(data.shape)
+        self.delta = np.array(data.delta, dtype=float)
+        self.coord_min = np.array(data.coord_min, dtype=float)
+        dims = list(data.dims)
+        for a, name, m, s, n in zip(angle_axes, ('kx', 'ky'), self.k_min, self.dk, self.k_shape):
+            self.shape[a], self.delta[a], self.coord_min[a], dims[a] = n, s, m, name
+        self.shape = tuple(self.shape)
+        self.dims = tuple(dims)
+
+    def __repr__(self):
+        return f"KSpaceConverter[{self.source_grid[0]} -> {self.shape}, dims {self.dims}]"
+
+    def _check(self, data: RegularDataArray):
+        if (data.shape, tuple(data.delta), tuple(data.coord_min)) != self.source_grid:
+            raise ValueError(f"{data} is not on the grid this converter was built for")
+
+    def source_indices(self, e: int, kx=slice(None), ky=slice(None)):
+        """Fractional indices into the angle axes from which the momenta ``kx`` x ``ky`` are sampled at energy
+        index ``e``. Tables of whole slices are cached in the memory budget.
+
+        :param kx: Index array or slice into the kx axis
+        :param ky: Index array or slice into the ky axis, ignored for angle-energy data
+        :return: (slit indices, perpendicular indices or None), each of shape (len(kx), len(ky))
+        """
+        whole = isinstance(kx, slice) and kx == slice(None) and isinstance(ky, slice) and ky == slice(None)
+        if whole:
+            return budget.get_or_compute(self, 'kspace_tables', int(e), lambda: self._indices(e, kx, ky))
+        return self._indices(e, kx, ky)
+
+    def _indices(self, e, kx, ky):
+        k0 = K_FACTOR*np.sqrt(self.kinetic[e]) if self.kinetic[e] > 0 else 0.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            s = self.k_axes[0][kx][:, None]/k0
+            alpha = np.rad2deg(np.arcsin(s)) + self.slit_offset
+            fa = np.interp(alpha, self.angles[0], np.arange(len(self.angles[0])), left=np.nan, right=np.nan)
+            if self.perp_axis is None:
+                return fa.astype(np.float32), None
+            t = self.k_axes[1][ky][None, :]/(k0*np.sqrt(1 - s**2))
+            beta = np.rad2deg(np.arcsin(t)) + self.perp_offset
+            fb = np.interp(beta, self.angles[1], np.arange(len(self.angles[1])), left=np.nan, right=np.nan)
+        return fa.astype(np.float32), fb.astype(np.float32)
+
+    def _slice(self, data: RegularDataArray, e: int, kx, ky) -> np.ndarray:
+        """The momentum image at energy index ``e``, of shape (len(kx), len(ky)), or (len(kx),) for
+        angle-energy data"""
+        fa, fb = self.source_indices(e, kx, ky)
+        if fb is None:
+            fb = np.zeros_like(fa)
+        # only the bounding box of the sampled angles is read, which matters for lazily loaded data
+        box = []
+        for f, n in ((fa, len(self.angles[0])), (fb, 1 if self.perp_axis is None else len(self.angles[1]))):
+            finite = f[np.isfinite(f)]
+            if finite.size == 0:
+                return np.full(fa.shape if self.perp_axis is not None else fa.shape[0], np.nan)
+            box.append((int(finite.min()), min(int(np.ceil(finite.max())) + 1, n)))
+        key = [slice(None)]*data.ndim
+        key[self.energy_axis] = int(e)
+        key[self.slit_axis] = slice(*box[0])
+        if self.perp_axis is not None:
+            key[self.perp_axis] = slice(*box[1])
+        img = np.asarray(data.values[tuple(key)])
+        if data.mask is not None:
+            mask = data.mask[tuple(k if n > 1 else (0 if isinstance(k, int) else slice(None))
+                                   for k, n in zip(key, data.mask.shape))]
+            img = np.where(mask != 0, img, np.nan)
+        remaining = [a for a in range(data.ndim) if a != self.energy_axis]
+        if self.perp_axis is None:
+            img = img[:, None]
+        elif remaining.index(self.slit_axis) == 1:
+            img = img.T
+        img = img.astype(np.result_type(img.dtype, np.float32), copy=False)
+        out = _bilinear(img, fa - box[0][0], fb - box[1][0])
+        return out if self.perp_axis is not None else out[:, 0]
+
+    def convert(self, data: RegularDataArray) -> RegularDataArray:
+        """Convert all of ``data``, with energy slices spread over :attr:`workers` threads"""
+        return RegularDataArray(np.asarray(KSpaceArray(self, data)), delta=self.delta, coord_min=self.coord_min,
+                                dims=self.dims, name=data.name, copy=False)
+
+    def view(self, data: RegularDataArray) -> RegularDataArray:
+        """``data`` in momentum space, converted lazily: only the elements that are indexed, e.g. the slices shown
+        by an ImageTool, are ever computed. See :class:`KSpaceArray`."""
+        out = RegularDataArray(KSpaceArray(self, data), delta=self.delta, coord_min=self.coord_min, dims=self.dims,
+                               name=data.name)
+        out._has_nan = True  # momenta outside of the measured angles
+        return out
+
+
+class KSpaceArray(LazyArray):
+    """The momentum-space version of an angle dataset, computed from the angles as it is indexed"""
+
+    def __init__(self, converter: KSpaceConverter, data: RegularDataArray):
+        converter._check(data)
+        self.converter = converter
+        self.data = data
+        self.shape = converter.shape
+        self.dtype = np.dtype(np.result_type(data.values.dtype, np.float32))
+
+    def _getitem(self, key):
+        cv = self.converter
+        sel = [np.atleast_1d(np.arange(n)[k]) for k, n in zip(key, self.shape)]
+        energies = sel[cv.energy_axis]
+        kx = key[cv.slit_axis] if key[cv.slit_axis] == slice(None) else sel[cv.slit_axis]
+        if cv.perp_axis is None:
+            ky, nky = slice(None), None
+        else:
+            ky = key[cv.perp_axis] if key[cv.perp_axis] == slice(None) else sel[cv.perp_axis]
+            nky = len(sel[cv.perp_axis])
+        block = np.empty((len(energies), len(sel[cv.slit_axis])) + (() if nky is None else (nky,)), dtype=self.dtype)
+
+        def work(chunk):
+            for n in chunk:
+                block[n] = cv._slice(self.data, energies[n], kx, ky)
+
+        map_chunks(work, np.array_split(np.arange(len(energies)), max(min(cv.workers, len(energies)), 1)), cv.workers)
+        # block is ordered (energy, kx, ky): put the axes back in the order of the data and drop the int indices
+        order = [cv.energy_axis, cv.slit_axis] + ([] if cv.perp_axis is None else [cv.perp_axis])
+        block = block.transpose([order.index(a) for a in range(len(order))])
+        return block[tuple(0 if not isinstance(k, slice) else slice(None) for k in key)]
+
+
+def converter_for(data: RegularDataArray, **geometry) -> KSpaceConverter:
+    """A :class:`KSpaceConverter` for the grid of ``data`` and ``geometry``. The last few converters are kept, so
+    that scans sharing a grid and a geometry share their tables."""
+    key = (data.shape, tuple(data.delta), tuple(data.coord_min), tuple(data.dims),
+           tuple(sorted((k, np.asarray(v).tobytes() if v is not None else None) for k, v in geometry.items())))
+    with _converters_lock:
+        if key in _converters:
+            _converters.move_to_end(key)
+            return _converters[key]
+    converter = KSpaceConverter(data, **geometry)
+    with _converters_lock:
+        _converters[key] = converter
+        while len(_converters) > 8:
+            _converters.popitem(last=False)
+    return converter
+
+
+def convert(data: RegularDataArray, **geometry) -> RegularDataArray:
+    """Convert ``data`` from angles to momentum. See :class:`KSpaceConverter` for the geometry keywords."""
+    return converter_for(data, **geometry).convert(data)
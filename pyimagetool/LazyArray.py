@@ -0,0 +1,209 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _normalize_key(key, shape):
+    """Expand an index of ints and slices (and at most one Ellipsis) to one entry per axis, with ints made
+    non-negative"""
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        i = next(i for i, k in enumerate(key) if k is Ellipsis)
+        key = key[:i] + (slice(None),)*(len(shape) - len(key) + 1) + key[i + 1:]
+    key = key + (slice(None),)*(len(shape) - len(key))
+    if len(key) != len(shape):
+        raise IndexError(f"Too many indices for an array of shape {shape}")
+    out = []
+    for k, n in zip(key, shape):
+        if isinstance(k, slice):
+            out.append(k)
+        else:
+            k = int(k)
+            if not -n <= k < n:
+                raise IndexError(f"Index {k} is out of bounds for an axis of size {n}")
+            out.append(k % n)
+    return tuple(out)
+
+
+class LazyArray:
+    """Base class for read-only arrays whose elements are only read when they are indexed.
+
+    A :class:`RegularDataArray` keeps a LazyArray as its data without copying or loading it. Indexing with ints
+    and slices returns a :class:`np.ndarray` holding only the selected elements, which is all the cursor needs to
+    compute cuts. Anything else, e.g. ``np.asarray``, loads the whole array.
+
+    Subclasses define ``shape``, ``dtype`` and :meth:`_getitem`, which receives one int or slice per axis.
+    """
+    shape: tuple = ()
+    dtype = np.dtype(float)
+
+    def __repr__(self):
+        return f"{type(self).__name__}[shape {self.shape}, {self.dtype}]"
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self._getitem(_normalize_key(key, self.shape))
+
+    def _getitem(self, key) -> np.ndarray:
+        raise NotImplementedError
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[...]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def copy(self):
+        """LazyArrays are read-only, so a copy is the array itself"""
+        return self
+
+    def transpose(self, *axes):
+        """A lazy view with permuted axes, see :class:`TransposedView`"""
+        if len(axes) == 1 and not isinstance(axes[0], int):
+            axes = axes[0]
+        if axes is None or len(axes) == 0:
+            axes = tuple(reversed(range(self.ndim)))
+        return TransposedView(self, axes)
+
+    @property
+    def T(self):
+        return self.transpose()
+
+
+class TransposedView(LazyArray):
+    """A LazyArray with the axes of another one permuted. Indexing reads only the selected elements of the base."""
+
+    def __init__(self, base: LazyArray, axes):
+        axes = tuple(int(a) % base.ndim for a in axes)
+        if sorted(axes) != list(range(base.ndim)):
+            raise ValueError(f"{axes} is not a permutation of the axes of {base}")
+        if isinstance(base, TransposedView):
+            axes = tuple(base.axes[a] for a in axes)
+            base = base.base
+        self.base = base
+        self.axes = axes
+        self.shape = tuple(base.shape[a] for a in axes)
+        self.dtype = base.dtype
+
+    def _getitem(self, key):
+        base_key = [None]*self.ndim
+        for k, a in zip(key, self.axes):
+            base_key[a] = k
+        out = self.base._getitem(tuple(base_key))
+        kept = [a for k, a in zip(key, self.axes) if isinstance(k, slice)]
+        order = sorted(kept)
+        return out.transpose([order.index(a) for a in kept])
+
+
+class IndexedArray(LazyArray):
+    """Wraps an array that is computed or loaded when indexed, such as a dask array or an xarray Variable with a
+    lazy file backend, so that only the indexed part is ever computed."""
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = tuple(array.shape)
+        self.dtype = np.dtype(array.dtype)
+
+    def _getitem(self, key):
+        part = self.array[key]
+        if hasattr(part, 'compute'):
+            part = part.compute()
+        return np.asarray(getattr(part, 'values', part))
+
+
+class NpyStack(LazyArray):
+    """Equally shaped frames stored in separate ``.npy`` files, presented as one array with the frames stacked
+    along ``axis``. Frames are memory-mapped when first indexed, and at most ``max_open`` stay open."""
+
+    def __init__(self, files, axis: int = 0, max_open: int = 64):
+        """
+        :param files: Sequence of ``.npy`` paths in stacking order
+        :param axis: Position of the stacking axis
+        :param max_open: Number of memory-mapped frames kept open
+        """
+        self.files = [os.fspath(f) for f in files]
+        if not self.files:
+            raise ValueError("No frames to stack")
+        first = np.load(self.files[0], mmap_mode='r')
+        self.frame_shape = first.shape
+        self.dtype = first.dtype
+        self.axis = axis % (len(self.frame_shape) + 1)
+        shape = list(self.frame_shape)
+        shape.insert(self.axis, len(self.files))
+        self.shape = tuple(shape)
+        self.max_open = max(int(max_open), 1)
+        self._open = OrderedDict()  # frame number -> memmap, least recently used first
+        self._lock = threading.Lock()
+        self.frames_opened = 0  # number of times a frame file was opened, for diagnostics
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_open'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def frame(self, k: int) -> np.ndarray:
+        """The memory-mapped frame ``k``"""
+        with self._lock:
+            if k in self._open:
+                self._open.move_to_end(k)
+                return self._open[k]
+        frame = np.load(self.files[k], mmap_mode='r')
+        if frame.shape != self.frame_shape or frame.dtype != self.dtype:
+            raise ValueError(f"Frame {self.files[k]} has shape {frame.shape} and dtype {frame.dtype}, "
+                             f"expected {self.frame_shape} and {self.dtype}")
+        with self._lock:
+            self.frames_opened += 1
+            self._open[k] = frame
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return frame
+
+    def _getitem(self, key):
+        stack_key = key[self.axis]
+        frame_key = key[:self.axis] + key[self.axis + 1:]
+        if not isinstance(stack_key, slice):
+            return np.array(self.frame(stack_key)[frame_key])
+        frames = range(*stack_key.indices(len(self.files)))
+        # the stacking axis moves left by one for every int indexing a frame axis before it
+        out_axis = self.axis - sum(not isinstance(k, slice) for k in key[:self.axis])
+        out = None
+        for n, k in enumerate(frames):
+            part = self.frame(k)[frame_key]
+            if out is None:
+                shape = list(np.shape(part))
+                shape.insert(out_axis, len(frames))
+                out = np.empty(shape, dtype=self.dtype)
+            out[(slice(None),)*out_axis + (n,)] = part
+        if out is None:
+            shape = [len(range(*k.indices(n))) for k, n in zip(frame_key, self.frame_shape) if isinstance(k, slice)]
+            shape.insert(out_axis, 0)
+            out = np.empty(shape, dtype=self.dtype)
+        return out
+
+
+def _natural_key(path):
+    """Sort key ordering ``step2.npy`` before ``step10.npy``"""
+    return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', os.path.basename(path))]
+
+
+def npy_files(path, pattern: str = '.npy'):
+    """The files in directory ``path`` ending with ``pattern``, in natural order"""
+    files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith(pattern)]
+    return sorted(files, key=_natural_key)
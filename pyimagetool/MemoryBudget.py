@@ -0,0 +1,161 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _default_limit():
+    """A quarter of the physical memory, or 2 GiB where that cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 4
+    except (ValueError, OSError, AttributeError):
+        return 2**31
+
+
+def nbytes_of(value) -> int:
+    """Estimate the memory held by a cached value. Understands arrays, objects with an ``nbytes`` attribute, and
+    tuples, lists and dicts of those. Anything else counts as zero."""
+    if isinstance(value, np.memmap):
+        return 0  # backed by a file, not by RAM
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(v) for v in value.values())
+    return 0
+
+
+class MemoryBudget:
+    """A process-wide, least-recently-used store for data derived from arrays: interpolators, cuts, statistics,
+    prefix sums, pyramids and so on.
+
+    Every entry belongs to an owner object (usually a :class:`RegularDataArray`) and a category. Entries are
+    evicted least-recently-used first, across all owners and categories, whenever the total exceeds ``limit``.
+    Owners are held by weak reference, and their entries are released when the owner is garbage collected.
+    """
+
+    def __init__(self, limit: int = None):
+        """:param limit: Maximum number of bytes to keep. Defaults to a quarter of the physical memory, and can
+        be overridden with the ``PYIMAGETOOL_CACHE_BYTES`` environment variable."""
+        if limit is None:
+            limit = int(os.environ.get('PYIMAGETOOL_CACHE_BYTES', _default_limit()))
+        self._limit = int(limit)
+        self._lock = threading.RLock()
+        self._entries: OrderedDict = OrderedDict()  # (owner id, category, key) -> (value, nbytes)
+        self._owners = {}  # owner id -> weakref to owner
+        self._total = 0
+
+    def __repr__(self):
+        return f"MemoryBudget[{self._total}/{self._limit} bytes, {len(self._entries)} entries]"
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, newval: int):
+        with self._lock:
+            self._limit = int(newval)
+            self._evict()
+
+    def get(self, owner, category: str, key=None, default=None):
+        """Return a cached value and mark it as recently used, or ``default`` if it is not cached."""
+        k = (id(owner), category, key)
+        with self._lock:
+            if k not in self._entries:
+                return default
+            self._entries.move_to_end(k)
+            return self._entries[k][0]
+
+    def put(self, owner, category: str, key, value, nbytes: int = None):
+        """Cache ``value`` and return it. Values larger than the whole budget are returned without being cached.
+
+        :param nbytes: Memory held by value. Estimated with :func:`nbytes_of` if not given
+        """
+        if nbytes is None:
+            nbytes = nbytes_of(value)
+        oid = id(owner)
+        k = (oid, category, key)
+        with self._lock:
+            self._remove(k)
+            if nbytes > self._limit:
+                return value
+            if oid not in self._owners:
+                self._owners[oid] = weakref.ref(owner, _discard_callback(self, oid))
+            self._entries[k] = (value, nbytes)
+            self._total += nbytes
+            self._evict()
+        return value
+
+    def get_or_compute(self, owner, category: str, key, compute, nbytes=None):
+        """Return the cached value, or call ``compute()`` and cache its result.
+
+        :param nbytes: Either the size in bytes, or a function mapping the computed value to its size
+        """
+        value = self.get(owner, category, key, _missing)
+        if value is _missing:
+            value = compute()
+            self.put(owner, category, key, value, nbytes(value) if callable(nbytes) else nbytes)
+        return value
+
+    def items(self, owner, category: str) -> list:
+        """The (key, value) pairs cached for ``owner`` in ``category``, without marking them as used"""
+        oid = id(owner)
+        with self._lock:
+            return [(k[2], v[0]) for k, v in self._entries.items() if k[0] == oid and k[1] == category]
+
+    def discard(self, owner, category: str = None):
+        """Drop every entry of ``owner``, or only those in ``category``"""
+        self._discard_id(id(owner), category)
+
+    def _discard_id(self, oid, category=None):
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == oid and (category is None or k[1] == category)]:
+                self._remove(k)
+            if category is None or not any(k[0] == oid for k in self._entries):
+                self._owners.pop(oid, None)
+
+    def usage(self, *owners) -> int:
+        """Total cached bytes, or the bytes belonging to the given owners"""
+        if not owners:
+            return self._total
+        return sum(self.usage_by_category(*owners).values())
+
+    def usage_by_category(self, *owners) -> dict:
+        """Cached bytes of the given owners (all owners if none given), broken down by category"""
+        ids = {id(o) for o in owners}
+        out = {}
+        with self._lock:
+            for (oid, category, _), (_, nbytes) in self._entries.items():
+                if not ids or oid in ids:
+                    out[category] = out.get(category, 0) + nbytes
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owners.clear()
+            self._total = 0
+
+    def _remove(self, k):
+        entry = self._entries.pop(k, None)
+        if entry is not None:
+            self._total -= entry[1]
+
+    def _evict(self):
+        while self._total > self._limit and self._entries:
+            k, (_, nbytes) = self._entries.popitem(last=False)
+            self._total -= nbytes
+
+
+def _discard_callback(mb: MemoryBudget, oid: int):
+    """Weakref callback that drops an owner's entries once it has been garbage collected"""
+    return lambda _: mb._discard_id(oid)
+
+
+_missing = object()
+
+budget = MemoryBudget()  # the process-wide budget shared by every ImageTool
@@ -1,6 +1,7 @@
 import numpy as np
 from typing import Dict, List, Tuple, Union
 from functools import partial
+from contextlib import contextmanager
 from collections.abc import Iterable
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtGui, QtCore
@@ -8,7 +9,10 @@ from pyqtgraph.GraphicsScene.mouseEvents import HoverEvent
 
 from .DataMatrix import RegularDataArray
 from .cmaps import CMap
-from .DataModel import ValueLimitedModel
+from .DataModel import SingleValueModel, ValueLimitedModel
+from .Profiler import UpdateProfiler
+from .CutEngine import CutEngine
+from .PeakFit import PeakFitter, track_peak
 from pyimagetool.pgwidgets.BinningLine import BinningLine
 from pyimagetool.pgwidgets.ImageSlice import ImageSlice
 
@@ -22,6 +26,7 @@ class PGImageTool(pg.GraphicsLayoutWidget):
     index_to_coord: List[str] = ['x', 'y', 'z', 't']
     frame_rate = 60
     bin_pen = pg.mkPen(style=pg.Qt.QtCore.Qt.DashLine)
+    fit_pen = pg.mkPen('r', width=2, style=pg.Qt.QtCore.Qt.DashLine)
 
     mouse_hover = QtCore.Signal(str)  # event fired when the mouse moves on an image
 
@@ -35,10 +40,14 @@ class PGImageTool(pg.GraphicsLayoutWidget):
         self.tool_layout: int = layout
 
         self.cursor: Cursor = Cursor(data)
+        self.profiler = UpdateProfiler()  # disabled until profiler.enabled is set
+        self.cursor.profiler = self.profiler
 
         self.lineplots: Dict[str, Tuple[pg.PlotItem, str]] = {}  # dict of (PlotItem, orient), orient = 'h' or 'v'
         self.lineplots_data: Dict[str, Tuple[pg.PlotDataItem, str]] = {}  # dict of PlotDataItems, orient = 'h' or 'v'
         self.cursor_lines: Dict[str, List[BinningLine]] = {}  # dict of cursor lines for 'x', 'y', 'z', etc.
+        self.fit_overlays: Dict[str, Tuple[pg.PlotDataItem, PeakFitter]] = {}  # fitted curve over a line panel
+        self.peak_overlays: Dict[str, Tuple[pg.PlotDataItem, dict]] = {}  # tracked peaks over an image panel
         self.imgs: Dict[str, ImageSlice] = {}  # a dictionary of ImageItems
         self.img_tr: Dict[str, QtGui.QTransform] = {}  # a dictionary of transforms going from index to coordinates
         self.img_tr_inv: Dict[str, QtGui.QTransform] = {}  # a dictionary of transforms going from coordinates to index
@@ -58,6 +67,8 @@ class PGImageTool(pg.GraphicsLayoutWidget):
 
         self.status_bar: str = ''  # string representing current mouse location
 
+        self._refreshing = False  # True while notify_region_changed updates the cursor
+
         self.load_ct(self.ct_name)
         self.build_layout()  # add plots according to chosen layout which populates self.lineplots and self.img_axes
         self.create_items()  # now that axes are ready, make ImageItems, PlotDataItems, and Cursor lines
@@ -82,6 +93,9 @@ class PGImageTool(pg.GraphicsLayoutWidget):
                 plot_item.setData(self.data.axes[i], linedata)
             else:
                 plot_item.setData(linedata, self.data.axes[i])
+            if key in self.fit_overlays:
+                self.fit_overlays[key][1].result = None  # do not start from fits to the old data
+                self.update_fit(key, self.cursor.get_cut(i).squeeze())
         # Update the image plots
         for key, img_ax in self.imgs.items():
             i, j = self.coord_to_index[key]
@@ -91,6 +105,8 @@ class PGImageTool(pg.GraphicsLayoutWidget):
                 img_ax.set_data(self.data.isel(*selector).squeeze())
             else:
                 img_ax.set_data(self.data.isel(*selector).squeeze().T)
+            if key in self.peak_overlays:
+                self.update_peaks(key, self.cursor.get_cut((i, j)).squeeze())
             if img_ax.aspect_ui.lockAspect.isChecked():
                 img_ax.aspect_ui.lockAspect.click()
             img_ax.vb.setXRange(self.data.coord_min[i], self.data.coord_max[i])
@@ -216,6 +232,8 @@ class PGImageTool(pg.GraphicsLayoutWidget):
                 img_ax.set_data(self.data.isel(*selector).squeeze(), lut=self.ct)
             else:
                 img_ax.set_data(self.data.isel(*selector).squeeze().T, lut=self.ct)
+            img_ax.img.profiler = self.profiler
+            img_ax.img.panel = key
             self.img_tr[key] = img_ax.img.transform()
             self.img_tr_inv[key], _ = img_ax.img.transform().inverted()
 
@@ -258,36 +276,192 @@ class PGImageTool(pg.GraphicsLayoutWidget):
                 plot_item.setData(self.data.axes[i], linedata)
             else:
                 plot_item.setData(linedata, self.data.axes[i])
-            # Listen to all cursor indices (except this one) and connect to update function
-            for j in range(self.data.ndim):
-                if j != i:
-                    self.cursor.index[j].value_set.connect(partial(self.update_line, i, plot_item, orientation))
-                    self.cursor.binwidth[j].value_set.connect(partial(self.update_line, i, plot_item, orientation))
+        # Recompute cuts once per cursor change, and only those the change affects
+        self.cursor.changed.connect(self.update_cuts)
+
+    def update_cuts(self, changes: dict):
+        """Slot for Cursor.changed. A cut needs recomputing when the binning slice of an axis it is not plotted
+        along has changed."""
+        moved = set(changes.get('slice', ()))
+        if not moved or self._refreshing:
+            return
+        for key, (plot_item, orientation) in self.lineplots_data.items():
+            i = self.coord_to_index[key]
+            if moved - {i}:
+                self.update_line(i, plot_item, orientation)
         for key, img_ax in self.imgs.items():
-            # Wire up events
             i, j = self.coord_to_index[key]
-            for k in range(self.data.ndim):
-                if k != i and k != j:
-                    self.cursor.index[k].value_set.connect(partial(self.update_img, i, j, img_ax))
-                    self.cursor.binwidth[k].value_set.connect(partial(self.update_img, i, j, img_ax))
+            if moved - {i, j}:
+                self.update_img(i, j, img_ax)
 
-    def update_img(self, i: int, j: int, img: ImageSlice, _=None):
+    def notify_region_changed(self, data: RegularDataArray = None, region=None):
+        """Refresh the view after the data grew, scrolled, or changed in place, without resetting the cursor or the
+        zoom. Only panels whose cut intersects ``region``, whose cursor bins moved, or whose axes changed extent
+        are recomputed.
+
+        :param data: The new data, e.g. the latest :meth:`RingBuffer.snapshot`, or None if :attr:`data` was
+            modified in place
+        :param region: Tuple of index slices of the new data that hold new values, or None for everything
+        """
+        old = self.data
+        if data is None or data is old:
+            data = old
+            old.mark_modified(region)
+        elif region is not None:
+            data.inherit_statistics(old, self._normalize_region(data, region))
+        region = self._normalize_region(data, region)
+        old_bins = self._bin_coords()
+        self.data = data
+        self._refreshing = True
+        try:
+            self.cursor.update_data(data)
+        finally:
+            self._refreshing = False
+        new_bins = self._bin_coords()
+        regridded = {i for i in range(data.ndim) if old.shape[i] != data.shape[i] or
+                     not np.isclose(old.coord_min[i], data.coord_min[i], rtol=0, atol=1e-6*data.delta[i])}
+        rebinned = {i for i in range(data.ndim) if
+                    not np.allclose(old_bins[i], new_bins[i], rtol=0, atol=1e-6*data.delta[i])}
+        selection = self.cursor.get_slice()
+
+        def stale(plotted):
+            if regridded & set(plotted) or rebinned - set(plotted):
+                return True
+            return all(r.start < r.stop and (a in plotted or (r.start < s.stop and s.start < r.stop))
+                       for a, (r, s) in enumerate(zip(region, selection)))
+
+        for key, (plot_item, orientation) in self.lineplots_data.items():
+            i = self.coord_to_index[key]
+            if stale((i,)):
+                self.update_line(i, plot_item, orientation)
+        for key, img_ax in self.imgs.items():
+            i, j = self.coord_to_index[key]
+            if stale((i, j)):
+                self.update_img(i, j, img_ax, calc_tr=bool(regridded & {i, j}))
+                self.img_tr[key] = img_ax.img.transform()
+                self.img_tr_inv[key], _ = img_ax.img.transform().inverted()
+        for key, line_list in self.cursor_lines.items():
+            i = self.coord_to_index[key]
+            if i in regridded:
+                for line in line_list:
+                    line.update_bounds((data.coord_min[i], data.coord_max[i]))
+
+    @staticmethod
+    def _normalize_region(data, region):
+        """A region as one slice with explicit, non-negative start and stop per axis"""
+        if region is None:
+            region = ()
+        region = tuple(region) + (slice(None),)*(data.ndim - len(region))
+        return tuple(slice(*r.indices(n)[:2]) if isinstance(r, slice) else slice(r % n, r % n + 1)
+                     for r, n in zip(region, data.shape))
+
+    def _bin_coords(self):
+        """The coordinates of the first and last element in the cursor bin along each axis"""
+        return [(self.data.index_to_scale(i, s.start), self.data.index_to_scale(i, s.stop - 1))
+                for i, s in enumerate(self.cursor.get_slice())]
+
+    def update_img(self, i: int, j: int, img: ImageSlice, _=None, calc_tr=False):
         """Template function for creating image update callback functions.
         i is the row axis, j is the col axis corresponding to the image. xy is 0, 1 and zy is 2, 1"""
-        x = self.cursor.get_cut((i, j)).squeeze()
-        if j > i:
-            img.set_data(x, calc_tr=False)
-        else:
-            img.set_data(x.T, calc_tr=False)
+        with self.profiler.panel(self.index_to_coord[i] + self.index_to_coord[j]):
+            with self.profiler.stage('get_cut'):
+                x = self.cursor.get_cut((i, j)).squeeze()
+            with self.profiler.stage('set_data'):
+                if j > i:
+                    img.set_data(x, calc_tr=calc_tr)
+                else:
+                    img.set_data(x.T, calc_tr=calc_tr)
+            key = self.index_to_coord[i] + self.index_to_coord[j]
+            if key in self.peak_overlays:
+                with self.profiler.stage('track'):
+                    self.update_peaks(key, x)
 
     def update_line(self, index: int, lineplot: pg.PlotDataItem, orientation: str, _=None):
         """Template function for creating callbacks which update every PlotDataItem according to current cursor
         position."""
-        x = self.cursor.get_cut(index).squeeze()
-        if orientation == 'h':
-            lineplot.setData(self.data.axes[index], x.values)
+        with self.profiler.panel(self.index_to_coord[index]):
+            with self.profiler.stage('get_cut'):
+                x = self.cursor.get_cut(index).squeeze()
+            with self.profiler.stage('set_data'):
+                if orientation == 'h':
+                    lineplot.setData(self.data.axes[index], x.values)
+                else:
+                    lineplot.setData(x.values, self.data.axes[index])
+            key = self.index_to_coord[index]
+            if key in self.fit_overlays:
+                with self.profiler.stage('fit'):
+                    self.update_fit(key, x)
+
+    def set_fit_overlay(self, enabled: bool = True, n_peaks: int = 1, model: str = 'lorentzian', panels=None):
+        """Overlay peaks fitted to the cut shown in line panels, refitted whenever the cut changes. Each fit
+        starts from the result of the previous one, so following a band with the cursor takes few iterations.
+
+        :param enabled: False removes the overlays
+        :param n_peaks: Number of peaks, see :func:`PeakFit.fit_peaks`
+        :param model: 'lorentzian' or 'gaussian'
+        :param panels: Keys of the line panels, e.g. ['x'], by default all of them
+        """
+        panels = list(self.lineplots_data) if panels is None else list(panels)
+        for key in panels:
+            if key in self.fit_overlays:
+                self.lineplots[key][0].removeItem(self.fit_overlays.pop(key)[0])
+        if not enabled:
+            return
+        for key in panels:
+            curve = self.lineplots[key][0].plot(pen=self.fit_pen)
+            self.fit_overlays[key] = (curve, PeakFitter(n_peaks, model))
+            self.update_fit(key, self.cursor.get_cut(self.coord_to_index[key]).squeeze())
+
+    def set_peak_overlay(self, enabled: bool = True, panels=None, axis: int = None, **params):
+        """Mark the maximum of every cut through image panels, e.g. of every MDC of an energy-momentum image, and
+        follow it as the cursor scrubs through the data.
+
+        :param enabled: False removes the overlays
+        :param panels: Keys of the image panels, e.g. ['xy'], by default all of them
+        :param axis: The data axis to find maxima along, by default the horizontal axis of each panel
+        :param params: window, method, search and minimum, see :func:`PeakFit.track_peak`
+        """
+        panels = list(self.imgs) if panels is None else list(panels)
+        for key in panels:
+            if key in self.peak_overlays:
+                self.imgs[key].removeItem(self.peak_overlays.pop(key)[0])
+        if not enabled:
+            return
+        for key in panels:
+            i, j = self.coord_to_index[key]
+            along = i if axis is None else axis % self.data.ndim
+            if along not in (i, j):
+                raise ValueError(f"Axis {along} is not shown in panel {key}")
+            points = pg.PlotDataItem(pen=None, symbol='o', symbolSize=4, symbolPen=None, symbolBrush='r')
+            self.imgs[key].addItem(points)
+            self.peak_overlays[key] = (points, dict(params, axis=along))
+            self.update_peaks(key, self.cursor.get_cut((i, j)).squeeze())
+
+    def update_peaks(self, key: str, cut: RegularDataArray):
+        """Track the maxima of the 2D ``cut`` shown in image panel ``key`` and mark them over it"""
+        points, params = self.peak_overlays[key]
+        i, j = self.coord_to_index[key]
+        params = dict(params)
+        along = params.pop('axis')
+        other = j if along == i else i
+        position, _ = track_peak(cut, 0 if along == min(i, j) else 1, **params)
+        position, coord = position.values, self.data.axes[other]
+        keep = np.isfinite(position)
+        if along == i:
+            points.setData(position[keep], coord[keep])
+        else:
+            points.setData(coord[keep], position[keep])
+
+    def update_fit(self, key: str, cut: RegularDataArray):
+        """Fit the 1D ``cut`` shown in line panel ``key`` and draw the fitted curve over it"""
+        curve, fitter = self.fit_overlays[key]
+        i = self.coord_to_index[key]
+        result = fitter.fit(cut, 0)
+        y = result.curves()
+        if self.lineplots_data[key][1] == 'h':
+            curve.setData(self.data.axes[i], y)
         else:
-            lineplot.setData(x.values, self.data.axes[index])
+            curve.setData(y, self.data.axes[i])
 
     def load_ct(self, cmap_name: str = 'viridis'):
         """
@@ -315,8 +489,9 @@ class PGImageTool(pg.GraphicsLayoutWidget):
                 self.cursor.set_pos(i, self.mouse_pos.y())
         elif self.mouse_panel[:3] == 'img':
             i, j = self.coord_to_index[self.mouse_panel[-2:]]
-            self.cursor.set_pos(i, self.mouse_pos.x())
-            self.cursor.set_pos(j, self.mouse_pos.y())
+            with self.cursor.batch():
+                self.cursor.set_pos(i, self.mouse_pos.x())
+                self.cursor.set_pos(j, self.mouse_pos.y())
         else:
             raise NotImplementedError("Mouse panel {0} is unknown".format(self.mouse_panel))
 
@@ -369,22 +544,48 @@ class PGImageTool(pg.GraphicsLayoutWidget):
                 self.set_crosshair_to_mouse()
 
 
-class Cursor:
-    """An object that holds a list of current index and position of the cursor location. Warning: this function
-    will raise a list indexing error if you access y, z, or t variables on data which does not have that as a
-    dimension.
+class Cursor(QtCore.QObject):
+    """An object that holds the current index, position and bin width of the cursor along every axis. Warning: this
+    function will raise a list indexing error if you access y, z, or t variables on data which does not have that
+    as a dimension.
+
+    The cursor state and the cut computation live in a Qt-free :class:`CutEngine`. The per-axis models in
+    :attr:`index`, :attr:`pos` and :attr:`binwidth` mirror that state for views, and only emit ``value_set`` when
+    their value really changed. Consumers of cuts should listen to :attr:`changed`, which is emitted once per change
+    (or once per :meth:`batch`) with a dict mapping ``'pos'``, ``'index'``, ``'binwidth'`` and ``'slice'`` to the
+    tuple of axes whose value changed. ``'slice'`` lists the axes whose binning slice, and therefore the cuts across
+    them, changed.
     """
+    changed = QtCore.Signal(object)
+
     def __init__(self, data: RegularDataArray):
         """
         :param data: Regular spaced data, which will be used to calculate how to transform axis to coordinate
         """
-        self.data = data
-        self._index: List[ValueLimitedModel] = [ValueLimitedModel(0, 0, imax) for imax in np.array(data.shape) - 1]
-        self._pos: List[ValueLimitedModel] = [ValueLimitedModel(cmin, cmin, cmax)
-                                              for cmin, cmax in zip(data.coord_min, data.coord_max)]
-        self._binwidth: List[ValueLimitedModel] = [ValueLimitedModel(0, 0, cmax)
-                                                   for cmax in (data.coord_max - data.coord_min)]
-        self._binpos: List[List[float]] = [[cmin, cmin + delta/2] for cmin, delta in zip(data.coord_min, data.delta)]
+        super().__init__()
+        self.engine = CutEngine(data)
+        pos, index, binwidth = self.engine.state()
+        self._index: List[ValueLimitedModel] = [ValueLimitedModel(int(index[i]), 0, imax, name=f'Cursor.index[{i}]')
+                                                for i, imax in enumerate(np.array(data.shape) - 1)]
+        self._pos: List[ValueLimitedModel] = [ValueLimitedModel(float(pos[i]), cmin, cmax, name=f'Cursor.pos[{i}]')
+                                              for i, (cmin, cmax) in enumerate(zip(data.coord_min, data.coord_max))]
+        self._binwidth: List[ValueLimitedModel] = [ValueLimitedModel(float(binwidth[i]), 0, cmax,
+                                                                     name=f'Cursor.binwidth[{i}]')
+                                                   for i, cmax in enumerate(data.coord_max - data.coord_min)]
+        self._batch_depth = 0
+        self._committed = self._snapshot()
+
+    @property
+    def data(self) -> RegularDataArray:
+        return self.engine.data
+
+    @property
+    def profiler(self) -> UpdateProfiler:
+        return self.engine.profiler
+
+    @profiler.setter
+    def profiler(self, newval: UpdateProfiler):
+        self.engine.profiler = newval
 
     @property
     def pos(self):
@@ -399,77 +600,110 @@ class Cursor:
         return self._binwidth
 
     def get_binwidth(self, i):
-        return self._binwidth[i].value
+        return float(self.engine.binwidth[i])
 
     def get_pos(self, axis):
         if isinstance(axis, str):
             i = PGImageTool.coord_to_index[axis]
         else:
             i = int(axis)
-        return self._pos[i].value
+        return float(self.engine.pos[i])
 
     def get_index(self, axis):
         if isinstance(axis, str):
             i = PGImageTool.coord_to_index[axis]
         else:
             i = int(axis)
-        return self._index[i].value
+        return int(self.engine.index[i])
 
     def get_slice(self):
-        return tuple(self.get_index_slice(i) for i in range(self.data.ndim))
+        return self.engine.get_slice()
 
     def get_index_slice(self, i):
-        """Using the known binwidth and bin positions, calculate a slice in index space
-        Note: if the binwidth <= delta (or the bin index is 1), there will never be any binning
-        """
-        if self._binwidth[i].value > self.data.delta[i]:
-            self._binpos[i][0] = min(max(self._pos[i].value - self._binwidth[i].value / 2, self.data.coord_min[i]),
-                                     self.data.coord_max[i])
-            self._binpos[i][1] = min(max(self._pos[i].value + self._binwidth[i].value / 2, self.data.coord_min[i]),
-                                     self.data.coord_max[i])
-            mn = int(np.ceil(self.data.scale_to_index(i, self._binpos[i][0])))
-            mx = int(np.floor(self.data.scale_to_index(i, self._binpos[i][1])))
-            return slice(mn, mx + 1)
-        else:
-            return slice(self._index[i].value, self._index[i].value + 1)
+        return self.engine.get_index_slice(i)
 
     def get_cut(self, axis: Union[int, Iterable]):
-        if not isinstance(axis, Iterable):
-            axis = [axis]
-        else:
-            axis = list(axis)
-        axis_cmpl = tuple(filter(lambda x: x not in axis, range(self.data.ndim)))
-        selection = tuple(slice(None) if i in axis else self.get_index_slice(i) for i in range(self.data.ndim))
-        return self.data.isel(*selection).mean(axis_cmpl).squeeze()
+        return self.engine.get_cut(axis)
+
+    @contextmanager
+    def batch(self):
+        """Apply several changes and notify views and :attr:`changed` once, when the outermost batch exits::
+
+            with cursor.batch():
+                cursor.set_pos(0, x)
+                cursor.set_pos(1, y)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._commit()
 
     def set_pos(self, i, newpos):
-        newpos = self._pos[i].set_value(newpos)
-        newindex = round(self.data.scale_to_index(i, newpos))
-        self._index[i].set_value(newindex)
+        with self.batch():
+            self.engine.set_pos(i, newpos)
 
     def set_index(self, i, newindex):
-        newindex = self._index[i].set_value(newindex)
-        newpos = self.data.index_to_scale(i, newindex)
-        self._pos[i].set_value(newpos)
+        with self.batch():
+            self.engine.set_index(i, newindex)
 
     def set_binwidth(self, i, newwidth):
-        self._binwidth[i].set_value(newwidth)
+        with self.batch():
+            self.engine.set_binwidth(i, newwidth)
 
     def set_binwidth_i(self, i, newindex):
-        newindex = min(max(0, round(newindex)), self.data.shape[i] - 1)
-        self._binwidth[i].set_value(newindex*self.data.delta[i])
+        with self.batch():
+            self.engine.set_binwidth_i(i, newindex)
 
     def reset(self, data=None):
-        if data is not None:
-            self.data = data
-            for i in range(self.data.ndim):
-                self._index[i]._lower_lim = 0
-                self._index[i]._upper_lim = self.data.shape[i] - 1
-                self._pos[i]._lower_lim = self.data.coord_min[i]
-                self._pos[i]._upper_lim = self.data.coord_max[i]
-                self._binwidth[i]._lower_lim = 0
-                self._binwidth[i]._upper_lim = self.data.coord_max[i] - self.data.coord_min[i]
-                self._binpos = [[cmin, cmin + delta/2] for cmin, delta in zip(self.data.coord_min, self.data.delta)]
-        for i in range(self.data.ndim):
-            self.set_index(i, 0)
-            self.set_binwidth_i(i, 1)
+        with self.batch():
+            if data is not None:
+                self._set_limits(data)
+                # the slices are relative to the new data, so every cut is stale
+                self._committed = self._committed[:3] + (None,)
+            self.engine.reset(data)
+
+    def update_data(self, data: RegularDataArray):
+        """Switch to a grown, scrolled or modified version of the data, keeping the cursor where it is in
+        coordinates. See :meth:`CutEngine.update_data`."""
+        with self.batch():
+            self._set_limits(data)
+            self.engine.update_data(data)
+
+    def _set_limits(self, data):
+        for i in range(data.ndim):
+            self._index[i]._lower_lim = 0
+            self._index[i]._upper_lim = data.shape[i] - 1
+            self._pos[i]._lower_lim = data.coord_min[i]
+            self._pos[i]._upper_lim = data.coord_max[i]
+            self._binwidth[i]._lower_lim = 0
+            self._binwidth[i]._upper_lim = data.coord_max[i] - data.coord_min[i]
+
+    def _snapshot(self):
+        return self.engine.state() + (self.engine.get_slice(),)
+
+    def _commit(self):
+        """Push changed values to the per-axis models and emit a single :attr:`changed` notification"""
+        old = self._committed
+        self._committed = new = self._snapshot()
+        changes = {}
+        for name, old_values, new_values, models in zip(('pos', 'index', 'binwidth'), old, new,
+                                                        (self._pos, self._index, self._binwidth)):
+            axes = tuple(int(i) for i in np.flatnonzero(old_values != new_values))
+            if axes:
+                changes[name] = axes
+                for i in axes:
+                    models[i].set_value(new_values[i].item())
+        if old[3] is None:
+            changes['slice'] = tuple(range(self.data.ndim))
+        else:
+            axes = tuple(i for i, (a, b) in enumerate(zip(old[3], new[3])) if a != b)
+            if axes:
+                changes['slice'] = axes
+        if changes:
+            if SingleValueModel.tracer is None:
+                self.changed.emit(changes)
+            else:
+                SingleValueModel.tracer.emit_signal('Cursor.changed', self.changed, changes)
@@ -0,0 +1,22 @@
+"""Thread pool dispatch shared by the batched numerical modules. NumPy, scipy.fft and scipy.ndimage release the GIL,
+so threads working on chunks of one shared input scale with the cores without copying it."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def n_workers(workers: int = None) -> int:
+    """The number of threads to use: ``workers``, or one per core if None"""
+    return workers if workers is not None else (os.cpu_count() or 1)
+
+
+def map_chunks(work, chunks, workers: int = None) -> list:
+    """Call ``work`` on every chunk, in up to ``workers`` threads (one per core if None), or in the calling thread
+    when there is only one worker or one chunk.
+
+    :return: The results of ``work`` in the order of ``chunks``
+    """
+    workers = n_workers(workers)
+    if workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(min(workers, len(chunks))) as pool:
+            return list(pool.map(work, chunks))
+    return [work(chunk) for chunk in chunks]
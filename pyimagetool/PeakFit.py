@@ -0,0 +1,338 @@
+"""Batched fitting of peaks to many 1D cuts at once, e.g. Lorentzians to every MDC of a cube.
+
+All cuts are fitted together by a vectorized Levenberg-Marquardt iteration: the residuals and Jacobians of a chunk
+of cuts are stacked, and every cut takes its own damped Gauss-Newton step from one batched linear solve. Each cut
+keeps its own damping, and cuts drop out of the iteration as they converge.
+
+The model is a sum of ``n_peaks`` peaks plus a linear background. Parameters are stacked per cut as
+``[amplitude, center, width] * n_peaks + [background, slope]``, where the width is the half width at half maximum
+of a Lorentzian or the standard deviation of a Gaussian.
+"""
+import numpy as np
+
+from .DataMatrix import RegularDataArray
+from .Parallel import map_chunks
+
+
+def _lorentzian(x, a, x0, w):
+    """Peak values and derivatives with respect to (a, x0, w)"""
+    u = x - x0
+    d = u**2 + w**2
+    f = a*w**2/d
+    return f, (w**2/d, 2*a*w**2*u/d**2, 2*a*w*u**2/d**2)
+
+
+def _gaussian(x, a, x0, w):
+    u = x - x0
+    e = np.exp(-u**2/(2*w**2))
+    return a*e, (e, a*e*u/w**2, a*e*u**2/w**3)
+
+
+MODELS = {'lorentzian': (_lorentzian, 2.0), 'gaussian': (_gaussian, 2*np.sqrt(2*np.log(2)))}  # (function, fwhm/w)
+
+
+def n_params(n_peaks: int) -> int:
+    return 3*n_peaks + 2
+
+
+def evaluate(x: np.ndarray, params: np.ndarray, model: str = 'lorentzian', jacobian: bool = False):
+    """The model at ``x`` for stacked ``params`` of shape (M, P)
+
+    :return: (M, len(x)) values, and the (M, len(x), P) Jacobian if ``jacobian``
+    """
+    peak, _ = MODELS[model]
+    n_peaks = (params.shape[-1] - 2)//3
+    xc = x[None, :]
+    center = (x[0] + x[-1])/2
+    f = params[:, -2:-1] + params[:, -1:]*(xc - center)
+    jac = np.empty(params.shape[:1] + x.shape + params.shape[-1:]) if jacobian else None
+    for k in range(n_peaks):
+        a, x0, w = (params[:, 3*k + i, None] for i in range(3))
+        fk, dk = peak(xc, a, x0, w)
+        f = f + fk
+        if jacobian:
+            for i in range(3):
+                jac[:, :, 3*k + i] = dk[i]
+    if jacobian:
+        jac[:, :, -2] = 1
+        jac[:, :, -1] = xc - center
+        return f, jac
+    return f
+
+
+def initial_guess(x: np.ndarray, y: np.ndarray, n_peaks: int = 1, model: str = 'lorentzian') -> np.ndarray:
+    """Starting parameters for every row of ``y`` from its moments: the background is the minimum, and peaks are
+    placed one after the other at the maximum of what the previous peaks leave, with widths from the number of
+    points above half of it. NaNs are ignored."""
+    _, fwhm_per_w = MODELS[model]
+    m = len(y)
+    params = np.zeros((m, n_params(n_peaks)))
+    finite = np.isfinite(y)
+    bg = np.min(np.where(finite, y, np.inf), axis=1)
+    bg = np.where(np.isfinite(bg), bg, 0)
+    params[:, -2] = bg
+    residual = np.where(finite, y - bg[:, None], 0)
+    dx = abs(x[-1] - x[0])/max(len(x) - 1, 1)
+    rows = np.arange(m)
+    for k in range(n_peaks):
+        i = np.argmax(residual, axis=1)
+        a = residual[rows, i]
+        above = np.sum(residual > a[:, None]/2, axis=1)
+        w = np.maximum(above, 1)*dx/fwhm_per_w
+        params[:, 3*k:3*k + 3] = np.stack([a, x[i], w], axis=1)
+        residual = residual - evaluate(x, np.concatenate([params[:, 3*k:3*k + 3], np.zeros((m, 2))], axis=1),
+                                       model)
+    return params
+
+
+def levenberg_marquardt(func, x: np.ndarray, y: np.ndarray, params: np.ndarray, positive=(), max_iter: int = 100,
+                        ftol: float = 1e-10, xtol: float = 1e-8):
+    """Fit every row of ``y`` sampled at ``x`` with one vectorized Levenberg-Marquardt iteration. NaNs are
+    skipped.
+
+    :param func: ``func(x, params, jacobian)`` returning the (M, len(x)) model values for (M, P) ``params``, and
+        with ``jacobian`` also the (M, len(x), P) Jacobian
+    :param params: (M, P) starting parameters
+    :param positive: Indices of parameters kept positive, e.g. widths
+    :param ftol: A cut has converged when a step lowers its sum of squared residuals by less than this fraction
+    :param xtol: ... or changes none of its parameters by more than this fraction
+    :return: (params, chi2, converged) with shapes (M, P), (M,) and (M,), where chi2 is the mean squared residual.
+        Rows with fewer finite points than parameters are not fitted: their params and chi2 are NaN and they have
+        not converged
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    weight = np.isfinite(y)
+    y = np.where(weight, y, 0)
+    params = np.array(params, dtype=float).reshape(len(y), -1)
+    count = weight.sum(axis=1)
+    underdetermined = count < params.shape[1]
+    count = np.maximum(count, 1)
+    positive = list(positive)
+
+    def cost(p, rows):
+        r = (y[rows] - func(x, p, False))*weight[rows]
+        return np.einsum('mn,mn->m', r, r)
+
+    lam = np.full(len(y), 1e-3)
+    chi = cost(params, slice(None))
+    converged = underdetermined.copy()  # leaves them out of the iteration
+    eye = np.eye(params.shape[1])
+    for _ in range(max_iter):
+        active = np.flatnonzero(~converged)
+        if len(active) == 0:
+            break
+        p = params[active]
+        f, jac = func(x, p, True)
+        jac *= weight[active, :, None]
+        r = (y[active] - f)*weight[active]
+        jtj = np.einsum('mnp,mnq->mpq', jac, jac)
+        grad = np.einsum('mnp,mn->mp', jac, r)
+        diag = np.einsum('mpp->mp', jtj)
+        damped = jtj + (lam[active, None]*diag)[:, :, None]*eye + 1e-12*(1 + diag.max(axis=1))[:, None, None]*eye
+        step = np.linalg.solve(damped, grad[:, :, None])[:, :, 0]
+        trial = p + step
+        trial[:, positive] = np.abs(trial[:, positive])
+        new = cost(trial, active)
+        better = new <= chi[active]
+        accepted = active[better]
+        small = np.all(np.abs(step) <= xtol*(np.abs(p) + xtol), axis=1)
+        done = (better & (chi[active] - new <= ftol*chi[active])) | small
+        params[accepted] = trial[better]
+        chi[accepted] = new[better]
+        lam[active] = np.where(better, lam[active]/10, lam[active]*10)
+        converged[active[done | (lam[active] > 1e12)]] = True
+    converged &= (lam < 1e12) & ~underdetermined
+    params[underdetermined] = np.nan
+    chi[underdetermined] = np.nan
+    return params, chi/count, converged
+
+
+def fit_curves(x: np.ndarray, y: np.ndarray, n_peaks: int = 1, model: str = 'lorentzian', initial=None,
+               max_iter: int = 100):
+    """Fit ``n_peaks`` peaks on a linear background to every row of ``y`` sampled at ``x``. NaNs are skipped.
+
+    :param initial: (M, P) starting parameters, by default from :func:`initial_guess`
+    :return: (params, chi2, converged), see :func:`levenberg_marquardt`
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    if initial is None:
+        initial = initial_guess(x, y, n_peaks, model)
+    return levenberg_marquardt(lambda x, p, jacobian: evaluate(x, p, model, jacobian), x, y, initial,
+                               positive=range(2, 3*n_peaks, 3), max_iter=max_iter)
+
+
+class PeakFitResult:
+    """Stacked fit parameters of a :func:`fit_peaks` call. Indexing by name returns a RegularDataArray on the
+    grid of the fitted data without the fit axis, with a trailing ``peak`` axis for several peaks:
+    ``amplitude``, ``center``, ``fwhm``, ``background``, ``slope``, ``chi2`` or ``converged``."""
+    names = ('amplitude', 'center', 'fwhm', 'background', 'slope', 'chi2', 'converged')
+
+    def __init__(self, params, chi2, converged, n_peaks, model, x, grid):
+        self.params = params
+        self.chi2 = chi2
+        self.converged = converged
+        self.n_peaks = n_peaks
+        self.model = model
+        self.x = x
+        self.grid = grid  # (delta, coord_min, dims, name, coords) of the remaining axes
+
+    def __repr__(self):
+        return f"PeakFitResult[{self.n_peaks} {self.model} peak(s) on {self.params.shape[:-1]} cuts]"
+
+    def __getitem__(self, name: str) -> RegularDataArray:
+        delta, coord_min, dims, data_name, coords = self.grid
+        if name in ('amplitude', 'center', 'fwhm'):
+            i = ('amplitude', 'center', 'fwhm').index(name)
+            values = self.params[..., i:3*self.n_peaks:3]
+            if name == 'fwhm':
+                values = values*MODELS[self.model][1]
+            if self.n_peaks == 1:
+                values = values[..., 0]
+            else:
+                delta, coord_min, dims = list(delta) + [1], list(coord_min) + [0], tuple(dims) + ('peak',)
+                coords = list(coords) + [None]
+        elif name in ('background', 'slope'):
+            values = self.params[..., -2 if name == 'background' else -1]
+        elif name == 'chi2':
+            values = self.chi2
+        elif name == 'converged':
+            values = self.converged
+        else:
+            raise KeyError(f"{name} is not one of {self.names}")
+        return RegularDataArray(values, delta=delta, coord_min=coord_min, dims=dims, name=f'{data_name} {name}',
+                                coords=coords)
+
+    def curves(self, x=None) -> np.ndarray:
+        """The fitted models at ``x`` (by default the fitted coordinates), with shape (*cuts, len(x))"""
+        x = self.x if x is None else np.asarray(x, dtype=float)
+        flat = self.params.reshape(-1, self.params.shape[-1])
+        return evaluate(x, flat, self.model).reshape(self.params.shape[:-1] + (len(x),))
+
+
+def fit_peaks(data: RegularDataArray, axis: int, n_peaks: int = 1, model: str = 'lorentzian', initial=None,
+              max_iter: int = 100, chunk_size: int = 2**21, workers: int = None) -> PeakFitResult:
+    """Fit peaks to every 1D cut of ``data`` along ``axis``, e.g. along momentum for MDCs.
+
+    :param initial: Starting parameters, e.g. the ``params`` of an earlier :class:`PeakFitResult`, or None to
+        start from :func:`initial_guess`. Cuts that fail to converge from these are fitted again from their moments
+    :param chunk_size: Number of Jacobian elements computed at a time
+    :param workers: Number of threads fitting chunks in parallel
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model}, should be one of {list(MODELS)}")
+    axis = axis % data.ndim
+    x = np.asarray(data.axes[axis], dtype=float)
+    mat = np.moveaxis(np.asarray(data.values, dtype=float), axis, -1)
+    rest = mat.shape[:-1]
+    y = mat.reshape(-1, len(x))
+    if data.mask is not None:
+        mask = np.moveaxis(np.broadcast_to(data.mask, data.shape), axis, -1).reshape(y.shape)
+        y = np.where(mask != 0, y, np.nan)
+    p = n_params(n_peaks)
+    start = None if initial is None else np.asarray(initial, dtype=float).reshape(len(y), p)
+    params, chi2 = np.empty((len(y), p)), np.empty(len(y))
+    converged = np.empty(len(y), dtype=bool)
+    step = max(1, chunk_size//(len(x)*p))
+
+    def work(lo):
+        rows = slice(lo, min(lo + step, len(y)))
+        init = None if start is None else start[rows]
+        params[rows], chi2[rows], converged[rows] = fit_curves(x, y[rows], n_peaks, model, init, max_iter)
+        if init is not None and not converged[rows].all():
+            redo = np.flatnonzero(~converged[rows]) + lo
+            params[redo], chi2[redo], converged[redo] = fit_curves(x, y[redo], n_peaks, model, None, max_iter)
+
+    map_chunks(work, range(0, len(y), step), workers)
+    keep = [a for a in range(data.ndim) if a != axis]
+    grid = ([data.delta[a] for a in keep], [data.coord_min[a] for a in keep], tuple(data.dims[a] for a in keep),
+            data.name, [data.coords[a] for a in keep])
+    return PeakFitResult(params.reshape(rest + (p,)), chi2.reshape(rest), converged.reshape(rest), n_peaks, model,
+                         x, grid)
+
+
+class PeakFitter:
+    """Fits the same model again and again, each time starting from the previous results when the number of cuts
+    is unchanged, as when following the cut under a moving cursor."""
+
+    def __init__(self, n_peaks: int = 1, model: str = 'lorentzian', max_iter: int = 100):
+        self.n_peaks = n_peaks
+        self.model = model
+        self.max_iter = max_iter
+        self.result: PeakFitResult = None
+
+    def fit(self, data: RegularDataArray, axis: int = -1) -> PeakFitResult:
+        axis = axis % data.ndim
+        rest = data.shape[:axis] + data.shape[axis + 1:]
+        initial = None
+        if self.result is not None and self.result.params.shape[:-1] == rest:
+            initial = self.result.params
+        self.result = fit_peaks(data, axis, self.n_peaks, self.model, initial, self.max_iter, workers=1)
+        return self.result
+
+
+def track_peak(data: RegularDataArray, axis: int, window: int = 3, method: str = 'parabolic', search=None,
+               minimum: bool = False):
+    """Position and height of the maximum of every 1D cut of ``data`` along ``axis``, refined below the grid
+    spacing, without fitting. All cuts are processed at once.
+
+    :param window: Number of elements around the maximum used for the refinement, at least 3
+    :param method: ``'parabolic'`` takes the vertex of a least squares parabola through the window, ``'centroid'``
+        the centroid of the window above its lowest value
+    :param search: (lo, hi) coordinates bounding the search along ``axis``, by default the whole axis
+    :param minimum: Track the minimum instead, e.g. of a second derivative or curvature image
+    :return: (position, amplitude), RegularDataArrays on the grid of ``data`` without ``axis``. Cuts without
+        finite values give NaN
+    """
+    if method not in ('parabolic', 'centroid'):
+        raise ValueError(f"Unknown method {method}, should be 'parabolic' or 'centroid'")
+    axis = axis % data.ndim
+    n = data.shape[axis]
+    lo, hi = 0, n
+    if search is not None:
+        ends = sorted(data.scale_to_index(axis, s) for s in search)
+        lo, hi = max(int(np.ceil(ends[0] - 1e-9)), 0), min(int(np.floor(ends[1] + 1e-9)) + 1, n)
+        if hi <= lo:
+            raise ValueError(f"The search range {search} holds no elements of axis {axis}")
+    mat = np.moveaxis(np.asarray(data.values), axis, -1)[..., lo:hi]
+    if minimum:
+        mat = -mat
+    if data.mask is not None:
+        mask = np.moveaxis(np.broadcast_to(data.mask, data.shape), axis, -1)[..., lo:hi]
+        mat = np.where(mask != 0, mat, np.nan)
+    finite = np.isfinite(mat)
+    filled = np.where(finite, mat, -np.inf)
+    peak = np.argmax(filled, axis=-1)[..., None]
+    # a window of 2*h + 1 elements, moved inside of the search range near its ends
+    h = max(min(int(window)//2, (hi - lo - 1)//2), 0)
+    start = np.clip(peak - h, 0, hi - lo - 1 - 2*h)
+    t = np.arange(-h, h + 1)
+    values = np.take_along_axis(filled, start + h + t, axis=-1)
+    floor = np.min(np.where(np.isfinite(values), values, np.inf), axis=-1, keepdims=True)
+    empty = ~finite.any(axis=-1)
+    values = np.where(np.isfinite(values), values, np.where(empty[..., None], 0, floor))
+    floor = np.where(empty[..., None], 0, floor)
+    offset = (peak - start - h)[..., 0].astype(float)
+    amplitude = np.take_along_axis(filled, peak, axis=-1)[..., 0].astype(float)
+    if h > 0 and method == 'parabolic':
+        coef = values @ np.linalg.pinv(np.vander(t, 3, increasing=True)).T  # (..., 3) least squares parabolas
+        c0, c1, c2 = coef[..., 0], coef[..., 1], coef[..., 2]
+        curved = c2 < 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vertex = np.clip(-c1/(2*c2), -h, h)
+        offset = np.where(curved, vertex, offset)
+        amplitude = np.where(curved, c0 + c1*vertex + c2*vertex**2, amplitude)
+    elif h > 0:
+        above = values - floor
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centroid = np.sum(above*t, axis=-1)/np.sum(above, axis=-1)
+        offset = np.where(np.isfinite(centroid), centroid, offset)
+    index = lo + start[..., 0] + h + offset
+    position = np.where(empty, np.nan, np.interp(index, np.arange(n), data.axes[axis]))
+    amplitude = np.where(empty, np.nan, -amplitude if minimum else amplitude)
+    keep = [a for a in range(data.ndim) if a != axis]
+    grid = dict(delta=[data.delta[a] for a in keep], coord_min=[data.coord_min[a] for a in keep],
+                dims=tuple(data.dims[a] for a in keep), coords=[data.coords[a] for a in keep])
+    return (RegularDataArray(position, name=f'{data.name} position', **grid),
+            RegularDataArray(amplitude, name=f'{data.name} amplitude', **grid))
@@ -0,0 +1,313 @@
+"""Chains of processing stages (smoothing, derivatives, normalization, background subtraction) evaluated lazily.
+
+A :class:`Pipeline` turns a :class:`RegularDataArray` into one lazy output per stage. Indexing an output computes
+the stage only over the indexed region, widened by what the stage needs around it (e.g. the half width of a
+smoothing kernel), and asks the stage before it for just that much. Results are memoized in the memory budget by
+the chain of stage parameters up to that stage, so changing the parameters of one stage recomputes that stage and
+those after it, and only where their output is indexed::
+
+    pipe = Pipeline(data, [GaussianSmooth(2, 1.5), Derivative(2, order=2)])
+    tool = ImageTool(pipe)
+    tool.set_stage_params(0, sigma=3)
+"""
+import numpy as np
+from scipy import ndimage, signal
+
+from .DataMatrix import RegularDataArray
+from .LazyArray import LazyArray
+from .MemoryBudget import budget
+
+
+class Stage:
+    """Base class of pipeline stages. A stage maps an array to an array of the same shape.
+
+    Subclasses store their parameters as attributes, and define :meth:`apply` and either :meth:`halo` or
+    :meth:`input_region`.
+    """
+    axis: int = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in self.params())})"
+
+    def params(self) -> tuple:
+        """The parameters, as a hashable tuple of (name, value) pairs"""
+        return tuple(sorted((k, tuple(np.ravel(v)) if isinstance(v, (list, np.ndarray)) else v)
+                            for k, v in vars(self).items()))
+
+    def halo(self, n: int) -> int:
+        """Number of input elements needed on each side of an output element along :attr:`axis`, for an axis of
+        length ``n``"""
+        return 0
+
+    def input_region(self, region, data: RegularDataArray):
+        """The input region needed to compute the output ``region``, a tuple of slices with explicit bounds"""
+        if self.axis is None:
+            return region
+        out = list(region)
+        r, n = region[self.axis], data.shape[self.axis]
+        h = self.halo(n)
+        out[self.axis] = slice(max(r.start - h, 0), min(r.stop + h, n))
+        return tuple(out)
+
+    def apply(self, block: np.ndarray, region, data: RegularDataArray) -> np.ndarray:
+        """Compute the stage over ``block``, the input over ``region``
+
+        :param region: Tuple of slices locating ``block`` in the full array
+        :param data: The source data, for its grid
+        """
+        raise NotImplementedError
+
+
+class BoxSmooth(Stage):
+    """Moving average over ``width`` elements along ``axis``. At the ends of the axis the edge values are
+    repeated."""
+
+    def __init__(self, axis: int, width: int):
+        self.axis = axis
+        self.width = int(width)
+
+    def halo(self, n):
+        return self.width//2
+
+    def apply(self, block, region, data):
+        return ndimage.uniform_filter1d(block, self.width, axis=self.axis, mode='nearest')
+
+
+class GaussianSmooth(Stage):
+    """Gaussian smoothing along ``axis`` with a standard deviation of ``sigma`` elements"""
+
+    def __init__(self, axis: int, sigma: float):
+        self.axis = axis
+        self.sigma = float(sigma)
+
+    def halo(self, n):
+        return int(4*self.sigma + 0.5)  # the kernel radius of gaussian_filter1d
+
+    def apply(self, block, region, data):
+        return ndimage.gaussian_filter1d(block, self.sigma, axis=self.axis, mode='nearest', truncate=4.0)
+
+
+class SavitzkyGolay(Stage):
+    """Savitzky-Golay filter of odd ``window`` elements and polynomial ``order`` along ``axis``, or the
+    ``deriv``-th derivative of the fitted polynomials, in units of the axis coordinates"""
+
+    def __init__(self, axis: int, window: int, order: int = 2, deriv: int = 0):
+        self.axis = axis
+        self.window = int(window)
+        self.order = int(order)
+        self.deriv = int(deriv)
+
+    def halo(self, n):
+        return self.window//2
+
+    def input_region(self, region, data):
+        # near the ends of the axis, mode='interp' fits the polynomial to the whole window at that end
+        out = list(super().input_region(region, data))
+        r, n = out[self.axis], data.shape[self.axis]
+        short = min(self.window, n) - (r.stop - r.start)
+        if short > 0:
+            out[self.axis] = slice(r.start, r.stop + short) if r.start == 0 else slice(r.start - short, r.stop)
+        return tuple(out)
+
+    def apply(self, block, region, data):
+        return signal.savgol_filter(block, self.window, self.order, deriv=self.deriv, delta=data.delta[self.axis],
+                                    axis=self.axis, mode='interp')
+
+
+class Derivative(Stage):
+    """Central differences of ``order`` along ``axis``, in units of the axis coordinates"""
+
+    def __init__(self, axis: int, order: int = 1):
+        self.axis = axis
+        self.order = int(order)
+
+    def halo(self, n):
+        return self.order
+
+    def apply(self, block, region, data):
+        for _ in range(self.order):
+            block = np.gradient(block, data.delta[self.axis], axis=self.axis)
+        return block
+
+
+class Normalize(Stage):
+    """Divide every profile along ``axis`` by its ``max``, ``mean`` or ``area``, or the whole array if ``axis``
+    is None. NaNs are skipped."""
+
+    def __init__(self, axis: int = None, mode: str = 'max'):
+        if mode not in ('max', 'mean', 'area'):
+            raise ValueError(f"Unknown normalization {mode}, should be 'max', 'mean' or 'area'")
+        self.axis = axis
+        self.mode = mode
+
+    def input_region(self, region, data):
+        if self.axis is None:
+            return tuple(slice(0, n) for n in data.shape)
+        return super().input_region(region, data)
+
+    def halo(self, n):
+        return n
+
+    def apply(self, block, region, data):
+        axis = self.axis
+        if self.mode == 'max':
+            scale = np.nanmax(block, axis=axis, keepdims=True)
+        else:
+            scale = np.nanmean(block, axis=axis, keepdims=True)
+            if self.mode == 'area':
+                scale = scale*(block.size if axis is None else block.shape[axis]) * \
+                    (np.prod(data.delta) if axis is None else data.delta[axis])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return block/scale
+
+
+class SubtractBackground(Stage):
+    """Subtract from every profile along ``axis`` the ``mean`` or ``min`` of its values between the coordinates
+    ``lo`` and ``hi``, e.g. above the Fermi level. The whole profile is used by default. NaNs are skipped."""
+
+    def __init__(self, axis: int, lo: float = None, hi: float = None, mode: str = 'mean'):
+        if mode not in ('mean', 'min'):
+            raise ValueError(f"Unknown background {mode}, should be 'mean' or 'min'")
+        self.axis = axis
+        self.lo = lo
+        self.hi = hi
+        self.mode = mode
+
+    def _background_slice(self, data):
+        n = data.shape[self.axis]
+        lo = 0 if self.lo is None else int(np.ceil(data.scale_to_index(self.axis, self.lo) - 1e-9))
+        hi = n if self.hi is None else int(np.floor(data.scale_to_index(self.axis, self.hi) + 1e-9)) + 1
+        lo, hi = min(max(lo, 0), n - 1), min(max(hi, 1), n)
+        return slice(lo, max(hi, lo + 1))
+
+    def input_region(self, region, data):
+        out = list(region)
+        bg, r = self._background_slice(data), region[self.axis]
+        out[self.axis] = slice(min(r.start, bg.start), max(r.stop, bg.stop))
+        return tuple(out)
+
+    def apply(self, block, region, data):
+        bg = self._background_slice(data)
+        start = region[self.axis].start
+        key = (slice(None),)*self.axis + (slice(bg.start - start, bg.stop - start),)
+        reduce = np.nanmean if self.mode == 'mean' else np.nanmin
+        return block - reduce(block[key], axis=self.axis, keepdims=True)
+
+
+class Pipeline:
+    """A chain of :class:`Stage` objects applied to a RegularDataArray, evaluated lazily per region.
+
+    :meth:`output` returns the result of any stage as a RegularDataArray backed by a :class:`StageArray`, which
+    ImageTool displays like any other data, computing only the cuts on display.
+    """
+
+    def __init__(self, data, stages=()):
+        """
+        :param data: The source data
+        :param stages: Sequence of stages, applied in order
+        """
+        self.data = data if isinstance(data, RegularDataArray) else RegularDataArray(data)
+        self.stages = list(stages)
+        for stage in self.stages:
+            self._check(stage)
+        self.source_version = 0
+
+    def __repr__(self):
+        return f"Pipeline[{self.data.shape}: {' -> '.join(repr(s) for s in self.stages) or 'no stages'}]"
+
+    def __len__(self):
+        return len(self.stages)
+
+    def _check(self, stage: Stage):
+        if stage.axis is not None:
+            stage.axis = stage.axis % self.data.ndim
+
+    def append(self, stage: Stage):
+        self._check(stage)
+        self.stages.append(stage)
+
+    def insert(self, i: int, stage: Stage):
+        self._check(stage)
+        self.stages.insert(i, stage)
+
+    def remove(self, i: int) -> Stage:
+        return self.stages.pop(i)
+
+    def set_params(self, i: int, **params):
+        """Change parameters of stage ``i``. Results of the stages before it stay memoized."""
+        stage = self.stages[i]
+        for name, value in params.items():
+            if name not in vars(stage):
+                raise ValueError(f"{stage} has no parameter {name}")
+        if 'mode' in params:  # validate through the constructor
+            type(stage)(**dict(vars(stage), **params))
+        vars(stage).update(params)
+        self._check(stage)
+
+    def notify_modified(self):
+        """Call after changing the source data in place, so that nothing memoized from it is reused"""
+        self.source_version += 1
+
+    def key(self, i: int) -> tuple:
+        """Hashable identity of the output of stage ``i`` (-1 for the source): the source version and the types
+        and parameters of the stages up to ``i``"""
+        return (self.source_version,) + tuple((type(s).__name__, s.params()) for s in self.stages[:i + 1])
+
+    def evaluate(self, i: int, region) -> np.ndarray:
+        """The output of stage ``i`` over ``region``, a tuple of slices with explicit, non-negative bounds"""
+        if i < 0:
+            return np.asarray(self.data.values[region])
+        region = tuple(region)
+
+        def compute():
+            stage = self.stages[i]
+            inner = stage.input_region(region, self.data)
+            block = self.evaluate(i - 1, inner)
+            if self.data.mask is not None and i == 0:
+                mask = self.data.mask[tuple(r if n > 1 else slice(None) for r, n in zip(inner, self.data.mask.shape))]
+                block = np.where(mask != 0, block, np.nan)
+            block = stage.apply(block.astype(np.result_type(block.dtype, np.float32), copy=False), inner, self.data)
+            out = block[tuple(slice(r.start - s.start, r.stop - s.start) for r, s in zip(region, inner))]
+            if out.shape != block.shape:
+                out = out.copy()  # do not keep the margins alive in the cache
+            out.flags.writeable = False
+            return out
+
+        key = (self.key(i), tuple((r.start, r.stop) for r in region))
+        return budget.get_or_compute(self, 'pipeline', key, compute)
+
+    def output(self, i: int = -1) -> RegularDataArray:
+        """The output of stage ``i``, by default the last one, as a lazily computed RegularDataArray"""
+        i = i % len(self.stages) if self.stages else -1
+        if i < 0:
+            return self.data
+        return RegularDataArray(StageArray(self, i), delta=self.data.delta, coord_min=self.data.coord_min,
+                                dims=self.data.dims, name=self.data.name, coords=self.data.coords)
+
+
+class StageArray(LazyArray):
+    """The output of one stage of a :class:`Pipeline`, computed where it is indexed. The parameters are read
+    when indexed, so the array follows later changes to the pipeline."""
+
+    def __init__(self, pipeline: Pipeline, i: int):
+        self.pipeline = pipeline
+        self.index = i
+        self.shape = pipeline.data.shape
+        self.dtype = np.dtype(np.result_type(pipeline.data.values.dtype, np.float32))
+
+    def _getitem(self, key):
+        region, post = [], []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, slice):
+                idx = range(*k.indices(n))
+                if len(idx) == 0:
+                    return np.empty([len(range(*s.indices(m))) for s, m in zip(key, self.shape)
+                                     if isinstance(s, slice)], dtype=self.dtype)
+                lo, hi = min(idx), max(idx) + 1
+                region.append(slice(lo, hi))
+                stop = idx.stop - lo
+                post.append(slice(idx.start - lo, stop if stop >= 0 else None, idx.step))
+            else:
+                region.append(slice(k, k + 1))
+                post.append(0)
+        return self.pipeline.evaluate(self.index, tuple(region))[tuple(post)]
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+class UpdateProfiler:
+    """Records the wall time of each stage of an ImageTool update, per panel, in rolling windows.
+
+    Stages are nested inside a panel context, so the time for e.g. ``mean`` is attributed to the panel whose
+    update triggered it::
+
+        with profiler.panel('xy'):
+            with profiler.stage('get_cut'):
+                ...
+
+    When ``enabled`` is False, :meth:`panel` and :meth:`stage` return a shared no-op context.
+    """
+    stages = ('get_cut', 'isel', 'mean', 'squeeze', 'set_data', 'paint')
+    _noop = nullcontext()
+
+    def __init__(self, history: int = 200, enabled: bool = False):
+        """:param history: Number of most recent samples kept for each panel and stage"""
+        self.enabled = enabled
+        self.history = history
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"UpdateProfiler[{'enabled' if self.enabled else 'disabled'}, {len(self._samples)} series]"
+
+    def panel(self, name: str):
+        """Attribute the stages recorded inside this context to panel ``name``"""
+        if not self.enabled:
+            return self._noop
+        return self._panel(name)
+
+    def stage(self, name: str):
+        """Time the code inside this context as stage ``name`` of the current panel"""
+        if not self.enabled:
+            return self._noop
+        return self._stage(name)
+
+    @contextmanager
+    def _panel(self, name):
+        stack = self._panel_stack()
+        stack.append(name)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    @contextmanager
+    def _stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack = self._panel_stack()
+            self.record(stack[-1] if stack else '', name, time.perf_counter() - t0)
+
+    def _panel_stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def record(self, panel: str, stage: str, seconds: float):
+        with self._lock:
+            if (panel, stage) not in self._samples:
+                self._samples[(panel, stage)] = deque(maxlen=self.history)
+            self._samples[(panel, stage)].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def samples(self, panel: str, stage: str) -> np.ndarray:
+        """The recorded times in seconds, oldest first"""
+        with self._lock:
+            return np.array(self._samples.get((panel, stage), ()))
+
+    def histogram(self, panel: str, stage: str, bins=20):
+        """Histogram of the recorded times of one stage, in milliseconds.
+
+        :return: (counts, bin_edges) as returned by :func:`np.histogram`
+        """
+        return np.histogram(self.samples(panel, stage)*1e3, bins=bins)
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Statistics of every recorded stage in milliseconds, as ``{panel: {stage: {statistic: value}}}``"""
+        with self._lock:
+            series = {k: np.array(v)*1e3 for k, v in self._samples.items() if len(v)}
+        out = {}
+        for (panel, stage), t in series.items():
+            out.setdefault(panel, {})[stage] = {'n': len(t), 'mean': float(t.mean()), 'median': float(np.median(t)),
+                                                'p95': float(np.percentile(t, 95)), 'max': float(t.max())}
+        return out
+
+    def report(self) -> str:
+        """A table of median and 95th percentile times of each stage"""
+        lines = []
+        for panel, stages in sorted(self.summary().items()):
+            lines.append(f"{panel or '-'}:")
+            for stage in sorted(stages, key=self._stage_order):
+                s = stages[stage]
+                lines.append(f"    {stage:<10} median {s['median']:8.3f} ms   p95 {s['p95']:8.3f} ms   n={s['n']}")
+        return '\n'.join(lines)
+
+    def status_text(self) -> str:
+        """One line summary of the median time spent per panel in cutting, setting data and painting"""
+        parts = []
+        for panel, stages in sorted(self.summary().items()):
+            times = ', '.join(f"{stage} {stages[stage]['median']:.1f}" for stage in ('get_cut', 'set_data', 'paint')
+                              if stage in stages)
+            if times:
+                parts.append(f"{panel}: {times}")
+        return ' | '.join(parts) + (' ms' if parts else '')
+
+    def _stage_order(self, stage):
+        return self.stages.index(stage) if stage in self.stages else len(self.stages)
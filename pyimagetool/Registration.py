@@ -0,0 +1,154 @@
+"""Drift correction of stacks of frames, e.g. images taken over a long acquisition.
+
+:func:`estimate_shifts` cross-correlates every frame with a reference using FFTs and refines the correlation peak
+to a fraction of an element with a parabola through its neighbours. :func:`apply_shifts` moves every frame back by
+its shift with separable linear interpolation. Frames are processed in chunks spread over a thread pool, which
+shares the input without copying it; scipy.fft and the NumPy kernels release the GIL.
+"""
+import warnings
+
+import numpy as np
+from scipy import fft
+
+from .DataMatrix import RegularDataArray
+from .Parallel import map_chunks
+
+
+def _chunks(n: int, frame_size: int):
+    """Slices of a few megabytes worth of frames"""
+    step = max(1, 2**19//max(frame_size, 1))
+    return [slice(lo, min(lo + step, n)) for lo in range(0, n, step)]
+
+
+def _frames(data, axis: int) -> np.ndarray:
+    """The frames of ``data`` along the first axis, with masked elements set to NaN"""
+    if isinstance(data, RegularDataArray):
+        mat = np.asarray(data.values)
+        if data.mask is not None:
+            mat = np.where(data.mask != 0, mat, np.nan)
+    else:
+        mat = np.asarray(data)
+    return np.moveaxis(mat, axis, 0)
+
+
+def _centered(block: np.ndarray, axes) -> np.ndarray:
+    """``block`` minus its mean over ``axes``, with non-finite elements set to zero, i.e. to the mean, so that they
+    do not take part in the correlation"""
+    finite = np.isfinite(block)
+    count = finite.sum(axis=axes, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(finite, block, 0).sum(axis=axes, keepdims=True)/count
+    return np.where(finite, block - mean, 0)
+
+
+def estimate_shifts(data, axis: int = 0, reference=None, workers: int = None) -> np.ndarray:
+    """Displacement of every frame relative to a reference, in elements.
+
+    NaNs and masked elements are left out of the correlation. Frames without any finite element get NaN shifts,
+    with a warning.
+
+    :param data: RegularDataArray or array holding the frames along ``axis``
+    :param axis: The frame axis
+    :param reference: The frame to align to: an index along ``axis``, an array shaped like a frame, or None for
+        the mean of all frames
+    :param workers: Number of threads
+    :return: (number of frames, frame ndim) array, so that frame ``k`` at ``x + shifts[k]`` matches the
+        reference at ``x``
+    """
+    frames = _frames(data, axis)
+    frame_shape = frames.shape[1:]
+    fft_axes = tuple(range(1, frames.ndim))
+    if reference is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # elements that are NaN in every frame
+            reference = np.nanmean(frames, axis=0)
+    elif np.ndim(reference) == 0:
+        reference = frames[int(reference)]
+    reference = np.asarray(reference, dtype=float)
+    if reference.shape != frame_shape:
+        raise ValueError(f"The reference has shape {reference.shape}, but frames have shape {frame_shape}")
+    if not np.isfinite(reference).any():
+        raise ValueError("The reference has no finite elements")
+    ref_spectrum = np.conj(fft.rfftn(_centered(reference, None)))
+    shifts = np.empty((len(frames), len(frame_shape)))
+
+    def work(chunk):
+        block = frames[chunk].astype(float)
+        empty = ~np.isfinite(block).reshape(len(block), -1).any(axis=1)
+        block = _centered(block, fft_axes)
+        corr = fft.irfftn(fft.rfftn(block, axes=fft_axes)*ref_spectrum, s=frame_shape, axes=fft_axes)
+        flat = corr.reshape(len(corr), -1)
+        peak = np.array(np.unravel_index(np.argmax(flat, axis=1), frame_shape)).T  # (frames, frame ndim)
+        rows = np.arange(len(corr))
+        c0 = flat[rows, np.argmax(flat, axis=1)]
+        for d, n in enumerate(frame_shape):
+            offset = 0.0
+            if n >= 3:
+                # parabolic refinement from the neighbours of the peak, which wrap around like the correlation
+                lo, hi = peak.copy(), peak.copy()
+                lo[:, d] = (peak[:, d] - 1) % n
+                hi[:, d] = (peak[:, d] + 1) % n
+                cm = corr[(rows,) + tuple(lo.T)]
+                cp = corr[(rows,) + tuple(hi.T)]
+                denom = cm - 2*c0 + cp
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    offset = np.where(denom < 0, 0.5*(cm - cp)/denom, 0.0)
+            s = peak[:, d] + offset
+            shifts[chunk, d] = np.where(empty, np.nan, np.where(s > n/2, s - n, s))
+
+    map_chunks(work, _chunks(len(frames), int(np.prod(frame_shape))), workers)
+    missing = np.isnan(shifts[:, 0])
+    if missing.any():
+        warnings.warn(f"Frames {np.flatnonzero(missing).tolist()} have no finite elements, their shifts are NaN")
+    return shifts
+
+
+def apply_shifts(data, shifts, axis: int = 0, workers: int = None) -> np.ndarray:
+    """Sample every frame ``k`` at ``x + shifts[k]`` with separable linear interpolation, so that frames displaced
+    by ``shifts`` are moved back onto the reference. Elements that come from outside of a frame, or of frames with
+    NaN shifts, are NaN.
+
+    :return: Float array shaped like the data
+    """
+    frames = _frames(data, axis)
+    frame_shape = frames.shape[1:]
+    shifts = np.asarray(shifts, dtype=float).reshape(len(frames), len(frame_shape))
+    dtype = np.result_type(frames.dtype, np.float32)
+    out = np.empty(frames.shape, dtype=dtype)
+
+    def work(chunk):
+        block = frames[chunk].astype(dtype)
+        for d, n in enumerate(frame_shape):
+            src = np.arange(n)[None, :] + shifts[chunk, d][:, None]  # (frames, n) sample positions
+            valid = (src >= -1e-9) & (src <= n - 1 + 1e-9)
+            src = np.where(valid, src, 0)
+            i0 = np.clip(np.floor(src), 0, max(n - 2, 0)).astype(np.intp)
+            w = np.clip(src - i0, 0, 1).astype(dtype)
+            bshape = [len(src)] + [1]*len(frame_shape)
+            bshape[d + 1] = n
+            i0, w, valid = (a.reshape(bshape) for a in (i0, w, valid))
+            a = np.take_along_axis(block, np.broadcast_to(i0, block.shape), axis=d + 1)
+            b = np.take_along_axis(block, np.broadcast_to(np.minimum(i0 + 1, n - 1), block.shape), axis=d + 1)
+            # a neighbour with zero weight does not count, even if it is NaN
+            block = np.where(w == 0, a, np.where(w == 1, b, (1 - w)*a + w*b))
+            block[~np.broadcast_to(valid, block.shape)] = np.nan
+        out[chunk] = block
+
+    map_chunks(work, _chunks(len(frames), int(np.prod(frame_shape))), workers)
+    return np.moveaxis(out, 0, axis)
+
+
+def align(data: RegularDataArray, axis: int = 0, reference=None, workers: int = None):
+    """Estimate the drift of every frame of ``data`` along ``axis`` and correct it.
+
+    :param reference: See :func:`estimate_shifts`
+    :return: (aligned RegularDataArray on the grid of ``data``, shifts in elements as returned by
+        :func:`estimate_shifts`)
+    """
+    data = data if isinstance(data, RegularDataArray) else RegularDataArray(data)
+    axis = axis % data.ndim
+    shifts = estimate_shifts(data, axis, reference, workers)
+    mat = apply_shifts(data, shifts, axis, workers)
+    aligned = RegularDataArray(mat, delta=data.delta, coord_min=data.coord_min, dims=data.dims, name=data.name,
+                               coords=data.coords, copy=False)
+    return aligned, shifts
@@ -0,0 +1,116 @@
+from functools import lru_cache
+
+import numpy as np
+
+from .Parallel import map_chunks, n_workers
+
+
+def linear_weights(src: np.ndarray, dst: np.ndarray):
+    """Tabulate linear interpolation from the ascending coordinates ``src`` onto ``dst``.
+
+    :return: (i0, w, valid), so that the value at ``dst[k]`` is ``(1 - w[k])*f[i0[k]] + w[k]*f[i0[k] + 1]``, and
+        ``valid[k]`` is False where ``dst[k]`` lies outside of ``src``
+    """
+    src = np.asarray(src, dtype=float)
+    dst = np.asarray(dst, dtype=float)
+    if len(src) == 1:
+        return np.zeros(len(dst), dtype=np.intp), np.zeros(len(dst)), np.isclose(dst, src[0])
+    span = (src[-1] - src[0])*1e-9  # tolerate rounding at the ends of the grid
+    valid = (dst >= src[0] - span) & (dst <= src[-1] + span)
+    i0 = np.clip(np.searchsorted(src, dst, side='right') - 1, 0, len(src) - 2)
+    w = np.clip((dst - src[i0])/(src[i0 + 1] - src[i0]), 0, 1)
+    return i0, w, valid
+
+
+def nearest_weights(src: np.ndarray, dst: np.ndarray):
+    """Like :func:`linear_weights`, for nearest neighbour resampling: every weight is zero"""
+    i0, w, valid = linear_weights(src, dst)
+    i0 = np.minimum(i0 + (w > 0.5), len(src) - 1)
+    return i0, np.zeros(len(dst)), valid
+
+
+@lru_cache(maxsize=64)
+def _cached_tables(src: bytes, dst: bytes, method: str):
+    src, dst = np.frombuffer(src), np.frombuffer(dst)
+    if method == 'linear':
+        return linear_weights(src, dst)
+    elif method == 'nearest':
+        return nearest_weights(src, dst)
+    raise ValueError(f"Unknown resampling method {method}, should be 'linear' or 'nearest'")
+
+
+def axis_tables(src, dst, method: str = 'linear'):
+    """The (i0, w, valid) tables resampling from ``src`` onto ``dst``. The most recently used tables are cached,
+    so regridding many datasets onto a common grid tabulates each axis once."""
+    return _cached_tables(np.ascontiguousarray(src, dtype=float).tobytes(),
+                          np.ascontiguousarray(dst, dtype=float).tobytes(), method)
+
+
+def resample_axis(arr: np.ndarray, axis: int, src, dst, workers: int = None, tables=None) -> np.ndarray:
+    """Resample ``arr`` along ``axis`` from coordinates ``src`` onto ``dst``, linearly unless ``tables`` come from
+    :func:`nearest_weights`. Points outside of ``src`` become NaN.
+
+    The work is split along the largest other axis and run in ``workers`` threads, since NumPy releases the GIL
+    for the gathers and arithmetic.
+
+    :param tables: (i0, w, valid) from :func:`axis_tables`, to reuse them across calls
+    """
+    i0, w, valid = linear_weights(src, dst) if tables is None else tables
+    arr = np.asarray(arr)
+    dtype = np.result_type(arr.dtype, np.float32)
+    shape = list(arr.shape)
+    shape[axis] = len(i0)
+    out = np.empty(shape, dtype=dtype)
+    wshape = [1]*arr.ndim
+    wshape[axis] = len(i0)
+    w = w.astype(dtype).reshape(wshape)
+    invalid = ~valid
+    # points on a node take its value alone, so that a NaN neighbour with zero weight does not spread
+    on_a, on_b = w == 0, w == 1
+
+    nearest = not w.any()
+
+    def work(sl):
+        a = np.take(arr[sl], i0, axis=axis).astype(dtype, copy=False)
+        if nearest:
+            out[sl] = a
+            if invalid.any():
+                out[sl][(slice(None),)*axis + (invalid,)] = np.nan
+            return
+        b = np.take(arr[sl], i0 + 1 if arr.shape[axis] > 1 else i0, axis=axis)
+        o = out[sl]
+        np.subtract(b, a, out=o)
+        o *= w
+        o += a
+        if on_a.any():
+            np.copyto(o, a, where=on_a)
+        if on_b.any():
+            np.copyto(o, b, where=on_b)
+        if invalid.any():
+            o[(slice(None),)*axis + (invalid,)] = np.nan
+
+    others = [a for a in range(arr.ndim) if a != axis]
+    workers = n_workers(workers)
+    split = max(others, key=lambda a: arr.shape[a]) if others else None
+    if split is None or workers <= 1 or out.size < 2**20:
+        work((slice(None),)*arr.ndim)
+        return out
+    bounds = np.linspace(0, arr.shape[split], min(workers, arr.shape[split]) + 1).astype(int)
+    slices = [(slice(None),)*split + (slice(lo, hi),) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    map_chunks(work, slices, workers)
+    return out
+
+
+def resample(arr: np.ndarray, src, dst, workers: int = None, method: str = 'linear') -> np.ndarray:
+    """Separable resampling of ``arr`` from the coordinates ``src`` onto ``dst``, one axis at a time. Each pass
+    is O(N), where point-wise interpolation costs O(N*2**ndim).
+
+    :param src: One coordinate array per axis
+    :param dst: One coordinate array per axis, or None for axes that are kept as they are
+    :param method: ``linear`` or ``nearest``
+    """
+    todo = [a for a in range(arr.ndim) if dst[a] is not None]
+    # axes that shrink the most go first, so later passes work on less data
+    for a in sorted(todo, key=lambda a: len(dst[a])/arr.shape[a]):
+        arr = resample_axis(arr, a, src[a], dst[a], workers, tables=axis_tables(src[a], dst[a], method))
+    return arr
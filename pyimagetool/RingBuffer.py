@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+
+from .DataMatrix import RegularDataArray
+
+
+class RingBuffer:
+    """A preallocated buffer holding the most recent ``capacity`` frames of a live acquisition along one axis.
+
+    Appending a frame is O(1) and never reallocates. :meth:`snapshot` returns a read-only
+    :class:`RegularDataArray` that is a view into the buffer, whose ``coord_min`` along the ring axis advances as
+    old frames drop out::
+
+        ring = RingBuffer((nx, ny), capacity=500, axis=2, delta=[dx, dy, dt], dims=('x', 'y', 't'))
+        ring.append(frame)  # in the acquisition thread
+        data = ring.snapshot()  # in the GUI thread
+
+    Frames live in a linear buffer three times the capacity. When the end of the buffer is reached, the last
+    ``capacity`` frames are copied back to its start, which costs one frame copy per two appends on average. A
+    snapshot stays consistent for at least ``capacity`` further appends, see :meth:`is_current`.
+    """
+
+    def __init__(self, frame_shape, capacity: int, axis: int = 0, delta=None, coord_min=None, dims=None,
+                 dtype=float, name='Live'):
+        """
+        :param frame_shape: Shape of one frame
+        :param capacity: Maximum number of frames held
+        :param axis: Position of the ring axis in the snapshots
+        :param delta: Grid spacing of each axis of the snapshots, including the ring axis
+        :param coord_min: Coordinate of the first frame ever appended and of the first element of the other axes
+        :param dims: Labels of each dimension of the snapshots
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.frame_shape = tuple(frame_shape)
+        self.capacity = int(capacity)
+        ndim = len(self.frame_shape) + 1
+        self.axis = axis % ndim
+        self.delta = np.ones(ndim) if delta is None else np.array(delta, dtype=float)
+        self.coord_min = np.zeros(ndim) if coord_min is None else np.array(coord_min, dtype=float)
+        if self.delta.shape != (ndim,) or self.coord_min.shape != (ndim,):
+            raise ValueError(f"delta and coord_min need {ndim} entries, one for each axis including the ring axis")
+        self.dims = dims
+        self.name = name
+        shape = list(self.frame_shape)
+        shape.insert(self.axis, 3*self.capacity)
+        self._buffer = np.empty(shape, dtype=dtype)
+        self._start = 0  # buffer index of the oldest frame held
+        self._stop = 0  # buffer index one past the newest frame
+        self._count = 0  # total number of frames appended
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"RingBuffer[{len(self)}/{self.capacity} frames of {self.frame_shape}, {self._count} appended]"
+
+    def __len__(self):
+        return self._stop - self._start
+
+    @property
+    def count(self) -> int:
+        """Total number of frames appended so far"""
+        return self._count
+
+    def _index(self, i):
+        return (slice(None),)*self.axis + (i,)
+
+    def append(self, frame):
+        """Append one frame, dropping the oldest if the buffer is full"""
+        frame = np.asarray(frame)
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame of shape {frame.shape} does not match {self.frame_shape}")
+        with self._lock:
+            if self._stop == self._buffer.shape[self.axis]:
+                n = self._stop - self._start
+                self._buffer[self._index(slice(0, n))] = self._buffer[self._index(slice(self._start, self._stop))]
+                self._start, self._stop = 0, n
+            self._buffer[self._index(self._stop)] = frame
+            self._stop += 1
+            self._count += 1
+            if self._stop - self._start > self.capacity:
+                self._start += 1
+
+    def clear(self):
+        with self._lock:
+            self._start = self._stop = self._count = 0
+
+    def snapshot(self) -> RegularDataArray:
+        """The frames currently held, as a read-only view. Returns None while the buffer is empty.
+
+        The snapshot's ``frame_count`` attribute is the total number of frames appended when it was taken.
+        """
+        with self._lock:
+            start, stop, count = self._start, self._stop, self._count
+        if stop == start:
+            return None
+        view = self._buffer[self._index(slice(start, stop))]
+        view.flags.writeable = False
+        coord_min = self.coord_min.copy()
+        coord_min[self.axis] += (count - (stop - start))*self.delta[self.axis]
+        out = RegularDataArray(view, delta=self.delta, coord_min=coord_min, dims=self.dims, name=self.name,
+                               copy=False)
+        out.frame_count = count
+        return out
+
+    def is_current(self, snapshot: RegularDataArray) -> bool:
+        """Whether ``snapshot`` is guaranteed to be intact. A snapshot taken after frame ``n`` was appended stays
+        intact at least until frame ``n + capacity`` is appended."""
+        return self._count - snapshot.frame_count <= self.capacity
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import numpy as np
+
+from .CutEngine import prefix_tables
+from .DataMatrix import RegularDataArray
+from .MemoryBudget import budget
+
+SIDECAR_VERSION = 1
+_categories = ('prefix_sum', 'mask_prefix_sum')  # budget categories persisted in a sidecar
+_executor = ThreadPoolExecutor(1)
+
+
+def sidecar_path(path) -> str:
+    """The sidecar directory belonging to the data file or directory ``path``"""
+    return os.fspath(path).rstrip('/\\') + '.pyimagetool'
+
+
+def _file_stats(data: RegularDataArray, path=None) -> list:
+    """(name, size, mtime in ns) of the files holding ``data``: ``path`` or the files directly inside it, and the
+    file ``data`` is memory-mapped from"""
+    files = []
+    if path is not None:
+        path = os.fspath(path)
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path))
+        elif os.path.exists(path):
+            files.append(path)
+    if isinstance(data.values, np.memmap) and data.values.filename:
+        files.append(os.fspath(data.values.filename))
+    stats = []
+    for f in dict.fromkeys(os.path.abspath(f) for f in files):
+        st = os.stat(f)
+        if os.path.isfile(f):
+            stats.append([os.path.basename(f), st.st_size, st.st_mtime_ns])
+    return stats
+
+
+def fingerprint(data: RegularDataArray, full: bool = False, path=None) -> str:
+    """A hash identifying the content of ``data``, its grid and its mask.
+
+    By default the content is sampled: a few blocks from up to 16 slabs along the first axis. That reads a few
+    hundred kilobytes however large the data is, at the price of missing changes that touch none of the sampled
+    elements. The size and modification time of the files holding the data (``path``, or the file it is
+    memory-mapped from) are hashed too, so that rewriting a file anywhere invalidates it. Use ``full=True`` to hash
+    every element.
+    """
+    h = hashlib.sha256()
+    header = {'version': SIDECAR_VERSION, 'shape': list(data.shape), 'dtype': str(data.values.dtype),
+              'delta': [float(d) for d in data.delta], 'coord_min': [float(c) for c in data.coord_min],
+              'files': _file_stats(data, path)}
+    h.update(json.dumps(header).encode())
+    if full:
+        h.update(np.ascontiguousarray(data.values).tobytes())
+    elif data.values.size:
+        n = data.shape[0]
+        for i in np.unique(np.linspace(0, n - 1, min(16, n)).round().astype(int)):
+            slab = data.values[i]
+            flat = np.reshape(slab, -1)  # a view for contiguous (memory-mapped) arrays
+            block = min(1024, flat.size)
+            for start in np.linspace(0, flat.size - block, min(8, flat.size // block)).astype(int):
+                h.update(np.ascontiguousarray(flat[start:start + block]).tobytes())
+    if data.mask is not None:
+        h.update(str(data.mask.shape).encode())
+        h.update(np.ascontiguousarray(data.mask).tobytes())
+    return h.hexdigest()
+
+
+class Sidecar:
+    """A versioned directory next to a data file holding what has been derived from the data: NaN and level
+    statistics, and the prefix-sum tables behind :meth:`CutEngine.get_cuts`, built for the line cuts along every
+    axis by :meth:`rebuild` and for any other cuts as they are used.
+
+    Arrays are stored as ``.npy`` files and memory-mapped back, so reopening costs no computation and no reading
+    beyond what is used. A ``manifest.json`` records the format version and the :func:`fingerprint` of the data,
+    and a sidecar whose fingerprint does not match is stale. See :func:`attach`.
+    """
+
+    def __init__(self, path):
+        """:param path: The data file or directory the sidecar belongs to"""
+        self.data_path = os.fspath(path)
+        self.path = sidecar_path(path)
+
+    def fingerprint(self, data: RegularDataArray) -> str:
+        """The :func:`fingerprint` of ``data`` read from the data path. When no file backs the data, so that an
+        edit would not change a file's modification time, every element is hashed, since a sampled hash could
+        reuse stale prefix tables."""
+        return fingerprint(data, full=not _file_stats(data, self.data_path), path=self.data_path)
+
+    def __repr__(self):
+        return f"Sidecar[{self.path}]"
+
+    def manifest(self) -> dict:
+        """The manifest, or None if there is no readable sidecar"""
+        try:
+            with open(os.path.join(self.path, 'manifest.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_current(self, data: RegularDataArray, fp: str = None) -> bool:
+        manifest = self.manifest()
+        return manifest is not None and manifest.get('version') == SIDECAR_VERSION and \
+            manifest.get('fingerprint') == (fp or self.fingerprint(data))
+
+    def load(self, data: RegularDataArray, fp: str = None) -> bool:
+        """Attach the statistics and tables of a current sidecar to ``data``.
+
+        :return: Whether the sidecar was current and has been loaded
+        """
+        if not self.is_current(data, fp):
+            return False
+        manifest = self.manifest()
+        stats = manifest['statistics']
+        if stats.get('has_nan') is not None:
+            data._has_nan = stats['has_nan']
+        if stats.get('levels') is not None:
+            data._levels = tuple(np.nan if v is None else v for v in stats['levels'])
+        for entry in manifest['tables']:
+            arrays = [None if f is None else np.load(os.path.join(self.path, f), mmap_mode='r')
+                      for f in entry['files']]
+            value = tuple(arrays) if entry['category'] == 'prefix_sum' else arrays[0]
+            budget.put(data, entry['category'], tuple(entry['key']), value, nbytes=0)
+        return True
+
+    def save(self, data: RegularDataArray, fp: str = None):
+        """Write the statistics of ``data`` and the tables cached for it in the memory budget.
+
+        Files are written under new names before the manifest is replaced, so readers never see a partial
+        sidecar and arrays memory-mapped from an earlier version stay valid.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        previous = self.manifest() or {'tables': []}
+        tables = []
+        for category in _categories:
+            for key, value in budget.items(data, category):
+                arrays = value if isinstance(value, tuple) else (value,)
+                tables.append({'category': category, 'key': [int(k) for k in key],
+                               'files': [None if a is None else self._write(a) for a in arrays]})
+        levels = data._levels
+        manifest = {'version': SIDECAR_VERSION, 'fingerprint': fp or self.fingerprint(data),
+                    'statistics': {'has_nan': data._has_nan,
+                                   'levels': None if levels is None else
+                                   [None if np.isnan(v) else float(v) for v in levels]},
+                    'tables': tables}
+        tmp = os.path.join(self.path, f'manifest.{uuid.uuid4().hex}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, 'manifest.json'))
+        # remove files only referenced by the previous manifest
+        keep = {f for entry in tables for f in entry['files']}
+        for entry in previous['tables']:
+            for f in entry['files']:
+                if f is not None and f not in keep:
+                    try:
+                        os.remove(os.path.join(self.path, f))
+                    except OSError:
+                        pass
+
+    def _write(self, arr: np.ndarray) -> str:
+        """Save an array unless it is already memory-mapped from this sidecar, and return its file name"""
+        if isinstance(arr, np.memmap) and arr.filename and \
+                os.path.dirname(os.path.abspath(arr.filename)) == os.path.abspath(self.path):
+            return os.path.basename(arr.filename)
+        name = f'{uuid.uuid4().hex}.npy'
+        np.save(os.path.join(self.path, name), np.asarray(arr))
+        return name
+
+    def rebuild(self, data: RegularDataArray, fp: str = None, cuts=None):
+        """Compute the statistics of ``data`` and the prefix-sum tables of its cuts, and save them with any other
+        cached tables. Each table is written as soon as it is computed and memory-mapped back, so that only one is
+        held in memory at a time. Lazy data has no tables, since its cuts are read by slicing.
+
+        :param cuts: The axes kept by the cuts to build tables for, each an axis or a tuple of axes as for
+            :meth:`CutEngine.get_cuts`. By default the line cuts along every axis
+        """
+        fp = fp or self.fingerprint(data)
+        _ = data.has_nan
+        data.levels()
+        if isinstance(data.values, np.ndarray):
+            os.makedirs(self.path, exist_ok=True)
+            for kept in (range(data.ndim) if cuts is None else cuts):
+                kept = {int(a) % data.ndim for a in np.atleast_1d(kept)}
+                comp = tuple(a for a in range(data.ndim) if a not in kept)
+                total, weight, mask_table = prefix_tables(data, comp)
+                self._persist(data, 'prefix_sum', comp, (total, weight))
+                if mask_table is not None:
+                    self._persist(data, 'mask_prefix_sum', comp, mask_table)
+        self.save(data, fp)
+
+    def _persist(self, data: RegularDataArray, category: str, key, value):
+        """Write a cached table and replace it in the memory budget by its memory map, which costs no RAM"""
+        arrays = value if isinstance(value, tuple) else (value,)
+        mapped = tuple(None if a is None else np.load(os.path.join(self.path, self._write(a)), mmap_mode='r')
+                       for a in arrays)
+        budget.put(data, category, key, mapped if isinstance(value, tuple) else mapped[0], nbytes=0)
+
+
+def attach(data: RegularDataArray, path, background: bool = True):
+    """Load the sidecar of ``path`` into ``data``, or rebuild it if it is missing or stale.
+
+    :param background: Rebuild in a background thread instead of before returning
+    :return: (sidecar, loaded, future), where ``loaded`` tells whether a current sidecar was loaded and ``future``
+        tracks a rebuild, or is None if there was nothing to rebuild
+    """
+    sidecar = Sidecar(path)
+    fp = sidecar.fingerprint(data)
+    if sidecar.load(data, fp):
+        return sidecar, True, None
+    if background:
+        return sidecar, False, _executor.submit(sidecar.rebuild, data, fp)
+    future = Future()
+    sidecar.rebuild(data, fp)
+    future.set_result(None)
+    return sidecar, False, future
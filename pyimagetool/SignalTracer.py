@@ -0,0 +1,154 @@
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+
+from .DataModel import SingleValueModel
+
+
+class TraceNode:
+    """One step of a signal cascade: a user action, a model emitting ``value_set``, or a slot invoked by it"""
+
+    def __init__(self, kind: str, name: str, changed: bool = True):
+        self.kind = kind  # 'action', 'emit' or 'slot'
+        self.name = name
+        self.changed = changed  # for an emission, whether the model's value actually changed
+        self.duration = 0.0  # seconds
+        self.children: List[TraceNode] = []
+
+    def __repr__(self):
+        return f"TraceNode[{self.kind} {self.name}, {len(self.children)} children]"
+
+    def walk(self):
+        """Iterate over this node and all of its descendants, depth first"""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def dump(self, indent: int = 0) -> str:
+        label = self.name
+        if self.kind == 'emit':
+            label = f"emit {self.name}" + ('' if self.changed else ' (unchanged)')
+        lines = [f"{'  '*indent}{label}  {self.duration*1e3:.3f} ms"]
+        lines += [child.dump(indent + 1) for child in self.children]
+        return '\n'.join(lines)
+
+
+class SignalTracer:
+    """Debug tracer for the DataModel layer. While active, every ``value_set`` emission of a
+    :class:`SingleValueModel` (and every ``Cursor.changed`` notification) and every Python slot it invokes is
+    recorded in a call tree with timings::
+
+        with SignalTracer() as tracer:
+            with tracer.action('move x'):
+                tool.pg_win.cursor.set_pos(0, 1.5)
+        print(tracer.dump())
+        tracer.emissions()['Cursor.index[0]']
+
+    Emissions outside of an :meth:`action` block each start their own tree. Slots are found with
+    :func:`sys.setprofile`, so tracing is slow and meant for debugging and tests only.
+    """
+
+    def __init__(self):
+        self.actions: List[TraceNode] = []
+        self._stack: List[TraceNode] = []
+        self._previous: Optional[SignalTracer] = None
+
+    def __enter__(self):
+        self._previous = SingleValueModel.tracer
+        SingleValueModel.tracer = self
+        return self
+
+    def __exit__(self, *exc):
+        SingleValueModel.tracer = self._previous
+        return False
+
+    @contextmanager
+    def action(self, name: str):
+        """Group everything emitted inside this block under one user action"""
+        node = TraceNode('action', name)
+        self._attach(node)
+        self._stack.append(node)
+        t0 = time.perf_counter()
+        try:
+            yield node
+        finally:
+            node.duration = time.perf_counter() - t0
+            self._stack.pop()
+
+    def emit(self, model: SingleValueModel, old):
+        """Emit ``model.value_set`` while recording the cascade it triggers. Called by the model."""
+        self.emit_signal(model.name or repr(model), model.value_set, model._value, changed=not _same(old, model._value))
+
+    def emit_signal(self, name: str, signal, value, changed: bool = True):
+        """Emit any bound signal with ``value`` while recording the cascade it triggers"""
+        node = TraceNode('emit', name, changed=changed)
+        self._attach(node)
+        self._stack.append(node)
+        emitter = sys._getframe()
+        slots = {}  # frame of a running slot -> its node
+
+        def profile(frame, event, _):
+            if event == 'call' and frame.f_back is emitter:
+                code = frame.f_code
+                slot = TraceNode('slot', getattr(code, 'co_qualname', code.co_name))
+                node.children.append(slot)
+                self._stack.append(slot)
+                slots[frame] = (slot, time.perf_counter())
+            elif event == 'return' and frame in slots:
+                slot, t0 = slots.pop(frame)
+                slot.duration = time.perf_counter() - t0
+                self._stack.pop()
+
+        previous_profile = sys.getprofile()
+        t0 = time.perf_counter()
+        sys.setprofile(profile)
+        try:
+            signal.emit(value)
+        finally:
+            sys.setprofile(previous_profile)
+            node.duration = time.perf_counter() - t0
+            self._stack.pop()
+
+    def _attach(self, node: TraceNode):
+        if self._stack:
+            self._stack[-1].children.append(node)
+        else:
+            self.actions.append(node)
+
+    def _nodes(self, kind):
+        return (n for root in self.actions for n in root.walk() if n.kind == kind)
+
+    def emissions(self) -> Counter:
+        """Number of emissions per model"""
+        return Counter(n.name for n in self._nodes('emit'))
+
+    def redundant_emissions(self) -> Counter:
+        """Number of emissions per model where the value did not change"""
+        return Counter(n.name for n in self._nodes('emit') if not n.changed)
+
+    def slot_calls(self) -> Counter:
+        """Number of invocations per slot"""
+        return Counter(n.name for n in self._nodes('slot'))
+
+    def slot_time(self) -> Counter:
+        """Total seconds spent per slot, including any cascade it triggered"""
+        total = Counter()
+        for n in self._nodes('slot'):
+            total[n.name] += n.duration
+        return total
+
+    def dump(self) -> str:
+        """The recorded call trees with timings"""
+        return '\n'.join(root.dump() for root in self.actions)
+
+    def clear(self):
+        self.actions = []
+
+
+def _same(a, b) -> bool:
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,141 @@
+"""Symmetrization of data about a mirror plane, e.g. about the Fermi level or a high-symmetry momentum.
+
+The mirror image of element ``i`` along an axis is at the fractional index ``s - i``, where ``s`` is twice the
+index of the center. The fractional part of ``s`` is the same for every element, so the reflection is a reversed
+slice of the data, blended with its neighbour when the center is off the grid. Every other axis is carried along
+by the slicing, and a center on the grid gives a view of the data without interpolation.
+
+Modes combine the data ``a`` with its reflection ``b``:
+
+* ``'average'``: ``(a + b)/2`` where both exist, and whichever exists elsewhere
+* ``'sum'``: ``a + b``, e.g. to remove the Fermi function about the Fermi level. NaN where the two do not overlap
+* ``'reflect'``: ``b`` alone
+"""
+import numpy as np
+
+from .DataMatrix import RegularDataArray
+from .LazyArray import LazyArray
+
+MODES = ('average', 'sum', 'reflect')
+
+
+def reflection(data: RegularDataArray, axis: int, center: float):
+    """(s0, w): the mirror image of element ``i`` along ``axis`` is at index ``s0 - i + w``, with 0 <= w < 1"""
+    s = 2*data.scale_to_index(axis, center)
+    s0 = int(np.floor(s + 1e-9))
+    w = s - s0
+    return s0, (0.0 if w < 1e-9 else float(w))
+
+
+def _source(data: RegularDataArray, key) -> np.ndarray:
+    """``data`` over ``key``, with masked elements set to NaN"""
+    block = data.values[key]
+    if data.mask is not None:
+        mask = data.mask[tuple(k if n > 1 else (slice(None) if isinstance(k, slice) else 0)
+                               for k, n in zip(key, data.mask.shape))]
+        block = np.where(mask != 0, block, np.nan)
+    return block
+
+
+def symmetrize_block(data: RegularDataArray, axis: int, s0: int, w: float, mode: str, key) -> np.ndarray:
+    """The symmetrized data over ``key``, one int or slice per axis, with elements lo to hi along ``axis``
+    selected by ``key[axis] = slice(lo, hi + 1)``"""
+    n = data.shape[axis]
+    lo, hi = key[axis].start, key[axis].stop - 1
+    # the reflection reads elements s0 - hi to s0 - lo, plus one more when it interpolates
+    a, b = s0 - hi, s0 - lo + (1 if w else 0)
+    start, stop = min(max(a, 0), n), min(max(b + 1, 0), n)
+    if stop <= start:
+        # the whole reflection is outside of the data
+        shape = [len(range(*k.indices(m))) for k, m in zip(key, data.shape) if isinstance(k, slice)]
+        reflected = np.full(shape, np.nan, dtype=np.result_type(data.values.dtype, np.float32))
+    else:
+        inner = list(key)
+        inner[axis] = slice(start, stop)
+        src = _source(data, tuple(inner))
+        dim = sum(isinstance(k, slice) for k in key[:axis])  # the position of axis in the block
+        if start - a or b + 1 - stop:
+            # parts of the reflection outside of the data
+            pad = [(0, 0)]*src.ndim
+            pad[dim] = (start - a, b + 1 - stop)
+            src = np.pad(src.astype(np.result_type(src.dtype, np.float32), copy=False), pad, constant_values=np.nan)
+        rev = src[(slice(None),)*dim + (slice(None, None, -1),)]
+        if w:
+            lead = (slice(None),)*dim
+            reflected = (1 - w)*rev[lead + (slice(1, None),)] + w*rev[lead + (slice(None, -1),)]
+        else:
+            reflected = rev
+    if mode == 'reflect':
+        return reflected
+    direct = _source(data, tuple(key))
+    if mode == 'sum':
+        return direct + reflected
+    with np.errstate(invalid='ignore'):
+        count = np.isfinite(direct).astype(np.float32) + np.isfinite(reflected)
+        total = np.where(np.isfinite(direct), direct, 0) + np.where(np.isfinite(reflected), reflected, 0)
+        return np.where(count > 0, total/count, np.nan)
+
+
+def _check(data: RegularDataArray, axis: int, mode: str):
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode}, should be one of {MODES}")
+    if data.coords[axis % data.ndim] is not None:
+        raise ValueError(f"Axis {axis} is not regular, see RegularDataArray.regularize")
+    return axis % data.ndim
+
+
+def symmetrize(data: RegularDataArray, axis: int, center: float = 0.0, mode: str = 'average') -> RegularDataArray:
+    """Symmetrize ``data`` about ``center`` along ``axis``, on the grid of ``data``. The result is a view of the
+    data when nothing needs to be computed, i.e. in ``'reflect'`` mode about the middle element of the axis.
+
+    :param center: The coordinate of the mirror plane, anywhere on or between grid points
+    :param mode: ``'average'``, ``'sum'`` or ``'reflect'``
+    """
+    axis = _check(data, axis, mode)
+    s0, w = reflection(data, axis, center)
+    key = (slice(None),)*axis + (slice(0, data.shape[axis]),) + (slice(None),)*(data.ndim - axis - 1)
+    mat = symmetrize_block(data, axis, s0, w, mode, key)
+    return RegularDataArray(mat, delta=data.delta, coord_min=data.coord_min, dims=data.dims, name=data.name,
+                            coords=data.coords, copy=False)
+
+
+def view(data: RegularDataArray, axis: int, center: float = 0.0, mode: str = 'average') -> RegularDataArray:
+    """Like :func:`symmetrize`, but computed only where the result is indexed, e.g. for the cuts ImageTool shows"""
+    axis = _check(data, axis, mode)
+    out = RegularDataArray(SymmetrizedArray(data, axis, center, mode), delta=data.delta, coord_min=data.coord_min,
+                           dims=data.dims, name=data.name, coords=data.coords)
+    out._has_nan = True
+    return out
+
+
+class SymmetrizedArray(LazyArray):
+    """Symmetrized data, computed from the source data as it is indexed"""
+
+    def __init__(self, data: RegularDataArray, axis: int, center: float, mode: str):
+        self.data = data
+        self.axis = axis
+        self.center = center
+        self.mode = mode
+        self.s0, self.w = reflection(data, axis, center)
+        self.shape = data.shape
+        dtype = data.values.dtype
+        self.dtype = np.dtype(dtype if mode == 'reflect' and not self.w and dtype.kind == 'f' else
+                              np.result_type(dtype, np.float32))
+
+    def _getitem(self, key):
+        k, n = key[self.axis], self.shape[self.axis]
+        if isinstance(k, slice):
+            idx = range(*k.indices(n))
+            if len(idx) == 0:
+                return np.empty([len(range(*s.indices(m))) for s, m in zip(key, self.shape) if isinstance(s, slice)],
+                                dtype=self.dtype)
+            lo = min(idx)
+            stop = idx.stop - lo
+            post = slice(idx.start - lo, stop if stop >= 0 else None, idx.step)
+            region = slice(lo, max(idx) + 1)
+        else:
+            region, post = slice(k, k + 1), 0
+        inner = key[:self.axis] + (region,) + key[self.axis + 1:]
+        block = symmetrize_block(self.data, self.axis, self.s0, self.w, self.mode, inner)
+        dim = sum(isinstance(s, slice) for s in key[:self.axis])
+        return np.asarray(block[(slice(None),)*dim + (post,)], dtype=self.dtype)
@@ -1,8 +1,15 @@
 from .DataMatrix import RegularDataArray
-from .ImageTool import ImageTool
-from .PGImageTool import PGImageTool
+from .CutEngine import CutEngine
+from .Events import EventHistogram
 
-__all__ = ['ImageTool', 'RegularDataArray']
+try:
+    from .ImageTool import ImageTool
+    from .PGImageTool import PGImageTool
+except ImportError:  # headless use without Qt, e.g. CutEngine in worker processes
+    ImageTool = None
+    PGImageTool = None
+
+__all__ = ['ImageTool', 'RegularDataArray', 'CutEngine', 'EventHistogram']
 
 
 def imagetool(data):
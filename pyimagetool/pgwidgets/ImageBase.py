@@ -20,7 +20,7 @@ class ImageBase(pg.PlotItem):
         self.baselut = CMap().load_ct(kwargs.pop('lut', 'blue_orange'))
         self.lut = np.copy(self.baselut)
 
-        self.img = pg.ImageItem(parent=self, lut=self.lut)
+        self.img = TimedImageItem(parent=self, lut=self.lut)
         self.addItem(self.img)
 
         # Create the menu
@@ -125,6 +125,18 @@ class ImageBase(pg.PlotItem):
             ev.ignore()
 
 
+class TimedImageItem(pg.ImageItem):
+    """An ImageItem that reports the time spent painting (including rendering the lookup table) to a profiler"""
+    profiler = None
+    panel = ''
+
+    def paint(self, p, *args):
+        if self.profiler is None or not self.profiler.enabled:
+            return super().paint(p, *args)
+        with self.profiler.panel(self.panel), self.profiler.stage('paint'):
+            return super().paint(p, *args)
+
+
 class AspectRatioForm(object):
     def setupUi(self, Form):
         Form.setObjectName("Form")
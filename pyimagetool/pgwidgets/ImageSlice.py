@@ -11,6 +11,9 @@ from pyimagetool.CMapEditor import CMapDialog
 
 
 class ImageSlice(ImageBase):
+    DisplayImage = 'image'
+    DisplaySecondDerivative = 'second_derivative'
+    DisplayCurvature = 'curvature'
 
     def __init__(self, dat: RegularDataArray = None, **kwargs):
         """2D image view with extra features.
@@ -18,6 +21,9 @@ class ImageSlice(ImageBase):
         :param lut: Name of colormap to initialize with
         :type lut: str
         """
+        self.display_mode = ImageSlice.DisplayImage
+        self.display_params = {}
+        self.source_data: RegularDataArray = None  # the data before the display mode is applied
         super().__init__(dat, **kwargs)
 
         # -------------
@@ -54,6 +60,52 @@ class ImageSlice(ImageBase):
         # self.cmap_editor = QtWidgets.QWidget()
         self.build_cmap_form()
 
+        # ------------
+        # Display menu
+        # ------------
+        self.display_menu = QtWidgets.QMenu('Display')
+        self.display_group = QtWidgets.QActionGroup(self.display_menu)
+        self.display_actions = {}
+        for mode, label in ((ImageSlice.DisplayImage, 'Image'),
+                            (ImageSlice.DisplaySecondDerivative, 'Second derivative'),
+                            (ImageSlice.DisplayCurvature, 'Curvature')):
+            action = QtWidgets.QAction(label, self.display_group)
+            action.setCheckable(True)
+            action.setChecked(mode == self.display_mode)
+            action.triggered.connect(partial(self.set_display_mode, mode))
+            self.display_actions[mode] = action
+            self.display_menu.addAction(action)
+        self.menu.addMenu(self.display_menu)
+
+    def set_data(self, dat: RegularDataArray, calc_tr=True, **kwargs):
+        self.source_data = dat
+        if self.display_mode == ImageSlice.DisplaySecondDerivative:
+            params = dict(axis=1, sigma=1.0, smooth_axis=0, workers=1)
+            params.update(self.display_params)
+            dat = dat.second_derivative(**params)
+        elif self.display_mode == ImageSlice.DisplayCurvature:
+            params = dict(axes=(0, 1), workers=1)
+            params.update(self.display_params)
+            dat = dat.curvature(**params)
+        super().set_data(dat, calc_tr=calc_tr, **kwargs)
+
+    def set_display_mode(self, mode: str, **params):
+        """Show the image itself, its second derivative or its curvature, see
+        :meth:`RegularDataArray.second_derivative` and :meth:`RegularDataArray.curvature`. The image is recomputed
+        from the data whenever it changes.
+
+        :param mode: One of :attr:`DisplayImage`, :attr:`DisplaySecondDerivative` or :attr:`DisplayCurvature`
+        :param params: Keywords of the operation, e.g. ``axis`` and ``sigma`` for the second derivative (along
+            the image's y axis by default), or ``a0`` for the curvature
+        """
+        if mode not in self.display_actions:
+            raise ValueError(f"Unknown display mode {mode}, should be one of {list(self.display_actions)}")
+        self.display_mode = mode
+        self.display_params = params
+        self.display_actions[mode].setChecked(True)
+        if self.source_data is not None:
+            self.set_data(self.source_data, calc_tr=False)
+
     def edit_cmap(self):
         dialog = CMapDialog(self.data)
         r = dialog.exec()
@@ -66,14 +118,18 @@ class ImageSlice(ImageBase):
 
     def cmap_reset(self):
         self.img.setLookupTable(self.baselut)
-        self.img.setLevels([np.min(self.data.values), np.max(self.data.values)])
+        levels = self.data.levels()
+        if np.all(np.isfinite(levels)):
+            self.img.setLevels(list(levels))
 
     def cmap_to_range(self):
         [[xmin, xmax], [ymin, ymax]] = self.vb.viewRange()
-        mat = self.data.sel(slice(xmin, xmax), slice(ymin, ymax)).values
-        if mat.size < 2:
+        dat = self.data.sel(slice(xmin, xmax), slice(ymin, ymax))
+        if dat.values.size < 2:
             return
-        self.img.setLevels([np.min(mat), np.max(mat)])
+        levels = dat.levels()
+        if np.all(np.isfinite(levels)):
+            self.img.setLevels(list(levels))
 
 
 def test():
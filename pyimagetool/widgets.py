@@ -103,6 +103,19 @@ class InfoBar(QtWidgets.QWidget):
             self.cursor_labels[i].setText(data.dims[i])
             self.bin_labels[i].setText(data.dims[i])
 
+    def set_ranges(self, data: RegularDataArray):
+        """Update the ranges of the spin boxes for data of a new extent, without firing their signals"""
+        self.data = data
+        for i in range(data.ndim):
+            for box in (self.cursor_i[i], self.cursor_c[i], self.bin_i[i], self.bin_c[i]):
+                box.blockSignals(True)
+            self.cursor_i[i].setRange(0, data.shape[i] - 1)
+            self.cursor_c[i].setRange(data.coord_min[i], data.coord_max[i])
+            self.bin_i[i].setRange(1, data.shape[i])
+            self.bin_c[i].setRange(data.delta[i], data.coord_max[i] - data.coord_min[i] + data.delta[i])
+            for box in (self.cursor_i[i], self.cursor_c[i], self.bin_i[i], self.bin_c[i]):
+                box.blockSignals(False)
+
     def transpose_clicked(self):
         dialog = TransposeDialog(self.data)
         r = dialog.exec()
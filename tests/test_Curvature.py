@@ -0,0 +1,71 @@
+import numpy as np
+
+from pyimagetool import RegularDataArray
+from pyimagetool.Curvature import smooth_derivatives
+
+
+class TestCurvature:
+    @staticmethod
+    def make_band(n=5):
+        """A parabolic band along y, repeated in n slices"""
+        x = np.linspace(-1, 1, 61)
+        y = np.linspace(-2, 2, 201)
+        img = np.exp(-(y[None, :] - x[:, None]**2)**2/(2*0.2**2))
+        return RegularDataArray(np.stack([img*(k + 1) for k in range(n)]), delta=[1, x[1] - x[0], y[1] - y[0]],
+                                coord_min=[0, x[0], y[0]], dims=('slice', 'x', 'y'))
+
+    def test_second_derivative(self):
+        dat = self.make_band()
+        dy = dat.delta[2]
+        sigma = 3
+        out = dat.second_derivative(2, sigma=sigma, workers=2)
+        # smoothing a Gaussian of width w by s gives a Gaussian of width sqrt(w**2 + s**2)
+        w, s = 0.2, sigma*dy
+        v = w**2 + s**2
+        x, y = dat.axes[1][:, None], dat.axes[2][None, :]
+        u = y - x**2
+        expected = w/np.sqrt(v)*np.exp(-u**2/(2*v))*(u**2/v**2 - 1/v)
+        inner = (slice(None), slice(None), slice(20, -20))
+        np.testing.assert_allclose(out.values[inner], (np.arange(1, 6)[:, None, None]*expected)[inner], atol=1e-4)
+        # the band minimum of the second derivative follows the dispersion
+        assert np.all(np.abs(dat.axes[2][np.argmin(out.values[0], axis=1)] - dat.axes[1]**2) < 2*dy)
+
+    def test_batched_matches_single(self):
+        dat = self.make_band(4)
+        cube = dat.curvature((1, 2), a0=0.5, sigma=2, workers=3)
+        single = RegularDataArray(dat.values[2], delta=dat.delta[1:], coord_min=dat.coord_min[1:])
+        d = smooth_derivatives(dat.values, (1, 2), 2, dat.delta[1:], [(0, 2)], workers=1)[(0, 2)]
+        np.testing.assert_allclose(d[2], single.second_derivative(1, sigma=2, smooth_axis=0).values, atol=1e-9)
+        # the curvature of every slice is independent of the other slices
+        for k in (0, 3):
+            alone = RegularDataArray(dat.values[k], delta=dat.delta[1:], coord_min=dat.coord_min[1:])
+            np.testing.assert_allclose(cube.values[k], alone.curvature((0, 1), a0=0.5, sigma=2).values, atol=1e-9)
+        profile = RegularDataArray(dat.values[1, 7]).curvature(0, a0=0.5, sigma=2)
+        np.testing.assert_allclose(dat.curvature(2, a0=0.5, sigma=2).values[1, 7], profile.values, atol=1e-9)
+        # the curvature is sharper than the band and peaks negative on it
+        curv = cube.values[3]
+        on_band = np.argmin(curv, axis=1)
+        assert np.all(np.abs(dat.axes[2][on_band] - dat.axes[1]**2) < 3*dat.delta[2])
+        assert np.isfinite(curv).all()
+
+    def test_nan(self):
+        dat = self.make_band(2)
+        mat = dat.values.copy()
+        holes = np.zeros(mat.shape, dtype=bool)
+        holes[:, 30, 100] = True
+        holes[:, :, :10] = True  # e.g. outside of the data after a k-space conversion
+        mat[holes] = np.nan
+        holey = RegularDataArray(mat, delta=dat.delta, coord_min=dat.coord_min)
+        curv = holey.curvature((1, 2), sigma=2).values
+        d2 = holey.second_derivative(2, sigma=2, smooth_axis=1).values
+        for out in (curv, d2):
+            assert np.all(np.isnan(out[holes]))
+            assert np.isfinite(out[~holes]).all()
+        # far from the holes the derivatives are unchanged
+        reference = dat.second_derivative(2, sigma=2, smooth_axis=1).values
+        far = (slice(None), slice(None, 20), slice(40, 90))
+        np.testing.assert_allclose(d2[far], reference[far], atol=1e-3*np.abs(reference).max())
+        # masked elements are treated like NaNs
+        masked = RegularDataArray(dat.values, delta=dat.delta, coord_min=dat.coord_min)
+        masked.mask = (~holes).astype(np.uint8)
+        np.testing.assert_allclose(masked.second_derivative(2, sigma=2, smooth_axis=1).values, d2, equal_nan=True)
@@ -0,0 +1,106 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pyimagetool import CutEngine, ImageTool, RegularDataArray
+
+
+def make_data():
+    mat = np.random.default_rng(0).random((6, 5, 7))
+    return RegularDataArray(mat, delta=[0.5, 2, 1], coord_min=[-1, 0, 3], dims=('kx', 'ky', 'energy'))
+
+
+def edc_at(engine, x):
+    engine.set_pos(0, x)
+    return engine.get_cut(2).values
+
+
+class TestCutEngine:
+    def test_matches_gui(self, qtbot):
+        dat = make_data()
+        it = ImageTool(dat)
+        engine = CutEngine(dat)
+        for e in (engine, it.pg_win.cursor):
+            e.set_pos(0, 0.3)
+            e.set_binwidth(0, 1.6)
+            e.set_index(1, 3)
+            e.set_binwidth_i(2, 3)
+        assert engine.get_slice() == it.pg_win.cursor.get_slice()
+        for axis in (0, 1, 2, (0, 1), (2, 1)):
+            np.testing.assert_array_equal(engine.get_cut(axis).values, it.pg_win.cursor.get_cut(axis).values)
+        np.testing.assert_allclose(engine.get_cut(2).values, dat.values[1:5, 3, :].mean(axis=0))
+
+    def test_pickle(self):
+        engine = CutEngine(make_data())
+        engine.set_pos(1, 4.2)
+        engine.set_binwidth(1, 5)
+        clone = pickle.loads(pickle.dumps(engine))
+        assert clone.get_slice() == engine.get_slice()
+        np.testing.assert_array_equal(clone.get_cut((0, 2)).values, engine.get_cut((0, 2)).values)
+
+    def test_threads(self):
+        dat = make_data()
+        positions = dat.axes[0]
+        with ThreadPoolExecutor(4) as pool:
+            edcs = list(pool.map(lambda x: edc_at(CutEngine(dat), x), positions))
+        np.testing.assert_allclose(np.array(edcs), dat.values[:, 0, :])
+
+    def test_get_cuts(self):
+        dat = make_data()
+        engine = CutEngine(dat)
+        rng = np.random.default_rng(1)
+        positions = np.column_stack([rng.uniform(-1.5, 2, 20), rng.uniform(0, 9, 20), rng.uniform(3, 9, 20)])
+        for axis, binwidths in ((2, [1.2, 4.5, 1]), ((0, 2), [0, 6.1, 0]), (1, [0, 0, 0]), (2, None)):
+            cuts = engine.get_cuts(axis, positions, binwidths)
+            assert cuts.dims[0] == 'cut' and cuts.shape[0] == 20
+            for n, pos in enumerate(positions):
+                for i, p in enumerate(pos):
+                    engine.set_pos(i, p)
+                    if binwidths is not None:
+                        engine.set_binwidth(i, binwidths[i])
+                np.testing.assert_allclose(cuts.values[n], engine.get_cut(axis).values)
+
+    def test_get_cuts_masked(self):
+        dat = make_data()
+        dat.values[2, 1, 3] = np.nan
+        dat.set_mask(np.arange(6)[:, None, None] != 4)
+        engine = CutEngine(dat)
+        engine.set_binwidth(0, 2)
+        engine.set_binwidth(1, 4)
+        positions = np.array([[0.5, 2], [1, 6], [-1, 0]])
+        cuts = engine.get_cuts(2, positions)
+        for n, pos in enumerate(positions):
+            engine.set_pos(0, pos[0])
+            engine.set_pos(1, pos[1])
+            np.testing.assert_allclose(cuts.values[n], engine.get_cut(2).values)
+
+    def test_get_cuts_lazy(self):
+        from pyimagetool.LazyArray import IndexedArray
+
+        class CountingArray(IndexedArray):
+            read = 0
+            calls = 0
+
+            def _getitem(self, key):
+                out = super()._getitem(key)
+                CountingArray.read += out.size
+                CountingArray.calls += 1
+                return out
+
+        dat = make_data()
+        dat.values[2, 1, 3] = np.nan
+        dat.values[4, 2, 1] = np.inf  # skipped by neither path
+        lazy = RegularDataArray(CountingArray(dat.values), delta=dat.delta, coord_min=dat.coord_min, dims=dat.dims)
+        positions = np.array([[0.5, 2, 5], [1, 6, 4], [-1, 0, 3]])
+        for binwidths in ([1.2, 4.5, 1], None):
+            expected = CutEngine(dat).get_cuts(2, positions, binwidths).values
+            CountingArray.read = 0
+            np.testing.assert_allclose(CutEngine(lazy).get_cuts(2, positions, binwidths).values, expected)
+            # only the binned slabs are read
+            assert 0 < CountingArray.read <= 3*3*3*7
+        # EDCs along ky at one kx share their slab, which is read once
+        positions = np.stack([np.full(5, 1.0), np.arange(5)*2.0, np.full(5, 3)], axis=1)
+        expected = CutEngine(dat).get_cuts(2, positions, [1.2, 0, 1]).values
+        assert np.isinf(expected).any()
+        CountingArray.calls = 0
+        np.testing.assert_allclose(CutEngine(lazy).get_cuts(2, positions, [1.2, 0, 1]).values, expected)
+        assert CountingArray.calls == 1
@@ -0,0 +1,80 @@
+import pytest
+import numpy as np
+from pyimagetool import ImageTool, EventHistogram
+from pyimagetool.DataMatrix import from_events
+
+
+def make_events(n=10000, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 1, (n, 3))
+
+
+class TestEvents:
+    def test_histogram(self):
+        ev = make_events()
+        delta, coord_min, shape = [0.2, 0.25, 0.5], [-2, -2, -2], (21, 17, 9)
+        hist = from_events(ev, delta, coord_min, shape, dims=('x', 'y', 't'), chunk_size=1000, workers=4)
+        edges = [c0 - d/2 + d*np.arange(n + 1) for d, c0, n in zip(delta, coord_min, shape)]
+        expected, _ = np.histogramdd(ev, bins=edges)
+        assert hist.dims == ('x', 'y', 't')
+        assert hist.data.dtype == np.uint32
+        np.testing.assert_array_equal(hist.data, expected)
+
+    def test_append(self):
+        ev = make_events()
+        eh = EventHistogram(ev[:6000], 0.5, -2, 9, chunk_size=1000)
+        eh.histogram()
+        eh.append(ev[6000:])
+        assert eh.n_events == 10000
+        full = EventHistogram(ev, 0.5, -2, 9, workers=1).histogram()
+        np.testing.assert_array_equal(eh.histogram().data, full.data)
+        delta, coord_min, shape = eh.grid_for(0.25)
+        assert shape == (18, 18, 18)
+        np.testing.assert_allclose(coord_min, -2.125)
+
+    def test_chunk_memory(self):
+        import tracemalloc
+        ev = np.random.default_rng(0).uniform(0, 999, size=(6400, 2))
+        eh = EventHistogram(ev, 1, 0, (1000, 1000), chunk_size=100, workers=4)
+        tracemalloc.start()
+        try:
+            counts = eh.histogram()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert counts.data.sum() == len(ev)
+        # a few int64 grids per thread, however many chunks there are
+        assert peak < 16*8e6
+
+    def test_imagetool_rebin(self, qtbot):
+        eh = EventHistogram(make_events(), 0.5, -2, 9, chunk_size=1000)
+        it = ImageTool(eh)
+        qtbot.addWidget(it)
+        assert it.data.shape == (9, 9, 9)
+        with qtbot.waitSignal(it.events_rebinned, timeout=5000):
+            future = it.rebin_events(0.25)
+        assert future.result().shape == (18, 18, 18)
+        assert it.data.shape == (18, 18, 18)
+        assert it.pg_win.data is it.data
+
+    def test_imagetool_rebin_failure(self, qtbot, monkeypatch):
+        eh = EventHistogram(make_events(), 0.5, -2, 9, chunk_size=1000)
+        it = ImageTool(eh)
+        qtbot.addWidget(it)
+
+        def fail(*args):
+            raise MemoryError("grid too large")
+
+        monkeypatch.setattr(eh, 'histogram', fail)
+        with qtbot.waitSignal(it.events_rebin_failed, timeout=5000) as blocker:
+            it.rebin_events(0.25)
+        assert 'grid too large' in blocker.args[0]
+        assert 'failed' in it.status_bar.currentMessage()
+
+    def test_histogram_dtype(self):
+        eh = EventHistogram(np.zeros((300, 2)), 1, 0, 2)
+        assert eh.histogram().values.dtype == np.uint32
+        assert eh.histogram().values[0, 0] == 300
+        with pytest.raises(OverflowError):
+            eh.histogram(dtype=np.uint8)
+        assert eh.histogram(dtype=float).values[0, 0] == 300
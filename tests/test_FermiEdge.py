@@ -0,0 +1,54 @@
+import numpy as np
+
+from pyimagetool import RegularDataArray
+from pyimagetool import FermiEdge
+
+
+def gold(edge, e=np.linspace(-0.3, 0.15, 226), n_scan=4, kt=0.003, noise=0.01):
+    """Fermi edges at ``edge`` along the first axis, a scan axis, and energy along the last axis"""
+    edcs = (1 - 0.5*(e[None, :] - edge[:, None]))/(np.exp((e[None, :] - edge[:, None])/kt) + 1) + 0.05
+    mat = np.repeat(edcs[:, None, :], n_scan, axis=1)
+    mat = mat + np.random.default_rng(0).normal(scale=noise, size=mat.shape)
+    return RegularDataArray(mat, delta=[0.5, 1, e[1] - e[0]], coord_min=[-15, 0, e[0]], dims=('angle', 'scan', 'energy'))
+
+
+class TestFermiEdge:
+    def test_fit_edges(self):
+        angle = np.arange(61)*0.5 - 15
+        edge = 0.02 + 3e-5*angle**2
+        dat = gold(edge)
+        fits = FermiEdge.fit_edges(dat, energy_axis=2, sum_axes=1, workers=2)
+        assert fits['ef'].dims == ('angle',) and fits['ef'].shape == (61,)
+        assert fits['converged'].values.all()
+        np.testing.assert_allclose(fits['ef'].values, edge, atol=1e-3)
+        np.testing.assert_allclose(fits['width'].values, 0.003, rtol=0.2)
+        # a quadratic through the fitted edges is closer to the truth than the fits themselves
+        smooth = FermiEdge.smooth_edge(fits['ef'], order=2, converged=fits['converged'])
+        assert np.abs(smooth.values - edge).max() < np.abs(fits['ef'].values - edge).max()
+        np.testing.assert_allclose(smooth.values, edge, atol=2e-4)
+        blurred = FermiEdge.smooth_edge(fits['ef'], sigma=2)
+        assert np.isfinite(blurred.values).all()
+        # the edge map keeps irregular channel coordinates
+        irregular = RegularDataArray(dat.values[:5], coords=[[0, 1, 2, 4, 8], None, None], delta=dat.delta,
+                                     coord_min=dat.coord_min, dims=dat.dims)
+        fits = FermiEdge.fit_edges(irregular, energy_axis=2, sum_axes=1)
+        np.testing.assert_allclose(fits['ef'].axes[0], [0, 1, 2, 4, 8])
+        np.testing.assert_allclose(FermiEdge.smooth_edge(fits['ef'], sigma=1).axes[0], [0, 1, 2, 4, 8])
+
+    def test_correct(self):
+        angle = np.arange(61)*0.5 - 15
+        edge = 0.02 + 3e-5*angle**2
+        dat = gold(edge)
+        corrected = FermiEdge.correct(dat, energy_axis=2, sum_axes=(1,), fermi_level=0, order=2)
+        assert corrected.shape == dat.shape and corrected.dims == dat.dims
+        np.testing.assert_allclose(corrected.coord_min, dat.coord_min)
+        # every channel now has its edge at zero, and the energies shifted in from above are NaN
+        refit = FermiEdge.fit_edges(corrected, energy_axis=2, sum_axes=1)
+        np.testing.assert_allclose(refit['ef'].values, 0, atol=1e-3)
+        assert np.isnan(corrected.values[0, 0, -1]) and not np.isnan(corrected.values[..., 0]).any()
+        # integer offsets move the EDCs exactly
+        step = dat.delta[2]
+        small = RegularDataArray(dat.values[:2], delta=dat.delta, coord_min=dat.coord_min)
+        moved = FermiEdge.shift_channels(small, np.array([[2*step], [-step]]), energy_axis=2)
+        np.testing.assert_allclose(moved.values[0, :, :-2], small.values[0, :, 2:])
+        np.testing.assert_allclose(moved.values[1, :, 1:], small.values[1, :, :-1])
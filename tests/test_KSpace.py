@@ -0,0 +1,51 @@
+import numpy as np
+
+from pyimagetool import RegularDataArray
+from pyimagetool.KSpace import KSpaceConverter, converter_for, convert, K_FACTOR
+
+
+class TestKSpace:
+    @staticmethod
+    def make_cube():
+        """Angle data whose value is the ky momentum of each (alpha, beta, Ek) point, plus 2*kx"""
+        alpha = np.linspace(-12, 10, 45)
+        beta = np.linspace(-8, 9, 35)
+        energy = np.linspace(16.5, 17, 11)
+        a, b, e = np.meshgrid(np.deg2rad(alpha - 1), np.deg2rad(beta), energy, indexing='ij')
+        k0 = K_FACTOR*np.sqrt(e)
+        mat = 2*k0*np.sin(a) + k0*np.cos(a)*np.sin(b)
+        return RegularDataArray(mat, delta=[alpha[1] - alpha[0], beta[1] - beta[0], energy[1] - energy[0]],
+                                coord_min=[alpha[0], beta[0], energy[0]], dims=('alpha', 'beta', 'eV'))
+
+    def test_convert(self):
+        dat = self.make_cube()
+        out = convert(dat, slit_offset=1, workers=3)
+        assert out.dims == ('kx', 'ky', 'eV') and out.shape[2] == 11
+        np.testing.assert_allclose(out.axes[2], dat.axes[2])
+        kx, ky = np.meshgrid(out.axes[0], out.axes[1], indexing='ij')
+        inside = ~np.isnan(out.values)
+        # most of the momentum grid is covered, and the values there are the momenta
+        assert inside.mean() > 0.8
+        np.testing.assert_allclose(out.values[inside], np.broadcast_to((2*kx + ky)[..., None], out.shape)[inside],
+                                   atol=2e-4)
+        # the converter of the same grid and geometry is reused, with its tables
+        assert converter_for(dat, slit_offset=1, workers=3) is converter_for(dat, slit_offset=1, workers=3)
+
+    def test_lazy_view(self):
+        dat = self.make_cube()
+        converter = KSpaceConverter(dat.transpose([2, 1, 0]), slit_axis=2, energy_axis=0)
+        assert converter.dims == ('eV', 'ky', 'kx')
+        full = converter.convert(dat.transpose([2, 1, 0]))
+        view = converter.view(dat.transpose([2, 1, 0]))
+        np.testing.assert_allclose(view.values[3], full.values[3])
+        np.testing.assert_allclose(view.values[:, 10, 4:30], full.values[:, 10, 4:30])
+        np.testing.assert_allclose(view.values[5, 10, 20], full.values[5, 10, 20])
+        # angle-energy images convert to momentum-energy
+        cut = RegularDataArray(dat.values[:, 17], delta=dat.delta[[0, 2]], coord_min=dat.coord_min[[0, 2]])
+        line = convert(cut, slit_offset=1)
+        assert line.ndim == 2 and line.dims[0] == 'kx'
+        kx = line.axes[0][:, None]
+        inside = ~np.isnan(line.values)
+        k0 = K_FACTOR*np.sqrt(line.axes[1])[None, :]
+        expected = 2*kx + np.sqrt(k0**2 - kx**2)*np.sin(np.deg2rad(dat.axes[1][17]))
+        np.testing.assert_allclose(line.values[inside], np.broadcast_to(expected, line.shape)[inside], atol=2e-4)
@@ -0,0 +1,43 @@
+import gc
+import numpy as np
+from pyimagetool import RegularDataArray
+from pyimagetool.MemoryBudget import MemoryBudget, budget
+
+
+class Owner:
+    pass
+
+
+class TestMemoryBudget:
+    def test_lru_across_owners(self):
+        mb = MemoryBudget(limit=250)
+        a, b = Owner(), Owner()
+        mb.put(a, 'cut', 0, np.zeros(10))  # 80 bytes
+        mb.put(b, 'cut', 0, np.zeros(10))
+        mb.put(a, 'stats', 0, np.zeros(10))
+        assert mb.usage() == 240
+        assert mb.usage(a) == 160
+        assert mb.usage_by_category(a) == {'cut': 80, 'stats': 80}
+        mb.get(a, 'cut', 0)  # now b's entry is the least recently used
+        mb.put(b, 'cut', 1, np.zeros(10))
+        assert mb.get(b, 'cut', 0) is None
+        assert mb.get(a, 'cut', 0) is not None
+        mb.put(a, 'huge', 0, np.zeros(100))
+        assert mb.get(a, 'huge', 0) is None
+        mb.limit = 100
+        assert mb.usage() <= 100
+
+    def test_owner_collected(self):
+        mb = MemoryBudget(limit=1000)
+        a = Owner()
+        assert mb.get_or_compute(a, 'cut', 0, lambda: np.ones(5))[0] == 1
+        assert mb.usage() == 40
+        del a
+        gc.collect()
+        assert mb.usage() == 0
+
+    def test_interpolator(self):
+        dat = RegularDataArray(np.arange(12.).reshape(3, 4))
+        assert np.allclose(dat.interp([[0.5, 1]]), [3])
+        assert dat.interpolator[0] == 'linear'
+        assert budget.usage(dat) > 0
@@ -0,0 +1,105 @@
+import numpy as np
+
+from pyimagetool import RegularDataArray
+from pyimagetool.PeakFit import fit_peaks, fit_curves, PeakFitter
+
+
+def mdcs(centers, widths, k=np.linspace(-1, 1, 161), amplitude=2.0, background=0.3, noise=0.0, seed=0):
+    """Lorentzian cuts along the last axis, one per element of ``centers``"""
+    u = k - np.asarray(centers)[..., None]
+    w = np.asarray(widths)[..., None]
+    y = amplitude*w**2/(u**2 + w**2) + background
+    return y + np.random.default_rng(seed).normal(scale=noise, size=y.shape)
+
+
+class TestPeakFit:
+    def test_fit_peaks(self):
+        e = np.linspace(-0.5, 0, 60)
+        centers = 0.4 + 1.2*e[:, None] + 0.05*np.linspace(-1, 1, 7)[None, :]  # (energy, angle scan)
+        widths = 0.03 + 0.1*e[:, None]**2 + 0*centers
+        dat = RegularDataArray(mdcs(centers, widths, noise=0.01), delta=[e[1] - e[0], 1, 2/160],
+                               coord_min=[e[0], 0, -1], dims=('energy', 'scan', 'kx'))
+        dat.values[3, 2, 40:45] = np.nan
+        result = dat.fit_peaks(2, workers=2)
+        assert result['center'].shape == (60, 7) and result['center'].dims == ('energy', 'scan')
+        np.testing.assert_allclose(result['center'].coord_min, [e[0], 0])
+        assert result['converged'].values.all()
+        np.testing.assert_allclose(result['center'].values, centers, atol=2e-3)
+        np.testing.assert_allclose(result['fwhm'].values, 2*widths, rtol=0.05)
+        np.testing.assert_allclose(result['amplitude'].values, 2, rtol=0.05)
+        np.testing.assert_allclose(result['background'].values, 0.3, atol=0.02)
+        assert result.curves().shape == dat.shape
+        # two Gaussian peaks, with a trailing peak axis
+        k = np.linspace(-1, 1, 201)
+        y = np.exp(-(k + 0.4)**2/(2*0.05**2)) + 0.6*np.exp(-(k - 0.3)**2/(2*0.08**2))
+        two = fit_peaks(RegularDataArray(np.stack([y, y[::-1]]), delta=[1, 0.01], coord_min=[0, -1]), 1, n_peaks=2,
+                        model='gaussian')
+        assert two['center'].dims[-1] == 'peak'
+        np.testing.assert_allclose(np.sort(two['center'].values, axis=1), [[-0.4, 0.3], [-0.3, 0.4]], atol=1e-4)
+
+    def test_warm_start(self):
+        k = np.linspace(-1, 1, 161)
+        centers = np.linspace(-0.5, 0.5, 200)
+        params, chi2, converged = fit_curves(k, mdcs(centers, 0.05, k, noise=0.02))
+        assert converged.all()
+        # the next scan has moved a little; starting from the last results gets closer in the same iterations
+        y = mdcs(centers + 0.003, 0.05, k, noise=0.02, seed=1)
+        best = fit_curves(k, y)[0]
+        cold = fit_curves(k, y, max_iter=2)[0]
+        warm = fit_curves(k, y, initial=params, max_iter=2)[0]
+        assert np.all(np.abs(warm - best).max(axis=0) < np.abs(cold - best).max(axis=0))
+        # the fitter follows a moving peak, refitting from its previous results
+        fitter = PeakFitter()
+        for c in (0.1, 0.12, 0.14):
+            result = fitter.fit(RegularDataArray(mdcs(c, 0.05, k), delta=[k[1] - k[0]], coord_min=[-1]), 0)
+            np.testing.assert_allclose(result['center'].values, c, atol=1e-6)
+
+    def test_missing_cuts(self):
+        k = np.linspace(-1, 1, 161)
+        y = mdcs([0.1, 0.2, 0.3, -0.2], 0.05, k)
+        y[1] = np.nan  # e.g. outside of the data after a k-space conversion
+        y[2, 3:] = np.nan  # fewer points than the 5 parameters
+        dat = RegularDataArray(y, delta=[1, k[1] - k[0]], coord_min=[0, -1])
+        for initial in (None, fit_peaks(dat, 1).params):
+            result = fit_peaks(dat, 1, initial=initial)
+            np.testing.assert_array_equal(result['converged'].values, [True, False, False, True])
+            assert np.isnan(result.params[1:3]).all() and np.isnan(result['chi2'].values[1:3]).all()
+            np.testing.assert_allclose(result['center'].values[[0, 3]], [0.1, -0.2], atol=1e-6)
+
+    def test_track_peak(self):
+        k = np.linspace(-1, 1, 201)
+        e = np.linspace(-0.4, 0, 41)
+        band = 0.5 + 1.5*e  # a linear dispersion, off the grid almost everywhere
+        y = np.exp(-(k[:, None] - band[None, :])**2/(2*0.04**2))[:, :, None]*np.array([1, 2, 3])
+        dat = RegularDataArray(y, delta=[0.01, 0.01, 1], coord_min=[-1, -0.4, 0], dims=('k', 'e', 'scan'))
+        dat.values[:, 5, 1] = np.nan
+        for method, tol in (('parabolic', 1e-3), ('centroid', 3e-3)):
+            position, amplitude = dat.track_peak(0, window=5, method=method)
+            assert position.dims == ('e', 'scan') and position.shape == (41, 3)
+            np.testing.assert_allclose(position.coord_min, [-0.4, 0])
+            expected = np.repeat(band[:, None], 3, axis=1)
+            expected[5, 1] = np.nan
+            np.testing.assert_allclose(position.values, expected, atol=tol)
+        np.testing.assert_allclose(amplitude.values[:, 2], 3, rtol=0.02)
+        # dips, and a search range that leaves out the strongest maximum
+        position, amplitude = RegularDataArray(-dat.values, delta=dat.delta, coord_min=dat.coord_min).track_peak(
+            0, minimum=True)
+        np.testing.assert_allclose(amplitude.values[:, 0], -1, rtol=0.02)
+        twin = RegularDataArray(y[:, :, 0] + 0.5*np.exp(-(k[:, None] + 0.8)**2/(2*0.04**2)), delta=[0.01, 0.01],
+                                coord_min=[-1, -0.4])
+        position, _ = twin.track_peak(0, search=(-1, -0.5))
+        np.testing.assert_allclose(position.values, -0.8, atol=1e-3)
+
+    def test_irregular_axes(self):
+        # peaks along an irregular axis, cut at irregular positions of another axis
+        t = np.array([0, 1, 2, 4, 8, 16.0])
+        scan = np.array([0, 0.5, 2, 5])
+        y = np.exp(-(t[None, :] - 5.5)**2/(2*2.0**2))*(1 + scan[:, None])
+        dat = RegularDataArray(y, coords=[scan, t], dims=('scan', 't'))
+        position, amplitude = dat.track_peak(1)
+        np.testing.assert_allclose(position.axes[0], scan)
+        # the parabola through (2, 4, 8) peaks at index 3.145, between the coordinates 4 and 8
+        np.testing.assert_allclose(position.values, 4 + 4*0.145, atol=0.01)
+        result = dat.fit_peaks(1, model='gaussian')
+        np.testing.assert_allclose(result['center'].axes[0], scan)
+        np.testing.assert_allclose(result['center'].values, 5.5, atol=1e-6)
@@ -0,0 +1,93 @@
+import numpy as np
+from scipy import ndimage, signal
+
+from pyimagetool import RegularDataArray
+from pyimagetool.MemoryBudget import budget
+from pyimagetool.Pipeline import (Pipeline, BoxSmooth, GaussianSmooth, SavitzkyGolay, Derivative, Normalize,
+                                  SubtractBackground)
+
+
+class CountingSmooth(GaussianSmooth):
+    calls = 0
+    elements = 0
+
+    def apply(self, block, region, data):
+        CountingSmooth.calls += 1
+        CountingSmooth.elements += block.size
+        return super().apply(block, region, data)
+
+
+class TestPipeline:
+    @staticmethod
+    def make_data():
+        mat = np.random.default_rng(0).normal(size=(20, 25, 30)) + 5
+        return RegularDataArray(mat, delta=[0.1, 0.2, 0.05], coord_min=[0, -2, 1], dims=('x', 'y', 'eV'))
+
+    def test_regions_match_full(self):
+        dat = self.make_data()
+        mat = dat.values
+        pipe = Pipeline(dat, [BoxSmooth(0, 4), GaussianSmooth(1, 1.5), SavitzkyGolay(2, 7, 2, deriv=1),
+                              Derivative(0, 2), SubtractBackground(-1, lo=2, hi=2.3), Normalize(2, 'max')])
+        full = ndimage.uniform_filter1d(mat, 4, axis=0, mode='nearest')
+        full = ndimage.gaussian_filter1d(full, 1.5, axis=1, mode='nearest')
+        full = signal.savgol_filter(full, 7, 2, deriv=1, delta=0.05, axis=2, mode='interp')
+        full = np.gradient(np.gradient(full, 0.1, axis=0), 0.1, axis=0)
+        full = full - full[:, :, 20:27].mean(axis=2, keepdims=True)
+        full = full/full.max(axis=2, keepdims=True)
+        out = pipe.output().values
+        np.testing.assert_allclose(out[3, :, 4:20], full[3, :, 4:20])
+        np.testing.assert_allclose(out[:, 24], full[:, 24])
+        np.testing.assert_allclose(out[5:2:-1, 1, ::3], full[5:2:-1, 1, ::3])
+        np.testing.assert_allclose(np.asarray(out), full)
+
+    def test_savgol_ends(self):
+        dat = self.make_data()
+        for axis in (0, 2):
+            out = Pipeline(dat, [SavitzkyGolay(axis, 7, 2)]).output().values
+            full = signal.savgol_filter(dat.values, 7, 2, axis=axis, mode='interp')
+            n = dat.shape[axis]
+            for i in (0, 1, 2, n - 3, n - 2, n - 1):
+                key = (slice(None),)*axis + (i,)
+                np.testing.assert_allclose(out[key], full[key])
+            key = (slice(None),)*axis + (slice(n - 2, n),)
+            np.testing.assert_allclose(out[key], full[key])
+
+    def test_memoized_stages(self):
+        dat = self.make_data()
+        budget.clear()
+        pipe = Pipeline(dat, [CountingSmooth(2, 2), Normalize(0)])
+        out = pipe.output()
+        smooth = ndimage.gaussian_filter1d(dat.values, 2, axis=2, mode='nearest')
+        CountingSmooth.calls = 0
+        np.testing.assert_allclose(out.values[:, 3, 4], smooth[:, 3, 4]/smooth[:, 3, 4].max())
+        assert CountingSmooth.calls == 1
+        # repeated cuts and changes to later stages reuse the smoothed data
+        out.values[:, 3, 4]
+        pipe.set_params(1, mode='mean')
+        np.testing.assert_allclose(out.values[:, 3, 4], smooth[:, 3, 4]/smooth[:, 3, 4].mean())
+        assert CountingSmooth.calls == 1
+        pipe.set_params(0, sigma=1)
+        out.values[:, 3, 4]
+        assert CountingSmooth.calls == 2
+        # switching back finds the earlier results
+        pipe.set_params(0, sigma=2)
+        np.testing.assert_allclose(pipe.output(0).values[:, 3, 4], smooth[:, 3, 4])
+        assert CountingSmooth.calls == 2
+
+    def test_imagetool_stage(self, qtbot):
+        from pyimagetool import ImageTool
+        dat = self.make_data()
+        pipe = Pipeline(dat, [CountingSmooth(2, 2), Derivative(2)])
+        it = ImageTool(pipe)
+        qtbot.addWidget(it)
+        smooth = ndimage.gaussian_filter1d(dat.values, 2, axis=2, mode='nearest')
+        z = it.pg_win.cursor.get_index(2)
+        np.testing.assert_allclose(it.get('xy').values, np.gradient(smooth, 0.05, axis=2)[:, :, z])
+        it.show_stage(0)
+        np.testing.assert_allclose(it.get('xy').values, smooth[:, :, z])
+        CountingSmooth.elements = 0
+        it.set_stage_params(0, sigma=1)
+        smooth = ndimage.gaussian_filter1d(dat.values, 1, axis=2, mode='nearest')
+        np.testing.assert_allclose(it.get('xy').values, smooth[:, :, z])
+        # only the displayed cuts were smoothed, never the whole cube
+        assert 0 < CountingSmooth.elements < dat.values.size/4
@@ -146,3 +146,263 @@ class TestImageTool:
         np.testing.assert_almost_equal(it.pg_win.lineplots_data['y'][0].xData, dat.values[0, :, 0])
         np.testing.assert_almost_equal(it.pg_win.lineplots_data['z'][0].xData,
                                        np.mean(dat.values[0:1, 0:2, :], axis=(0, 1)))
+
+    def test_imagetool_nan(self, qtbot):
+        mat = self.make_numpy_data().astype(float)
+        mat[1, 0, 0] = np.nan
+        it = ImageTool(mat)
+        assert np.isnan(mat[1, 0, 0])
+        it.info_bar.bin_i[0].setValue(3)
+        np.testing.assert_almost_equal(it.pg_win.lineplots_data['z'][0].xData,
+                                       np.nanmean(mat[0:2, 0:1, :], axis=(0, 1)))
+
+    def test_imagetool_profiler(self, qtbot):
+        dat = self.make_regular_data()
+        it = ImageTool(dat, layout=ImageTool.LayoutComplete)
+        qtbot.addWidget(it)
+        it.show_timings()
+        it.info_bar.cursor_i[2].setValue(1)
+        summary = it.profiler.summary()
+        assert summary['xy']['get_cut']['n'] == 1
+        assert summary['x']['mean']['n'] == 1
+        it.update_timings()
+        assert 'xy' in it.timing_label.text()
+        counts, _ = it.profiler.histogram('xy', 'set_data')
+        assert counts.sum() == 1
+        it.show_timings(False)
+        it.info_bar.cursor_i[2].setValue(0)
+        assert it.profiler.summary()['xy']['get_cut']['n'] == 1
+
+    def test_imagetool_signal_tracer(self, qtbot):
+        from pyimagetool.SignalTracer import SignalTracer
+        dat = self.make_regular_data()
+        it = ImageTool(dat)
+        with SignalTracer() as tracer:
+            with tracer.action('move z'):
+                it.pg_win.cursor.set_index(2, 1)
+        emissions = tracer.emissions()
+        assert emissions['Cursor.index[2]'] == 1
+        assert emissions['Cursor.pos[2]'] == 1
+        assert emissions['Cursor.changed'] == 1
+        assert tracer.slot_calls()['PGImageTool.update_cuts'] == 1
+        assert 'emit Cursor.index[2]' in tracer.dump()
+        with SignalTracer() as tracer:
+            it.pg_win.cursor.set_index(2, 1)
+        assert sum(tracer.emissions().values()) == 0
+
+    def test_imagetool_cursor_batch(self, qtbot):
+        dat = self.make_regular_data()
+        it = ImageTool(dat, layout=ImageTool.LayoutComplete)
+        cursor = it.pg_win.cursor
+        changes = []
+        cursor.changed.connect(changes.append)
+        it.profiler.enabled = True
+        with cursor.batch():
+            cursor.set_pos(0, 4.2)
+            cursor.set_pos(1, 5.9)
+        assert changes == [{'pos': (0, 1), 'index': (0, 1), 'slice': (0, 1)}]
+        assert cursor.get_index(0) == 2 and cursor.get_index(1) == 1
+        summary = it.profiler.summary()
+        assert summary['xz']['get_cut']['n'] == 1 and summary['zy']['get_cut']['n'] == 1
+        assert 'xy' not in summary
+        np.testing.assert_almost_equal(it.pg_win.lineplots_data['z'][0].yData, dat.values[2, 1, :])
+        # moving within the same index changes nothing that is displayed
+        cursor.set_pos(0, 4.1)
+        assert changes[-1] == {'pos': (0,)}
+        assert it.profiler.summary()['xz']['get_cut']['n'] == 1
+
+    def test_imagetool_live(self, qtbot):
+        from pyimagetool.RingBuffer import RingBuffer
+        rng = np.random.default_rng(0)
+        ring = RingBuffer((6, 5), capacity=8, axis=2, delta=[1, 1, 0.5], dims=('x', 'y', 't'))
+        for _ in range(3):
+            ring.append(rng.normal(size=(6, 5)))
+        it = ImageTool(ring, layout=ImageTool.LayoutComplete)
+        qtbot.addWidget(it)
+        cursor = it.pg_win.cursor
+        cursor.set_pos(0, 2)
+        cursor.set_pos(2, 0.5)
+        it.profiler.enabled = True
+        for _ in range(3):
+            it.append(rng.normal(size=(6, 5)))
+        # the cursor stays put, and only the cuts along t are recomputed since the cursor is at t = 0.5
+        assert cursor.get_pos(0) == 2 and cursor.get_pos(2) == 0.5
+        summary = it.profiler.summary()
+        assert set(summary) == {'z', 'xz', 'zy'}
+        assert summary['z']['get_cut']['n'] == 3
+        assert it.data.shape == (6, 5, 6) and it.info_bar.cursor_i[2].maximum() == 5
+        # once frames scroll out, the time axis moves but the cursor keeps its time
+        for _ in range(3):
+            it.append(rng.normal(size=(6, 5)))
+        assert it.data.shape == (6, 5, 8) and it.data.coord_min[2] == 0.5
+        assert cursor.get_pos(2) == 0.5 and cursor.get_index(2) == 0
+        assert it.info_bar.cursor_i[2].value() == 0
+        np.testing.assert_almost_equal(it.get('z')[1], it.data.values[2, 0, :])
+        np.testing.assert_almost_equal(it.get('xy').values, it.data.values[:, :, 0])
+
+    def test_imagetool_append(self, qtbot):
+        dat = self.make_regular_data()
+        dat.levels()
+        it = ImageTool(dat, layout=ImageTool.LayoutComplete)
+        qtbot.addWidget(it)
+        it.pg_win.cursor.set_index(0, 1)
+        it.append(np.full((1, 2, 2), 20.0), axis=0)
+        assert it.data.shape == (5, 2, 2) and it.data.coord_max[0] == 8
+        assert it.data._levels == (0, 20)
+        assert it.pg_win.cursor.get_index(0) == 1
+        np.testing.assert_almost_equal(it.get('x')[1], it.data.values[:, 0, 0])
+        # a stream of frames fills a buffer that only reallocates when full
+        expected = it.data.values.copy()
+        buffers = set()
+        for n in range(40):
+            it.append(np.full((2, 2), float(n)), axis=0)
+            buffers.add(id(it._append_buffers['values'][0]))
+            expected = np.concatenate([expected, np.full((1, 2, 2), float(n))])
+        np.testing.assert_array_equal(it.data.values, expected)
+        assert len(buffers) <= 3 and np.shares_memory(it.data.values, it._append_buffers['values'][0])
+
+    def test_imagetool_append_mask(self, qtbot):
+        dat = self.make_regular_data()
+        mask = np.ones(dat.shape, dtype=bool)
+        mask[1, 0, 1] = False
+        dat.set_mask(mask)
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        for n in range(20):
+            it.append(np.full((2, 2), float(n)), axis=0)
+        expected = np.concatenate([mask, np.ones((20, 2, 2), dtype=bool)])
+        np.testing.assert_array_equal(it.data.mask, expected)
+        assert np.shares_memory(it.data.mask, it._append_buffers['mask'][0])
+        kept = np.delete(it.data.values[:, 0, 1], 1)
+        np.testing.assert_allclose(it.data.mean(0).values[0, 0, 1], kept.mean())
+        # a detector mask broadcast along the appended axis keeps broadcasting
+        dat.set_mask(mask[:1] & np.array([[True, False], [True, True]]))
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        it.append(np.zeros((3, 2, 2)), axis=0)
+        assert it.data.mask.shape == (1, 2, 2) and not it.data.mask[0, 0, 1]
+        # other axes keep their coordinates, and an irregular axis can not be extended
+        # (the constructor regularizes, but notify_region_changed takes any data)
+        it.data = RegularDataArray(np.zeros((2, 2, 3)), coords=[None, None, [0, 1, 5]])
+        it.append(np.zeros((2, 3)), axis=0)
+        np.testing.assert_array_equal(it.data.axes[2], [0, 1, 5])
+        with pytest.raises(ValueError):
+            it.append(np.zeros((3, 2)), axis=2)
+
+    def test_imagetool_kspace(self, qtbot):
+        from pyimagetool.data import arpes_data_3d
+        from pyimagetool.KSpace import converter_for
+        dat = arpes_data_3d()
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        it.show_kspace(slit_axis=1)
+        assert it.data.dims[:2] == ('ky', 'kx')
+        full = converter_for(dat, slit_axis=1).convert(dat)
+        z = it.pg_win.cursor.get_index(2)
+        np.testing.assert_allclose(it.get('xy').values, full.values[:, :, z])
+        it.show_kspace(False)
+        assert it.data.dims == dat.dims and not it.views
+
+    def test_imagetool_display_mode(self, qtbot):
+        from pyimagetool.data import arpes_data_3d
+        dat = arpes_data_3d()
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        img = it.pg_win.imgs['xy']
+        raw = img.data
+        img.set_display_mode(img.DisplaySecondDerivative, sigma=2)
+        np.testing.assert_allclose(img.data.values, raw.second_derivative(1, sigma=2, smooth_axis=0).values)
+        it.pg_win.cursor.set_index(2, 10)
+        np.testing.assert_allclose(img.source_data.values, dat.values[:, :, 10])
+        np.testing.assert_allclose(img.data.values, img.source_data.second_derivative(1, sigma=2, smooth_axis=0).values)
+        img.set_display_mode(img.DisplayImage)
+        np.testing.assert_allclose(img.data.values, dat.values[:, :, 10])
+
+    def test_imagetool_fit_overlay(self, qtbot):
+        k = np.linspace(-1, 1, 101)
+        centers = np.linspace(-0.3, 0.3, 20)
+        mat = 1/(1 + ((k[:, None] - centers[None, :])/0.1)**2)
+        dat = RegularDataArray(np.repeat(mat[:, :, None], 3, axis=2), delta=[k[1] - k[0], 1, 1], coord_min=[-1, 0, 0])
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        win = it.pg_win
+        win.set_fit_overlay(panels=['x'])
+        curve, fitter = win.fit_overlays['x']
+        np.testing.assert_allclose(fitter.result['center'].values, centers[0], atol=1e-6)
+        np.testing.assert_allclose(curve.yData, mat[:, 0], atol=1e-6)
+        win.cursor.set_index(1, 7)
+        np.testing.assert_allclose(fitter.result['center'].values, centers[7], atol=1e-6)
+        win.set_fit_overlay(False)
+        assert not win.fit_overlays
+
+    def test_imagetool_peak_overlay(self, qtbot):
+        k = np.linspace(-1, 1, 101)
+        e = np.linspace(-0.4, 0, 21)
+        band = 0.5 + 1.5*e
+        mat = np.exp(-(k[:, None, None] - band[None, :, None] - 0.02*np.arange(4))**2/(2*0.05**2))
+        dat = RegularDataArray(mat, delta=[k[1] - k[0], e[1] - e[0], 1], coord_min=[-1, -0.4, 0])
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        win = it.pg_win
+        win.set_peak_overlay(panels=['xy'], window=5)
+        points, _ = win.peak_overlays['xy']
+        np.testing.assert_allclose(points.xData, band, atol=1e-3)
+        np.testing.assert_allclose(points.yData, e, atol=1e-9)
+        win.cursor.set_index(2, 3)
+        np.testing.assert_allclose(points.xData, band + 0.06, atol=1e-3)
+        with pytest.raises(ValueError):
+            win.set_peak_overlay(panels=['xy'], axis=2)
+        win.set_peak_overlay(False)
+        assert not win.peak_overlays
+
+    def test_imagetool_symmetrize(self, qtbot):
+        from pyimagetool.data import arpes_data_3d
+        dat = arpes_data_3d()
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        center = dat.axes[0][len(dat.axes[0])//2] + 0.3*dat.delta[0]
+        it.show_symmetrized(axis=0, center=center)
+        full = dat.symmetrize(0, center)
+        z = it.pg_win.cursor.get_index(2)
+        np.testing.assert_allclose(it.get('xy').values, full.values[:, :, z], atol=1e-5)
+        it.show_symmetrized(False)
+        assert not it.views and isinstance(it.data.values, np.ndarray)
+
+    def test_imagetool_nested_views(self, qtbot):
+        from pyimagetool.data import arpes_data_3d
+        dat = arpes_data_3d()
+        it = ImageTool(dat)
+        qtbot.addWidget(it)
+        original = it.data
+        # symmetrizing momentum space about the default center, then going back to the angles
+        it.show_kspace(slit_axis=1)
+        kspace = it.data
+        it.show_symmetrized(axis=1)
+        assert [name for name, _ in it.views] == ['kspace', 'symmetrize']
+        assert np.isfinite(it.get('xy').values).any()
+        it.show_kspace(False)
+        assert it.data is original and not it.views
+        it.show_symmetrized(False)  # already gone with the momentum view under it
+        assert it.data is original
+        # removing the outer view goes back to the inner one
+        it.show_kspace(slit_axis=1)
+        it.show_symmetrized(axis=1)
+        it.show_symmetrized(False)
+        assert [name for name, _ in it.views] == ['kspace'] and it.data.dims == kspace.dims
+        it.show_kspace(False)
+        # the other way around, and a view that can not be made leaves the views as they were
+        it.show_symmetrized(axis=0, center=dat.axes[0][10])
+        it.show_kspace(slit_axis=1)
+        symmetrized = it.views[1][1]
+        with pytest.raises(ValueError):
+            it.show_symmetrized(mode='nonsense')
+        assert [name for name, _ in it.views] == ['symmetrize', 'kspace'] and it.views[1][1] is symmetrized
+        it.show_symmetrized(False)
+        assert it.data is original and not it.views
+
+    def test_imagetool_memmap(self, qtbot, tmp_path):
+        from pyimagetool.DataMatrix import load
+        self.make_regular_data().save(tmp_path / 'scan.pit')
+        it = ImageTool(load(tmp_path / 'scan.pit'))
+        qtbot.addWidget(it)
+        assert isinstance(it.data.values, np.memmap)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from pyimagetool import RegularDataArray
+from pyimagetool.Registration import estimate_shifts, apply_shifts, align
+
+
+def blobs(shifts, shape=(64, 80)):
+    """Frames of two Gaussian blobs displaced by ``shifts``, stacked along the last axis"""
+    x, y = np.arange(shape[0])[:, None], np.arange(shape[1])[None, :]
+    frames = []
+    for sx, sy in shifts:
+        frames.append(np.exp(-((x - 30 - sx)**2 + (y - 35 - sy)**2)/(2*4.0**2)) +
+                      0.5*np.exp(-((x - 15 - sx)**2 + (y - 55 - sy)**2)/(2*3.0**2)))
+    return np.stack(frames, axis=-1)
+
+
+class TestRegistration:
+    def test_estimate_shifts(self):
+        rng = np.random.default_rng(0)
+        true = np.cumsum(rng.normal(scale=0.4, size=(40, 2)), axis=0)
+        true -= true[0]
+        stack = blobs(true)
+        shifts = estimate_shifts(stack, axis=-1, reference=0, workers=3)
+        np.testing.assert_allclose(shifts, true, atol=0.1)
+
+    def test_align(self):
+        true = np.array([[0, 0], [1.5, -2.25], [-3.3, 0.7], [2, 4]])
+        dat = RegularDataArray(blobs(true), delta=[0.5, 0.5, 1], dims=('x', 'y', 'frame'))
+        aligned, shifts = align(dat, axis=2, reference=0)
+        assert aligned.dims == dat.dims and aligned.shape == dat.shape
+        inner = (slice(8, -8), slice(8, -8))
+        for k in range(len(true)):
+            np.testing.assert_allclose(aligned.values[inner + (k,)], dat.values[inner + (0,)], atol=0.02)
+        # elements shifted in from outside of a frame are NaN
+        assert np.isnan(aligned.values[:, -1, 3]).all() and not np.isnan(aligned.values[..., 0]).any()
+        # integer shifts move frames exactly
+        moved = apply_shifts(np.arange(12.0).reshape(2, 6), [[2], [-1]], axis=0)
+        np.testing.assert_array_equal(moved[0, :4], [2, 3, 4, 5])
+        np.testing.assert_array_equal(moved[1, 1:], [6, 7, 8, 9, 10])
+        # NaNs spread only to the elements interpolated from them
+        holey = np.array([[0, 1, 2, np.nan, 4, 5]]*3)
+        moved = apply_shifts(holey, [[0], [1], [0.5]], axis=0)
+        np.testing.assert_array_equal(moved[0], holey[0])
+        np.testing.assert_array_equal(moved[1], [1, 2, np.nan, 4, 5, np.nan])
+        np.testing.assert_array_equal(moved[2], [0.5, 1.5, np.nan, np.nan, 4.5, np.nan])
+        np.testing.assert_array_equal(apply_shifts([[0, 1, 2, 3, np.nan, 5]], [[0]]), [[0, 1, 2, 3, np.nan, 5]])
+
+    def test_nan_frames(self):
+        true = np.array([[0, 0], [1.5, -2.25], [-3.3, 0.7], [2, 4], [0, 0]])
+        stack = blobs(true)
+        stack[:10, :, 1] = np.nan  # e.g. a detector region that dropped out
+        stack[..., 4] = np.nan
+        with pytest.warns(UserWarning, match=r'\[4\]'):
+            shifts = estimate_shifts(stack, axis=-1)
+        np.testing.assert_allclose(shifts[:4] - shifts[0], true[:4], atol=0.1)
+        assert np.isnan(shifts[4]).all()
+        assert np.isnan(apply_shifts(stack, shifts, axis=-1)[..., 4]).all()
+        # masked elements are left out like NaNs, here a bright spot on every frame but the first
+        dat = RegularDataArray(blobs(true[:4]), dims=('x', 'y', 'frame'))
+        dat.values[50:54, 5:9, 1:] = 10
+        dat.mask = np.ones(dat.shape, dtype=np.uint8)
+        dat.mask[50:54, 5:9, :] = 0
+        np.testing.assert_allclose(estimate_shifts(dat, axis=2, reference=0), true[:4], atol=0.1)
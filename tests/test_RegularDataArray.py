@@ -124,3 +124,245 @@ class TestRegularDataArray:
         assert dat_mean.coord_min[1] == pytest.approx(11.0)
         assert np.allclose(dat_mean.values, dat.values.mean(axis=(0,1)).reshape(1, 1))
 
+
+    def test_nan(self):
+        mat = np.arange(20, dtype=float).reshape(4, 5)
+        mat[1, 2] = np.nan
+        mat[:, 4] = np.nan
+        dat = RegularDataArray(mat)
+        assert dat.has_nan
+        assert not self.make_2d().has_nan
+        dat_mean = dat.mean(0)
+        assert np.allclose(dat_mean.values[0, :4], np.nanmean(mat[:, :4], axis=0))
+        assert np.isnan(dat_mean.values[0, 4])
+        assert dat.levels() == (0.0, 18.0)
+        assert not dat.isel(slice(None), slice(0, 2)).has_nan
+        assert np.isnan(mat[1, 2])
+
+    def test_mask(self):
+        mat = np.arange(24, dtype=float).reshape(2, 3, 4)
+        pixels = np.array([[True, False, True], [True, True, True]])
+        dat = RegularDataArray(mat, mask=pixels[:, :, None])
+        expected = np.ma.array(mat, mask=~np.broadcast_to(pixels[:, :, None], mat.shape))
+        assert np.allclose(dat.mean((0, 1)).values.ravel(), expected.mean(axis=(0, 1)))
+        assert np.allclose(dat.isel(slice(None), slice(1, 3), 2).mean(1).values.ravel(),
+                           expected[:, 1:3, 2].mean(axis=1))
+        assert np.isnan(dat.isel(0, 1, None).mean(2).values).all()
+        assert dat.isel(0, 1, None).squeeze().mask.shape == (1,)
+        assert dat.transpose([2, 0, 1]).mask.shape == (1, 2, 3)
+        weighted = RegularDataArray(mat, mask=np.array([1., 3.]).reshape(2, 1, 1))
+        assert np.allclose(weighted.mean(0).values.ravel(), ((mat[0] + 3*mat[1])/4).ravel())
+        # NaNs are skipped with their weight, also when the weighted sum is taken in slabs
+        holey = mat.copy()
+        holey[1, 0, 0] = np.nan
+        weighted = RegularDataArray(holey, mask=np.array([1., 3.]).reshape(2, 1, 1))
+        assert weighted.mean(0).values[0, 0, 0] == 0
+        assert np.allclose(weighted.mean((1, 2)).values.ravel(), [mat[0].mean(), mat[1].ravel()[1:].mean()])
+        assert np.allclose(weighted.coarsen((2, 1, 2)).values[0, 0], [(1 + 3*13)/5, (2 + 3 + 3*(14 + 15))/8])
+        from pyimagetool.DataMatrix import _weighted_mean
+        np.testing.assert_allclose(_weighted_mean(holey, weighted.mask, (1, 2), True, slab_size=1),
+                                   weighted.mean((1, 2)).values.ravel())
+        flags = RegularDataArray(mat > 20, mask=pixels[:, :, None])
+        assert flags.levels() == (0.0, 1.0)
+        assert flags.isel(0, None, None).levels() == (0.0, 0.0)
+        assert dat.levels() == (0.0, 23.0)
+        dat.set_mask(mat < 10)
+        assert dat.levels() == (0.0, 9.0)
+        with pytest.raises(ValueError):
+            dat.set_mask(pixels)
+
+    def test_coarsen(self):
+        dat = self.make_2d()
+        dat_co = dat.coarsen(2)
+        assert dat_co.shape == (2, 2)
+        assert np.allclose(dat_co.values, dat.values[:4, :4].reshape(2, 2, 2, 2).mean(axis=(1, 3)))
+        assert np.allclose(dat_co.delta, [6, 10])
+        assert np.allclose(dat_co.coord_min, [7.5, 3.5])
+        dat.set_mask(np.array([True, False, True, True]).reshape(4, 1))
+        dat_co = dat.coarsen((2, 1))
+        assert np.allclose(dat_co.values[0], dat.values[0])
+        assert np.allclose(dat_co.values[1], dat.values[2:4].mean(axis=0))
+
+    def test_npy_stack(self, tmp_path):
+        from pyimagetool import CutEngine
+        from pyimagetool.DataMatrix import from_npy_stack
+        rng = np.random.default_rng(0)
+        full = rng.normal(size=(12, 5, 6))
+        for k in range(12):
+            np.save(tmp_path / f'step{k}.npy', full[k])
+        dat = from_npy_stack(tmp_path, delta=[1, 0.5, 0.2], dims=('step', 'x', 'y'), max_open=4)
+        stack = dat.values
+        assert dat.shape == (12, 5, 6) and RegularDataArray(dat).values is stack
+        np.testing.assert_array_equal(stack[3:7, :, 2], full[3:7, :, 2])
+        np.testing.assert_array_equal(stack[10], full[10])
+        tr = dat.transpose([2, 0, 1])
+        np.testing.assert_array_equal(tr.values[1, 4:9], full.transpose(2, 0, 1)[1, 4:9])
+        np.testing.assert_array_equal(np.asarray(tr.values), full.transpose(2, 0, 1))
+        # a cut binned along the stacking axis opens only the frames in the bin
+        stack._open.clear()
+        stack.frames_opened = 0
+        engine = CutEngine(dat)
+        engine.set_pos(0, 5)
+        engine.set_binwidth(0, 3)
+        np.testing.assert_allclose(engine.get_cut((1, 2)).values, full[4:7].mean(axis=0))
+        assert stack.frames_opened == 3
+
+    def test_save_load(self, tmp_path):
+        from pyimagetool.DataMatrix import load
+        mat = np.random.default_rng(0).normal(size=(7, 5, 3)).astype(np.float32)
+        mask = np.ones((7, 5, 1), dtype=bool)
+        mask[2, 3] = False
+        dat = RegularDataArray(mat, delta=[0.1, 2, 1/3], coord_min=[-1.25, 3, np.pi], dims=('kx', 'ky', 'eV'),
+                               name='scan 1', mask=mask)
+        dat.save(tmp_path / 'scan.pit')
+        out = load(tmp_path / 'scan.pit')
+        assert isinstance(out.values, np.memmap) and out.values.offset % 4096 == 0
+        np.testing.assert_array_equal(out.values, mat)
+        assert out.values.dtype == np.float32
+        np.testing.assert_array_equal(out.mask, mask)
+        assert out.delta.tolist() == [0.1, 2, 1/3] and out.coord_min.tolist() == [-1.25, 3, np.pi]
+        assert out.dims == ('kx', 'ky', 'eV') and out.name == 'scan 1'
+        # copies, e.g. the one ImageTool makes, keep a read-only map instead of loading the file
+        assert RegularDataArray(out).values is out.values
+        writable = load(tmp_path / 'scan.pit', mmap_mode='r+')
+        assert not np.shares_memory(RegularDataArray(writable).values, writable.values)
+        in_memory = load(tmp_path / 'scan.pit', mmap_mode=None)
+        assert not isinstance(in_memory.values, np.memmap)
+        np.testing.assert_array_equal(in_memory.values, mat)
+        with open(tmp_path / 'other.npy', 'wb') as f:
+            np.save(f, mat)
+        with pytest.raises(ValueError):
+            load(tmp_path / 'other.npy')
+
+    def test_xarray_zero_copy(self):
+        xr = pytest.importorskip('xarray')
+        from pyimagetool.DataMatrix import from_xarray
+        mat = np.random.default_rng(0).normal(size=(6, 5, 4))
+        coords = {'x': np.arange(6)*0.5, 'y': 1 + np.arange(5), 'z': np.arange(4)*0.25}
+        xdat = xr.DataArray(mat, dims=('x', 'y', 'z'), coords=coords)
+        dat = from_xarray(xdat)
+        assert np.shares_memory(dat.values, mat)
+        assert not np.shares_memory(RegularDataArray(xdat).values, mat)
+        out = dat.to_xarray()
+        assert np.shares_memory(out.values, mat) and out.dims == ('x', 'y', 'z')
+        np.testing.assert_allclose(out['x'].values, coords['x'])
+
+    def test_dask(self):
+        xr = pytest.importorskip('xarray')
+        da = pytest.importorskip('dask.array')
+        from pyimagetool import CutEngine
+        from pyimagetool.DataMatrix import from_xarray
+        mat = np.random.default_rng(0).normal(size=(8, 6, 10))
+        computed = []
+
+        def record(block, block_info=None):
+            computed.append(block_info[0]['chunk-location'])
+            return block
+
+        lazy = da.from_array(mat, chunks=(2, 6, 5)).map_blocks(record, dtype=float)
+        dat = from_xarray(xr.DataArray(lazy, dims=('x', 'y', 'z'),
+                                       coords={'x': np.arange(8), 'y': np.arange(6), 'z': np.arange(10)}))
+        assert not computed
+        engine = CutEngine(RegularDataArray(dat))
+        engine.set_pos(0, 3)
+        engine.set_pos(2, 7)
+        np.testing.assert_allclose(engine.get_cut(1).values, mat[3, :, 7])
+        assert computed == [(1, 0, 1)]
+        assert dat.to_xarray().chunks is not None
+
+    def test_nonuniform(self):
+        from pyimagetool import CutEngine
+        from pyimagetool.Resample import resample_axis
+        energy = np.concatenate([np.linspace(-1, 0, 11), np.linspace(0.05, 0.5, 10)])
+        k = np.linspace(-0.5, 0.5, 5)
+        mat = np.add.outer(np.arange(5.0), 2*energy)
+        dat = RegularDataArray(mat, dims=('k', 'eV'), coords=[k, energy])
+        assert dat.is_regular(0) and not dat.is_regular(1)
+        np.testing.assert_array_equal(dat.axes[1], energy)
+        assert dat.index_to_scale(1, 12) == energy[12]
+        assert dat.scale_to_index(1, 0.1) == 12
+        cut = dat.isel(None, slice(5, 15)).mean(0).squeeze()
+        np.testing.assert_array_equal(cut.axes[0], energy[5:15])
+        # cursor bins use the real coordinates
+        engine = CutEngine(dat)
+        engine.set_pos(1, 0.1)
+        engine.set_binwidth(1, 0.12)
+        assert engine.get_index_slice(1) == slice(11, 14)
+        lo, hi = engine.get_cuts(0, [[0, 0.1]]).values, mat[:, 11:14].mean(axis=1)
+        np.testing.assert_allclose(lo[0], hi)
+        # resampling is exact for linear data
+        reg = dat.regularize(delta=[None, 0.05])
+        assert reg.is_regular() and reg.shape == (5, 31)
+        np.testing.assert_allclose(reg.values, np.add.outer(np.arange(5.0), 2*reg.axes[1]))
+        big = np.random.default_rng(0).normal(size=(300, 64, 80))
+        src = np.sort(np.random.default_rng(1).uniform(0, 1, 80))
+        dst = np.linspace(src[0], src[-1], 100)
+        np.testing.assert_allclose(resample_axis(big, 2, src, dst, workers=4),
+                                   np.apply_along_axis(lambda f: np.interp(dst, src, f), 2, big))
+        # descending coordinates are flipped like negative deltas
+        flipped = RegularDataArray(mat[:, ::-1], coords=[k, energy[::-1]])
+        np.testing.assert_array_equal(flipped.values, mat)
+        np.testing.assert_array_equal(flipped.axes[1], energy)
+
+    def test_regrid(self):
+        rng = np.random.default_rng(2)
+        dat = RegularDataArray(rng.normal(size=(20, 30, 25)), delta=[0.1, 0.05, 0.2], coord_min=[0, -1, 3])
+        new_delta, new_min, new_shape = [0.07, 0.05, 0.13], [0.05, -1, 2.9], [25, 30, 40]
+        out = dat.regrid(new_delta, new_min, new_shape)
+        assert out.shape == tuple(new_shape)
+        np.testing.assert_allclose(out.delta, new_delta)
+        np.testing.assert_allclose(out.coord_min, new_min)
+        pts = np.stack(np.meshgrid(*out.axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        expected = dat.interp(pts).reshape(new_shape)
+        np.testing.assert_allclose(out.values, expected, equal_nan=True)
+        # points outside of the data are NaN, like interp
+        assert np.isnan(out.values[:, :, 0]).all()
+        nearest = dat.regrid(new_delta, new_min, new_shape, method='nearest')
+        inside = ~np.isnan(expected)
+        np.testing.assert_allclose(nearest.values[inside], dat.interp(pts, 'nearest').reshape(new_shape)[inside])
+        # the default grid keeps the coordinate range
+        assert dat.regrid([0.05, 0.05, 0.1]).shape == (39, 30, 49)
+        np.testing.assert_array_equal(dat.regrid().values, dat.values)
+        # grid points on a node keep its value next to masked or NaN nodes
+        line = RegularDataArray(np.arange(10.0))
+        line.mask = np.ones(10, dtype=np.uint8)
+        line.mask[3] = 0
+        fine = line.regrid([0.5], [0], [19]).values
+        np.testing.assert_array_equal(fine[:10], [0, 0.5, 1, 1.5, 2, np.nan, np.nan, np.nan, 4, 4.5])
+        np.testing.assert_array_equal(fine[-1], 9)
+        holey = RegularDataArray(np.where(np.arange(10) == 8, np.nan, np.arange(10.0)))
+        np.testing.assert_array_equal(holey.regrid([0.5], [0], [19]).values[-3:], [np.nan, np.nan, 9])
+
+    def test_symmetrize(self):
+        rng = np.random.default_rng(3)
+        dat = RegularDataArray(rng.normal(size=(6, 41, 5)), delta=[1, 0.05, 1], coord_min=[0, -1.2, 0])
+        i = np.arange(41)
+        for center in (-0.2, -0.2137, 0.3):
+            out = dat.symmetrize(1, center)
+            s = 2*dat.scale_to_index(1, center)  # mirror in index space, as coordinates round at the ends
+            mirror = np.apply_along_axis(lambda f: np.interp(s - i, i, f, left=np.nan, right=np.nan), 1, dat.values)
+            expected = np.where(np.isnan(mirror), dat.values, (dat.values + mirror)/2)
+            np.testing.assert_allclose(out.values, expected, atol=1e-12)
+            np.testing.assert_allclose(dat.symmetrize(1, center, 'sum').values, dat.values + mirror, atol=1e-12)
+            # the lazy view computes the same values for any cut
+            lazy = dat.symmetrize(1, center, lazy=True)
+            np.testing.assert_allclose(lazy.values[2, 3:30:4, 1], expected[2, 3:30:4, 1], atol=1e-12)
+            np.testing.assert_allclose(lazy.values[:, ::-1][:, 7], expected[:, -8], atol=1e-12)
+            np.testing.assert_allclose(np.asarray(lazy.values), expected, atol=1e-12)
+        # reflecting about the middle of the axis is a view of the data
+        flipped = dat.symmetrize(1, 0.0 - 0.2, 'reflect')
+        assert np.shares_memory(flipped.values, dat.values)
+        np.testing.assert_array_equal(flipped.values, dat.values[:, ::-1])
+        far = dat.symmetrize(1, 5.0, 'reflect')
+        assert np.isnan(far.values).all()
+        # mirror planes whose reflection misses the axis entirely, on either side
+        short = RegularDataArray(rng.normal(size=(3, 20)), delta=[1, 0.1], coord_min=[0, 0])
+        for center in (2.5, 5.0, -0.5, 2.37):
+            for lazy in (False, True):
+                avg = short.symmetrize(1, center, lazy=lazy)
+                assert avg.shape == short.shape
+                np.testing.assert_allclose(np.asarray(avg.values), short.values)
+                np.testing.assert_allclose(np.asarray(avg.values)[:, 5:9], short.values[:, 5:9])
+                for mode in ('sum', 'reflect'):
+                    out = np.asarray(short.symmetrize(1, center, mode, lazy=lazy).values)
+                    assert out.shape == short.shape and np.isnan(out).all()
@@ -0,0 +1,51 @@
+import threading
+import numpy as np
+from pyimagetool.RingBuffer import RingBuffer
+
+
+class TestRingBuffer:
+    def test_append(self):
+        ring = RingBuffer((3, 4), capacity=5, axis=2, delta=[1, 1, 0.5], coord_min=[0, 0, 10], dims=('x', 'y', 't'))
+        assert ring.snapshot() is None
+        buffer = ring._buffer
+        for n in range(1, 40):
+            ring.append(np.full((3, 4), n))
+            snap = ring.snapshot()
+            held = np.arange(max(1, n - 4), n + 1)
+            assert snap.shape == (3, 4, len(held))
+            assert snap.dims == ('x', 'y', 't')
+            np.testing.assert_array_equal(snap.data[0, 0], held)
+            assert snap.coord_min[2] == 10 + 0.5*(held[0] - 1)
+            assert not snap.data.flags.writeable
+        assert ring._buffer is buffer
+        assert ring.count == 39 and len(ring) == 5
+
+    def test_snapshot_stays_valid(self):
+        ring = RingBuffer((2,), capacity=4)
+        for n in range(30):
+            ring.append([n, n])
+            snap = ring.snapshot()
+            expected = snap.data.copy()
+            for m in range(ring.capacity):
+                ring.append([-1, -1])
+                assert ring.is_current(snap)
+                np.testing.assert_array_equal(snap.data, expected)
+            ring.clear()
+
+    def test_writer_thread(self):
+        ring = RingBuffer((16, 16), capacity=50)
+
+        def writer():
+            for n in range(2000):
+                ring.append(np.full((16, 16), n))
+
+        t = threading.Thread(target=writer)
+        t.start()
+        while t.is_alive():
+            snap = ring.snapshot()
+            if snap is not None:
+                frames = snap.data[:, 0, 0].copy()
+                if ring.is_current(snap):
+                    np.testing.assert_array_equal(np.diff(frames), 1)
+        t.join()
+        np.testing.assert_array_equal(ring.snapshot().data[:, 0, 0], np.arange(1950, 2000))
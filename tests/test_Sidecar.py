@@ -0,0 +1,81 @@
+import json
+import numpy as np
+from pyimagetool import RegularDataArray, CutEngine
+from pyimagetool.MemoryBudget import budget
+from pyimagetool.Sidecar import Sidecar, attach, fingerprint, sidecar_path
+
+
+def make_data(seed=0):
+    mat = np.random.default_rng(seed).normal(size=(20, 15, 10))
+    mat[3, 4, 5] = np.nan
+    return RegularDataArray(mat, delta=[0.1, 0.2, 0.5], dims=('x', 'y', 'z'))
+
+
+class TestSidecar:
+    def test_roundtrip(self, tmp_path):
+        path = tmp_path / 'scan.npy'
+        data = make_data()
+        engine = CutEngine(data)
+        engine.set_binwidth(1, 0.6)
+        expected = engine.get_cuts(0, [[0, 1.0, 2.0], [0, 2.0, 3.0]], [0, 0.6, 1.0]).values
+        sidecar, loaded, future = attach(data, path, background=False)
+        assert not loaded
+        future.result()
+        assert json.load(open(sidecar_path(path) + '/manifest.json'))['statistics']['has_nan']
+
+        reopened = make_data()
+        sidecar, loaded, future = attach(reopened, path)
+        assert loaded and future is None
+        assert reopened._has_nan is True and reopened._levels == data.levels()
+        # the rebuild built the tables of the line cuts along every axis
+        tables = dict(budget.items(reopened, 'prefix_sum'))
+        assert set(tables) == {(1, 2), (0, 2), (0, 1)}
+        for total, weight in tables.values():
+            assert isinstance(total, np.memmap) and isinstance(weight, np.memmap)
+        edcs = CutEngine(reopened).get_cuts(2, [[0, 0.5], [1.0, 2.0]], [0.3, 0.6]).values
+        np.testing.assert_allclose(edcs, CutEngine(data).get_cuts(2, [[0, 0.5], [1.0, 2.0]], [0.3, 0.6]).values)
+        assert set(dict(budget.items(reopened, 'prefix_sum'))) == set(tables)
+        cuts = CutEngine(reopened).get_cuts(0, [[0, 1.0, 2.0], [0, 2.0, 3.0]], [0, 0.6, 1.0]).values
+        np.testing.assert_allclose(cuts, expected)
+        # saving again keeps the memory-mapped files and does not rewrite them
+        files = sorted(p.name for p in (tmp_path / 'scan.npy.pyimagetool').iterdir())
+        sidecar.save(reopened)
+        assert sorted(p.name for p in (tmp_path / 'scan.npy.pyimagetool').iterdir()) == files
+
+    def test_stale(self, tmp_path):
+        path = tmp_path / 'scan.npy'
+        attach(make_data(), path, background=False)
+        changed = make_data(seed=1)
+        assert fingerprint(changed) != fingerprint(make_data())
+        sidecar, loaded, future = attach(changed, path)
+        assert not loaded
+        future.result()
+        assert Sidecar(path).is_current(changed)
+        assert not Sidecar(path).is_current(make_data())
+
+    def test_file_edits(self, tmp_path):
+        import os
+        path = tmp_path / 'scan.npy'
+        np.save(path, make_data().values)
+        data = RegularDataArray(np.load(path, mmap_mode='r'), delta=[0.1, 0.2, 0.5], copy=False)
+        attach(data, path, background=False)
+        assert Sidecar(path).is_current(data)
+        # an edit that no sampled block covers still makes the sidecar stale, through the file's mtime
+        def sampled():
+            return fingerprint(RegularDataArray(np.array(np.load(path)), delta=[0.1, 0.2, 0.5]))
+
+        before = sampled()
+        edited = np.load(path, mmap_mode='r+')
+        edited[2, 7, 3] += 1  # slab 2 is not among the sampled slabs
+        edited.flush()
+        del edited
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert sampled() == before
+        reopened = RegularDataArray(np.load(path, mmap_mode='r'), delta=[0.1, 0.2, 0.5], copy=False)
+        assert not Sidecar(path).is_current(reopened)
+        # data in memory only is hashed in full
+        memory = make_data()
+        attach(memory, tmp_path / 'other.npy', background=False)
+        memory.values[1, 7, 3] += 1
+        assert not Sidecar(tmp_path / 'other.npy').is_current(memory)